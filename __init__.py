@@ -21,8 +21,11 @@ import os
 import json
 import time
 import re
+import html
 import shlex
 import copy
+import bisect
+import functools
 import unicodedata
 import logging
 import tempfile
@@ -39,6 +42,7 @@ from types import MethodType
 
 from aqt import mw
 from aqt.qt import *
+from aqt import gui_hooks
 from aqt.gui_hooks import card_layout_will_show
 from aqt.clayout import CardLayout
 from aqt.addons import AddonManager
@@ -47,6 +51,13 @@ from aqt.clayout import CardLayout
 from aqt.theme import theme_manager
 from bs4 import BeautifulSoup, Comment
 
+from .syntax_rules import shared_scanners, RuleProfile, RuleGuard, audit_rules, FALLBACK_RULES, HIGHLIGHTING_RULES, HIGHLIGHTING_RULES_COMM
+from . import lexer
+from .spans import SpanStats, SpanCache, coalesce_spans, read_span_file, write_span_file
+from .css_colors import named_color, convert_color_to_hex
+from .brackets import BracketIndex, BRACKET_PAIRS
+from .elements import ElementIndex
+
 # ========================= PYQT_VERSION ======================================
 try:
     from PyQt6.QtWidgets import (
@@ -65,8 +76,8 @@ try:
         QLineEdit,
         QStyledItemDelegate        
     )    
-    from PyQt6.QtGui import QTextDocument, QTextOption, QGuiApplication, QTextCharFormat, QColor, QFont, QSyntaxHighlighter, QTextCursor, QPainter, QTextFormat
-    from PyQt6.QtCore import QRegularExpression, Qt, QSize, QEvent, QTimer, QCoreApplication   
+    from PyQt6.QtGui import QTextBlockUserData, QTextDocument, QTextOption, QGuiApplication, QTextCharFormat, QColor, QFont, QSyntaxHighlighter, QTextCursor, QPainter, QTextFormat
+    from PyQt6.QtCore import Qt, QPoint, QSize, QEvent, QTimer, QCoreApplication   
     pyqt_version = "PyQt6"
 except ImportError:
     from PyQt5.QtWidgets import (
@@ -85,8 +96,8 @@ except ImportError:
         QLineEdit,
         QStyledItemDelegate        
     )
-    from PyQt5.QtGui import QTextDocument, QTextOption, QGuiApplication, QTextCharFormat, QColor, QFont, QSyntaxHighlighter, QTextCursor, QPainter, QTextFormat
-    from PyQt5.QtCore import QRegExp, Qt, QSize, QEvent, QTimer, QCoreApplication
+    from PyQt5.QtGui import QTextBlockUserData, QTextDocument, QTextOption, QGuiApplication, QTextCharFormat, QColor, QFont, QSyntaxHighlighter, QTextCursor, QPainter, QTextFormat
+    from PyQt5.QtCore import Qt, QPoint, QSize, QEvent, QTimer, QCoreApplication
     pyqt_version = "PyQt5"
 
 if pyqt_version == "PyQt6":    
@@ -287,6 +298,30 @@ theme_night = True if theme_manager.night_mode else False
 themeName = configF("GLOBAL_SETTINGS", "theme", "MODERN")
 auto_insert = config["GLOBAL_SETTINGS"]["auto_insert"]
 auto_completion = config["GLOBAL_SETTINGS"]["auto_completion"]
+# =ru= с какого размера изменения сначала раскрашиваются видимые строки, а остальные в простое (0 - выкл.)
+lazy_highlighting_min_chars = config["GLOBAL_SETTINGS"].get("lazy_highlighting_min_chars", 30000)
+# =ru= длинные (минифицированные) строки раскрашиваются упрощенно: только строки и комментарии (0 - выкл.)
+long_line_min_chars = config["GLOBAL_SETTINGS"].get("long_line_min_chars", 10000)
+long_line_budget_ms = config["GLOBAL_SETTINGS"].get("long_line_budget_ms", 30)
+# =ru= кэш готовых отрезков строк (при переключении сторон и карточек не раскрашивать заново; 0 - выкл.)
+span_cache_max_lines = config["GLOBAL_SETTINGS"].get("span_cache_max_lines", 100000)
+span_cache_max_mb = config["GLOBAL_SETTINGS"].get("span_cache_max_mb", 32)
+# =ru= сколько из кэша отрезков сохранять на диск при закрытии окна, чтобы завтра не раскрашивать заново (0 - выкл.)
+span_cache_disk_mb = config["GLOBAL_SETTINGS"].get("span_cache_disk_mb", 8)
+# =ru= профилирование правил подсветки (время каждого прохода, см. Ctrl+Shift+F4)
+profile_highlighting = config["GLOBAL_SETTINGS"].get("profile_highlighting", False)
+# =ru= сколько миллисекунд на строку можно опасному (с перебором) правилу, дольше - на длинных строках его замена (0 - выкл.)
+rule_budget_ms = config["GLOBAL_SETTINGS"].get("rule_budget_ms", 5)
+# =ru= свой документ для каждой стороны карточки и стиля: переключение без повторной раскраски, с историей отмены
+template_documents = config["GLOBAL_SETTINGS"].get("template_documents", True)
+# =ru= после открытия окна в простое раскрашивать остальные стороны, карточки и стиль в кэш отрезков
+prewarm_templates = config["GLOBAL_SETTINGS"].get("prewarm_templates", True)
+# =ru= при правке сразу только синтаксис, украшения (образцы цветов, особые пробелы) видимым строкам через столько мс (0 - сразу)
+decoration_delay_ms = config["GLOBAL_SETTINGS"].get("decoration_delay_ms", 150)
+# =ru= через столько мс после смены выделения пометить его вхождения на экране (0 - только по F4)
+occurrence_delay_ms = config["GLOBAL_SETTINGS"].get("occurrence_delay_ms", 250)
+# =ru= подчеркивать незакрытые и лишние закрывающие теги (по дереву элементов)
+mark_unclosed_tags = config["GLOBAL_SETTINGS"].get("mark_unclosed_tags", True)
 languageName = configF("GLOBAL_SETTINGS", "language", "en")
 current_language = anki.lang.current_lang #en, pr-BR, en-GB, ru и подобное 
 if not languageName: # если надо автоопределение       
@@ -349,6 +384,7 @@ def custom_update_current_ordinal_and_redraw(self, idx: int) -> None:
 paste_without_tab_replace = False
 def on_card_layout_will_show(card_layout: CardLayout):    
     global thisCardLayout, gl_model_name, template_name, theme_night, colors, html_js_highlighting_addon, original_update_current_ordinal_and_redraw   
+    load_span_cache() # раскраска с прошлого сеанса
     if theme_manager.night_mode: # определям темная или светлая тема
         theme_night = True
     else:
@@ -530,6 +566,33 @@ def on_card_layout_will_show(card_layout: CardLayout):
 # Подключаем хук
 card_layout_will_show.append(on_card_layout_will_show)
 
+
+def on_theme_did_change():
+    """=ru= Сменился ночной режим Anki: подменяем таблицы подсветки открытого редактора шаблонов"""
+    global theme_night, colors
+    theme_night = True if theme_manager.night_mode else False
+    if theme_night:
+        colors = config["THEMES"][themeName]["DARK_MODE"]
+    else:
+        colors = config["THEMES"][themeName]["LIGHT_MODE"]
+    try:
+        if thisCardLayout is not None:
+            edit_area = thisCardLayout.tform.edit_area
+            pool = getattr(edit_area, "document_pool", None)
+            if pool is not None:
+                for highlighter in pool.highlighters():
+                    highlighter.update_theme()
+            highlighter = getattr(edit_area, "highlighter", None)
+            if highlighter is not None:
+                highlighter.update_theme()
+    except RuntimeError: # окно уже закрыто
+        pass
+    except Exception as e:
+        logError(e)
+
+if hasattr(gui_hooks, "theme_did_change"): # в старых версиях Anki такого хука нет
+    gui_hooks.theme_did_change.append(on_theme_did_change)
+
 def CtrlF4():
     global thisCardLayout    
     thisCardLayout.topAreaForm.templatesBox.setFocus()
@@ -573,87 +636,6 @@ CardLayout.setupShortcuts = custom_CardLayout_setupShortcuts
 # =============================================================================
 
 
-def convert_color_to_hex(color: str) -> str:
-    """
-    Конвертирует цвет из форматов rgb(), rgba(), hsl(), hsla() в #RRGGBB или #AARRGGBB.
-    Если формат не распознан, возвращает исходное значение.
-    """
-    # Регулярные выражения для rgb/rgba
-    rgb_regex = re.compile(r'rgb\(\s*(\d{1,3})\s*,\s*(\d{1,3})\s*,\s*(\d{1,3})\s*\)')
-    rgba_regex = re.compile(r'rgba\(\s*(\d{1,3})\s*,\s*(\d{1,3})\s*,\s*(\d{1,3})\s*,\s*(0|1|0?\.\d+)\s*\)')
-
-    # Регулярные выражения для hsl/hsla
-    hsl_regex = re.compile(r'hsl\(\s*(\d{1,3})\s*,\s*(\d{1,3})%\s*,\s*(\d{1,3})%\s*\)')
-    hsla_regex = re.compile(r'hsla\(\s*(\d{1,3})\s*,\s*(\d{1,3})%\s*,\s*(\d{1,3})%\s*,\s*(0|1|0?\.\d+)\s*\)')
-
-    # Проверяем rgb
-    match = rgb_regex.match(color)
-    if match:
-        r, g, b = map(int, match.groups())
-        return f"#{r:02X}{g:02X}{b:02X}"
-
-    # Проверяем rgba
-    match = rgba_regex.match(color)
-    if match:
-        r, g, b = map(int, match.groups()[:3])
-        a = float(match.group(4))
-        alpha = int(a * 255)        
-        return f"#{alpha:02X}{r:02X}{g:02X}{b:02X}"
-
-    # Проверяем hsl
-    match = hsl_regex.match(color)
-    if match:
-        h, s, l = map(int, match.groups())
-        r, g, b = hsl_to_rgb(h, s / 100, l / 100)
-        return f"#{r:02X}{g:02X}{b:02X}"
-
-    # Проверяем hsla
-    match = hsla_regex.match(color)
-    if match:
-        h, s, l = map(int, match.groups()[:3])
-        a = float(match.group(4))
-        r, g, b = hsl_to_rgb(h, s / 100, l / 100)
-        alpha = int(a * 255)
-        return f"#{alpha:02X}{r:02X}{g:02X}{b:02X}"
-
-    # Если формат не распознан, возвращаем исходное значение
-    return color
-
-def hsl_to_rgb(h, s, l):
-    """
-    Преобразует HSL в RGB.
-    h: Hue (0-360)
-    s: Saturation (0-1)
-    l: Lightness (0-1)
-    Возвращает кортеж (r, g, b) с компонентами в диапазоне 0-255.
-    """
-    c = (1 - abs(2 * l - 1)) * s
-    x = c * (1 - abs((h / 60) % 2 - 1))
-    m = l - c / 2
-
-    if 0 <= h < 60:
-        r, g, b = c, x, 0
-    elif 60 <= h < 120:
-        r, g, b = x, c, 0
-    elif 120 <= h < 180:
-        r, g, b = 0, c, x
-    elif 180 <= h < 240:
-        r, g, b = 0, x, c
-    elif 240 <= h < 300:
-        r, g, b = x, 0, c
-    elif 300 <= h < 360:
-        r, g, b = c, 0, x
-    else:
-        r, g, b = 0, 0, 0
-
-    r = int((r + m) * 255)
-    g = int((g + m) * 255)
-    b = int((b + m) * 255)
-
-    return r, g, b
-
-
-
 class AppFocusWatcher(QObject):  # Наследуемся от QObject
     def __init__(self, app):
         super().__init__()  # Инициализируем базовый класс QObject
@@ -1132,6 +1114,10 @@ class LineNumberArea(QWidget):
                         Qt.AlignmentFlag.AlignRight if pyqt_version == "PyQt6" else Qt.AlignRight, number
                     )
 
+                    if block_is_reduced(block):
+                        # =ru= метка слева: строка раскрашена упрощенно (длинная строка)
+                        painter.fillRect(0, int(top), 3, line_height, QColor(colors["error_color"]))
+
                     if block_number == current_block_number:
                         # Горизонтальная линия сверху
                         pen = QPen(QColor(colors["current_line_color"]))
@@ -1391,213 +1377,659 @@ def gotoN(editor, dialog):
 
 
 
-class HtmlSyntaxHighlighter(QSyntaxHighlighter):   
-    """=ru= Класс для подсветки синтаксиса HTML и CSS в редакторе Anki""" 
-    def __init__(self, parent=None):
-        super(HtmlSyntaxHighlighter, self).__init__(parent)        
+LAZY_HIGHLIGHT_SLICE = 0.008 # =ru= сколько секунд за один такт простоя дорисовывать отложенные строки
+DECORATION_EDIT_MAX_CHARS = 1000 # =ru= изменение меньше этого - правка: сразу только синтаксис, украшения потом
 
-        self.cur_edit_area = None  
-        self.edit_area_selected_text = ""       
-        self.edit_area_highlighterF4_text = ""
+# =ru= выражения для подсветки цветов и пробелов (re можно использовать и в фоновом потоке)
+color_hex_regex = re.compile(r'#[a-fA-F0-9]{3,8}\b', re.ASCII | re.IGNORECASE)
+color_word_regex = re.compile(r'\b([a-zA-Z]{3,20})\b', re.ASCII | re.IGNORECASE)
+color_function_regex = re.compile(r'rgba?\([^\)]+\)|hsla?\([^\)]+\)|hwb\([^\)]+\)', re.IGNORECASE)
+special_space_regex = re.compile("[\u00A0\u2000\u2001\u2002\u2003\u2004\u2005\u2006\u2007\u2008\u2009\u200A\u200B\u200C\u200E\u200F\u202F\u205F\u3000]+")
+tab_regex = re.compile(R"[\t]+")
+non_bmp_regex = re.compile("[\U00010000-\U0010FFFF]")
 
-        self.current_line = -1  # Хранит номер текущей строки
-        self.current_line_format = QTextCharFormat()
-        self.current_line_format.setBackground(QColor(colors["current_line_color"]))
 
-        self.mult_block_start = ["<!--", "/*", "= `", "=`"]
-        self.mult_block_end = ["-->", "*/", "`", "`"]
-        self.mult_block_idx = -1 # =ru= индекс блока
+SWATCH_CACHE_SIZE = 1024 # =ru= сколько разных цветов хранить в кэше форматов
 
-        self.highlighting_rules = [] # =ru= правила раскрашивания строки     
-        self.highlighting_rulesComm = [] # =ru= правила раскрашивания строки даже в комментариях           
 
-        # для поиска в строке перебирая self.mult_block_start
-        self.mult_block_start_regex = re.compile("|".join(map(re.escape, self.mult_block_start)))
-      
-        text_color = QTextCharFormat()        
-        try:
-            text_color.setForeground(QColor(colors["text_color"]))
-        except Exception as e: logError(e)
+@functools.lru_cache(maxsize=SWATCH_CACHE_SIZE)
+def cached_swatch_format(color):
+    """
+    =ru= Готовый формат образца цвета по нормализованной строке цвета (#rrggbb, имя в нижнем регистре)
+    или None, если это не цвет. Кэш общий для всех подсветчиков. Создает QTextCharFormat, поэтому
+    вызывается только из потока GUI (фоновая задача получает имена форматов, а не сами форматы).
+    """
+    qcolor = QColor(color)
+    if not qcolor.isValid():
+        return None
+    fmt = color_swatch_format(qcolor)
+    fmt.swatch_color = color # =ru= имя формата для файла кэша отрезков
+    return fmt
+
+
+def swatch_cache_stats():
+    """=ru= Строка со статистикой кэша форматов образцов цвета"""
+    info = cached_swatch_format.cache_info()
+    total = info.hits + info.misses
+    rate = 100.0 * info.hits / total if total else 0.0
+    return f"swatch cache: {info.hits} hits, {info.misses} misses ({rate:.1f}% hits), {info.currsize}/{info.maxsize} colors"
+
+
+def color_swatch_format(qcolor):
+    """=ru= Формат для образца цвета: фон - сам цвет, текст белый/черный по яркости"""
+    fmt = QTextCharFormat()
+    fmt.setBackground(qcolor)
+    # Автоматически выбираем белый/чёрный текст по яркости
+    if qcolor.alpha() < 64:
+        fmt.setForeground(QColor("gray"))
+    elif qcolor.lightness() < 128:
+        fmt.setForeground(GC_white)
+    else:
+        fmt.setForeground(GC_black)
+    return fmt
+
+
+def utf16_offsets(text):
+    """=ru= Позиции символов Python в единицах UTF-16 (как в Qt) или None, если они совпадают"""
+    if not non_bmp_regex.search(text):
+        return None
+    offsets = [0] * (len(text) + 1)
+    pos = 0
+    for i, char in enumerate(text):
+        offsets[i] = pos
+        pos += 2 if ord(char) > 0xFFFF else 1
+    offsets[len(text)] = pos
+    return offsets
+
+
+class HighlightBlockData(QTextBlockUserData):
+    """=ru= Данные строки для подсветки"""
+    def __init__(self):
+        super().__init__()
+        self.pending = False # строка еще не раскрашена (отложена до простоя)
+        self.reduced = False # строка раскрашена упрощенно (длинная или не уложилась во время)
+        self.retry = False # не уложилась во время: в простое раскрасить заново без ограничения
+        self.core = None # только синтаксис, украшения позже: (текст, состояние предыдущей строки, состояние, отрезки, упрощенно)
 
-        error_color = QTextCharFormat()        
-        try:
-            error_color.setForeground(QColor(colors["error_color"]))
-        except Exception as e: logError(e)
 
-        # Defining the orange format for Anki fields =br= Definição do formato laranja para campos do Anki        
-        anki_field_color = QTextCharFormat()
-        try:
-            anki_field_color.setForeground(QColor(colors["x_anki_field_color"]))
-        except Exception as e: logError(e)
+def block_is_pending(block):
+    data = block.userData()
+    return data is not None and getattr(data, "pending", False)
 
-        brackets_curly_color = QTextCharFormat()
-        try:
-            brackets_curly_color.setForeground(QColor(colors["x_brackets_curly_color"]))
-        except Exception as e: logError(e)
-        brackets_round_color = QTextCharFormat()        
-        try:
-            brackets_round_color.setForeground(QColor(colors["x_brackets_round_color"]))
-        except Exception as e: logError(e)
-        brackets_square_color = QTextCharFormat()
-        try:
-            brackets_square_color.setForeground(QColor(colors["x_brackets_square_color"]))
-        except Exception as e: logError(e)
 
-        self.comment_color = QTextCharFormat()
-        try:
-            self.comment_color.setForeground(QColor(colors["x_comment_color"]))
-        except Exception as e: logError(e)
+def block_is_lazy(block):
+    """=ru= Строку надо раскрасить в простое: отложена или не уложилась во время"""
+    data = block.userData()
+    return data is not None and (getattr(data, "pending", False) or getattr(data, "retry", False))
 
-        css_id_color = QTextCharFormat()
-        try:
-            css_id_color.setForeground(QColor(colors["x_css_id_color"]))
-        except Exception as e: logError(e)
 
-        css_class_color = QTextCharFormat()
-        try:
-            css_class_color.setForeground(QColor(colors["x_css_class_color"]))
-        except Exception as e: logError(e)
+def block_is_reduced(block):
+    data = block.userData()
+    return data is not None and getattr(data, "reduced", False)
 
 
-        css_property_color = QTextCharFormat()
-        try:
-            css_property_color.setForeground(QColor(colors["x_css_property_color"]))
-        except Exception as e: logError(e)
+def block_is_undecorated(block):
+    data = block.userData()
+    return data is not None and getattr(data, "core", None) is not None
 
-        html_tag_attr_color = QTextCharFormat()
-        try:
-            html_tag_attr_color.setForeground(QColor(colors["x_html_tag_attr_color"]))
-        except Exception as e: logError(e)
 
-        html_tag_color = QTextCharFormat()
+class HighlightTables:
+    """
+    =ru= Форматы подсветки для одной темы (theme, ночной режим) и сканеры правил с этими форматами.
+    Создаются один раз (см. highlight_tables) и общие для всех окон редактора шаблонов.
+    key - (тема, ночной режим), по нему таблицы находятся при чтении кэша отрезков с диска.
+    """
+    def __init__(self, colors, night, key=None):
+        self.key = key
+        self.current_line_format = QTextCharFormat()
         try:
-            html_tag_color.setForeground(QColor(colors["x_html_tag_color"]))
-            html_tag_color.setFontWeight(QFont.Weight.Bold.value if pyqt_version == "PyQt6" else QFont.Bold)
+            self.current_line_format.setBackground(QColor(colors["current_line_color"]))
         except Exception as e: logError(e)
 
-
-        self.keyword_attention_color = QTextCharFormat()        
-        try:
-            self.keyword_attention_color.setForeground(QColor(colors["x_keyword_attention_color"]))
-            self.keyword_attention_color.setFontWeight(QFont.Weight.Bold.value if pyqt_version == "PyQt6" else QFont.Bold)
-        except Exception as e: logError(e)
-        self.keyword_attention_colorRed = QTextCharFormat()        
+        # =ru= цвета для ключей из таблицы правил (syntax_rules.py)
+        self.formats = {}
+        for key in ("text_color", "error_color", "x_anki_field_color", "x_brackets_curly_color",
+                    "x_brackets_round_color", "x_brackets_square_color", "x_comment_color",
+                    "x_css_id_color", "x_css_class_color", "x_css_property_color",
+                    "x_html_tag_attr_color", "x_html_tag_color", "x_keyword_attention_color",
+                    "x_keyword_block_color", "x_keyword_color", "x_name_color",
+                    "x_name_function_color", "x_number_color", "x_string_color",
+                    "x_string_multiline_color"):
+            fmt = QTextCharFormat()
+            try:
+                fmt.setForeground(QColor(colors[key]))
+                if key in ("x_html_tag_color", "x_keyword_attention_color"):
+                    fmt.setFontWeight(QFont.Weight.Bold.value if pyqt_version == "PyQt6" else QFont.Bold)
+            except Exception as e: logError(e)
+            self.formats[key] = fmt
+
+        self.comment_color = self.formats["x_comment_color"]
+        self.string_color = self.formats["x_string_color"]
+        self.keyword_attention_color = self.formats["x_keyword_attention_color"]
+        self.keyword_attention_colorRed = self.wave_underline("red")
+        self.keyword_attention_colorBlue = self.wave_underline("blue")
+
+        # Подсветка выделенного текста (F4) и парных скобок к нему
+        self.f4_format = QTextCharFormat()
+        if night:
+            self.f4_format.setBackground(QColor("#5e5e30"))
+            self.f4_format.setForeground(QColor("yellow"))
+        else:
+            self.f4_format.setBackground(QColor("#cfcf6d"))
+            self.f4_format.setForeground(QColor("blue"))
+        self.pair_format = QTextCharFormat()
+        self.pair_format.setBackground(QColor("#cfcf6d"))
+        self.pair_format.setForeground(QColor("#e80af7"))
+
+        # регулярные выражения скомпилированы один раз на процесс, здесь только подстановка форматов
+        scanners, scannerComm = shared_scanners()
+        self.rule_scanners = {lang: scanner.bind(self.formats) for lang, scanner in scanners.items()}
+        self.rule_scannerComm = scannerComm.bind(self.formats)
+        for scanner in list(self.rule_scanners.values()) + [self.rule_scannerComm]:
+            scanner.guard = rule_guard
+
+        # =ru= имена форматов для файла кэша отрезков (f4_format и pair_format - только в ExtraSelection, в отрезках их нет)
+        self.named_formats = dict(self.formats)
+        self.named_formats["wave_red"] = self.keyword_attention_colorRed
+        self.named_formats["wave_blue"] = self.keyword_attention_colorBlue
+        self.format_names = {id(fmt): name for name, fmt in self.named_formats.items()}
+
+        # =ru= отрезки с форматами - для основного потока, с именами форматов - для фоновой задачи
+        # (сканеры с именами вместо форматов, образец цвета - сам цвет, см. spans_by_name)
+        names = {name: name for name in self.named_formats}
+        self.name_scanners = {lang: scanner.bind(names) for lang, scanner in scanners.items()}
+        self.name_scannerComm = scannerComm.bind(names)
+        for scanner in list(self.name_scanners.values()) + [self.name_scannerComm]:
+            scanner.guard = rule_guard
+        self.painter = SpanPainter(self.rule_scanners, self.rule_scannerComm, self.named_formats, cached_swatch_format)
+        self.name_painter = SpanPainter(self.name_scanners, self.name_scannerComm, names, str)
+        self.set_profile(rule_profile if profile_highlighting else None)
+
+    def format_name(self, fmt):
+        """=ru= Имя формата отрезка (образец цвета - сам цвет) или None"""
+        name = self.format_names.get(id(fmt))
+        if name is None:
+            name = getattr(fmt, "swatch_color", None)
+        return name
+
+    def format_by_name(self, name):
+        fmt = self.named_formats.get(name)
+        if fmt is None and name.startswith("#"):
+            fmt = cached_swatch_format(name)
+        return fmt
+
+    def spans_by_name(self, named):
+        """=ru= Отрезки name_painter с форматами этой темы (в основном потоке); не цвет - без отрезка"""
+        spans = []
+        for start, length, name in named:
+            fmt = self.format_by_name(name)
+            if fmt is not None:
+                spans.append((start, length, fmt))
+        return spans
+
+    def set_profile(self, profile):
+        """=ru= Включает (RuleProfile) или выключает (None) профилирование правил"""
+        for scanner in list(self.rule_scanners.values()) + list(self.name_scanners.values()) + [
+                self.rule_scannerComm, self.name_scannerComm]:
+            scanner.profile = profile
+
+    @staticmethod
+    def wave_underline(color):
+        fmt = QTextCharFormat()
         try:
             if pyqt_version == "PyQt6":
-                self.keyword_attention_colorRed.setUnderlineStyle(QTextCharFormat.UnderlineStyle.WaveUnderline)
+                fmt.setUnderlineStyle(QTextCharFormat.UnderlineStyle.WaveUnderline)
             else:
-                self.keyword_attention_colorRed.setUnderlineStyle(QTextCharFormat.WaveUnderline)
-            self.keyword_attention_colorRed.setUnderlineColor(QColor("red"))  # Цвет подчеркивания
+                fmt.setUnderlineStyle(QTextCharFormat.WaveUnderline)
+            fmt.setUnderlineColor(QColor(color))  # Цвет подчеркивания
         except Exception as e: logError(e)
-        self.keyword_attention_colorBlue = QTextCharFormat()        
-        try:
-            if pyqt_version == "PyQt6":
-                self.keyword_attention_colorBlue.setUnderlineStyle(QTextCharFormat.UnderlineStyle.WaveUnderline)
+        return fmt
+
+
+class SpanPainter:
+    """
+    =ru= Отрезки подсветки строки (начало, длина, формат) по токенам лексера: правила, строки и
+    комментарии, украшения. Что записывается как формат, задают поля: форматы темы для основного
+    потока или их имена для фоновой задачи (см. HighlightTables). С именами Qt не используется
+    вовсе, форматы по ним подставляет основной поток (HighlightTables.spans_by_name).
+    """
+    def __init__(self, rule_scanners, rule_scannerComm, formats, swatch):
+        self.rule_scanners = rule_scanners # язык: сканер правил
+        self.rule_scannerComm = rule_scannerComm
+        self.comment_color = formats["x_comment_color"]
+        self.string_color = formats["x_string_color"]
+        self.keyword_attention_colorRed = formats["wave_red"]
+        self.keyword_attention_colorBlue = formats["wave_blue"]
+        self.swatch = swatch # цвет (#rrggbb, имя в нижнем регистре) -> формат образца или None
+
+    def highlightBlockIdxComm(self, text, idx, spans):
+        """=ru= Метод для раскрашивания даже в комментариях"""
+        if text is None or len(text) == 0:
+            return
+        # надо обработать все правила HIGHLIGHTING_RULES_COMM - даже в комментариях
+        for start, length, format in self.rule_scannerComm.scan(text):
+            spans.append((idx + start, length, format))
+
+    def highlightBlockIdx(self, text, idx, spans, deadline=None, lang=lexer.LANG_HTML):
+        """
+        =ru= Метод для раскрашивания кода правилами языка lang с частичным смещением.
+        Возвращает False, если правила не уложились до deadline (тогда отрезков не добавляет).
+        """
+        if text is None or len(text) == 0:
+            return True
+        # надо обработать все правила области, так как это не комментарий
+        found, complete = self.rule_scanners[lang].scan_until(text, deadline)
+        if not complete:
+            return False
+        for start, length, format in found:
+            spans.append((idx + start, length, format))
+        return True
+
+
+    def highlight_tokens(self, text, tokens, spans, deadline=None):
+        """
+        =ru= Раскраска строки по токенам: код правилами, строки и комментарии своим цветом.
+        Возвращает False, если правила не уложились до deadline (код остался без раскраски).
+        """
+        # код вместе со строками раскрашивается правилами одним куском до комментария или до
+        # смены области (правила смотрят вперед, например атрибут тега ищет >), потом строки
+        # перекрашиваются. Каждый кусок - только правилами своей области (HTML, CSS, JS).
+        # Разметка - одним куском до комментария HTML, а CSS и JS внутри нее (style="...",
+        # onclick="...", <style>...</style> в одной строке) заменяются символом \0, который не
+        # раскрашивает ни одно правило: правила разметки видят тег целиком, а вложенный код
+        # раскрашивается после них правилами своего языка
+        complete = True
+        run_start = -1
+        run_lang = None
+        markup_start = -1
+        markup_end = -1
+        nested = [] # куски CSS/JS внутри разметки: (начало, конец, язык)
+
+        def flush_markup():
+            parts = []
+            pos = markup_start
+            for start, end, lang in nested:
+                end = min(end, markup_end)
+                if end > start:
+                    parts.append(text[pos:start])
+                    parts.append("\0" * (end - start))
+                    pos = end
+            parts.append(text[pos:markup_end])
+            return self.highlightBlockIdx("".join(parts), markup_start, spans, deadline, lexer.LANG_HTML)
+
+        for start, end, kind, lang in tokens:
+            if run_start != -1 and (kind == lexer.TOKEN_COMMENT or lang != run_lang):
+                if markup_start != -1:
+                    nested.append((run_start, start, run_lang))
+                else:
+                    complete = self.highlightBlockIdx(text[run_start:start], run_start, spans, deadline, run_lang) and complete
+                run_start = -1
+            if lang == lexer.LANG_HTML:
+                if kind == lexer.TOKEN_COMMENT:
+                    if markup_start != -1:
+                        complete = self.flush_nested(text, flush_markup(), nested, spans, deadline) and complete
+                        markup_start = -1
+                    continue
+                if markup_start == -1:
+                    markup_start = start
+                    nested = []
+                markup_end = end
+                continue
+            if kind != lexer.TOKEN_COMMENT and run_start == -1:
+                run_start = start
+                run_lang = lang
+        if run_start != -1:
+            if markup_start != -1:
+                nested.append((run_start, len(text), run_lang))
             else:
-                self.keyword_attention_colorBlue.setUnderlineStyle(QTextCharFormat.WaveUnderline)
-            self.keyword_attention_colorBlue.setUnderlineColor(QColor("blue"))  # Цвет подчеркивания
-        except Exception as e: logError(e)
+                complete = self.highlightBlockIdx(text[run_start:], run_start, spans, deadline, run_lang) and complete
+        if markup_start != -1:
+            complete = self.flush_nested(text, flush_markup(), nested, spans, deadline) and complete
 
-        keyword_block_color = QTextCharFormat()
-        try:
-            keyword_block_color.setForeground(QColor(colors["x_keyword_block_color"]))
-        except Exception as e: logError(e)
+        for start, end, kind, lang in tokens:
+            if kind == lexer.TOKEN_CODE:
+                continue
+            spans.append((start, end - start, self.comment_color if kind == lexer.TOKEN_COMMENT else self.string_color))
+            if complete:
+                self.highlightBlockIdxComm(text[start:end], start, spans) # раскраска даже в комментариях и строках
+        return complete
+
+    def flush_nested(self, text, complete, nested, spans, deadline):
+        """=ru= Куски CSS/JS внутри разметки - после правил разметки, чтобы их перекрыть"""
+        for start, end, lang in nested:
+            complete = self.highlightBlockIdx(text[start:end], start, spans, deadline, lang) and complete
+        return complete
+
+
+    def reduced_spans(self, text, tokens):
+        """=ru= Упрощенная раскраска длинной строки: только строки и комментарии по токенам лексера"""
+        spans = []
+        for start, end, kind, lang in tokens:
+            if kind != lexer.TOKEN_CODE:
+                spans.append((start, end - start, self.comment_color if kind == lexer.TOKEN_COMMENT else self.string_color))
+        return spans
+
+    def block_spans(self, text, tokens, decorate=True, budget=True):
+        """
+        =ru= Отрезки (начало, длина, формат) для строки в порядке применения и признак
+        упрощенной раскраски: (отрезки, упрощенно). decorate=False - только синтаксис,
+        без decoration_spans. budget=False - без ограничения времени long_line_budget_ms
+        (в простое и в фоновой задаче).
+        """
+        # длинная (минифицированная) строка: правила и цвета по всей строке - это долго
+        if 0 < long_line_min_chars <= len(text):
+            return self.reduced_spans(text, tokens), True
+        deadline = time.perf_counter() + long_line_budget_ms / 1000 if budget and long_line_budget_ms > 0 else None
+
+        spans = []
+        if not self.highlight_tokens(text, tokens, spans, deadline):
+            return self.reduced_spans(text, tokens), True # правила не уложились во время
+        if not decorate:
+            return spans, False
+        if deadline is not None and time.perf_counter() >= deadline:
+            return spans, True # остальное (цвета, пробелы) пропускаем
+        self.decoration_spans(text, spans)
+        return spans, False
+
+
+    def decoration_spans(self, text, spans):
+        """=ru= Украшения поверх синтаксиса: образцы цветов, особые пробелы и табуляция"""
+        # Подсветка слов с цветами #
+        for match in color_hex_regex.finditer(text):
+            fmt = self.swatch(match.group(0).lower())
+            if fmt is None:
+                continue
+            spans.append((match.start(0), match.end(0) - match.start(0), fmt))
 
-        keyword_color = QTextCharFormat()
-        try:
-            keyword_color.setForeground(QColor(colors["x_keyword_color"]))        
-        except Exception as e: logError(e)
+        # Подсветка слов заданные словом цвета (сначала проверка по таблице, QColor только для цветов)
+        for match in color_word_regex.finditer(text):
+            color = named_color(match.group(1))
+            if color is None:
+                continue
+            fmt = self.swatch(color)
+            if fmt is None:
+                continue
+            spans.append((match.start(1), match.end(1) - match.start(1), fmt))
 
-        name_color = QTextCharFormat()
-        try:
-            name_color.setForeground(QColor(colors["x_name_color"]))
-        except Exception as e: logError(e)
+        # Подсветка слов с rgb hsl hwb (разбор кэшируется в css_colors.parse_color_function)
+        for match in color_function_regex.finditer(text):
+            fmt = self.swatch(convert_color_to_hex(match.group(0)).lower())
+            if fmt is None:
+                continue
+            spans.append((match.start(0), 4, fmt))
 
-        name_function_color = QTextCharFormat()
-        try:
-            name_function_color.setForeground(QColor(colors["x_name_function_color"]))
-        except Exception as e: logError(e)
+        # подсветка особых пробельных символов (не включать \u200D так как это для emoji Zero Width Joiner (ZWJ, U+200D)  )
+        for match in special_space_regex.finditer(text):
+            spans.append((match.start(0), match.end(0) - match.start(0), self.keyword_attention_colorRed))
+        # табуляция допустима в некоторых тэгах, так что синим
+        for match in tab_regex.finditer(text):
+            spans.append((match.start(0), match.end(0) - match.start(0), self.keyword_attention_colorBlue))
 
-        number_color = QTextCharFormat()
-        try:
-            number_color.setForeground(QColor(colors["x_number_color"]))
-        except Exception as e: logError(e)
 
-        self.string_color = QTextCharFormat()        
+highlight_tables_cache = {} # (тема, ночной режим): HighlightTables
+rule_profile = RuleProfile() # =ru= общий профиль правил всех окон
+rule_guard = RuleGuard(rule_budget_ms / 1000, log.warning) if rule_budget_ms > 0 else None # =ru= общий для всех окон
+
+
+def log_rule_audit():
+    """=ru= В лог - правила, в которых возможен катастрофический перебор (см. audit_pattern)"""
+    try:
+        for rules in (HIGHLIGHTING_RULES, HIGHLIGHTING_RULES_COMM):
+            for number, pattern, issue in audit_rules(rules):
+                fallback = FALLBACK_RULES.get(pattern)
+                log.info(f"rule #{number} {pattern}: {issue}; "
+                         f"{'guarded' if rule_guard else 'not guarded'}, fallback: {fallback or 'skip the rule'}")
+    except Exception as e: logError(e)
+
+
+log_rule_audit()
+span_cache = SpanCache(span_cache_max_lines, span_cache_max_mb * 1048576) # =ru= общий для всех окон, только в основном потоке
+
+
+def span_cache_put(key, text, state, spans, reduced):
+    """=ru= Сведенные отрезки строки в кэш"""
+    # упрощенная раскраска из-за нехватки времени зависит от загрузки, ее не кэшируем
+    if not reduced or 0 < long_line_min_chars <= len(text):
+        span_cache.put(key, text, (state, spans, reduced))
+
+
+def set_profile_highlighting(enabled):
+    """=ru= Включение профилирования правил для всех таблиц подсветки"""
+    global profile_highlighting
+    profile_highlighting = enabled
+    for tables in highlight_tables_cache.values():
+        tables.set_profile(rule_profile if enabled else None)
+
+
+def highlight_tables(theme_name, night):
+    """=ru= Таблицы подсветки темы, строятся при первом обращении"""
+    key = (theme_name, bool(night))
+    tables = highlight_tables_cache.get(key)
+    if tables is None:
+        theme_colors = config["THEMES"][theme_name]["DARK_MODE" if night else "LIGHT_MODE"]
+        tables = highlight_tables_cache[key] = HighlightTables(theme_colors, night, key)
+    return tables
+
+
+span_cache_file = str(module_dir / "user_files" / "span_cache.bin")
+# =ru= файл кэша от другой версии дополнения не читается (лексер и правила могли измениться)
+span_cache_version = "%s-%s" % (version, addon_manager.addonMeta(module_name).get("mod", 0))
+span_cache_loaded = False # =ru= файл прочитан (до этого его нельзя перезаписывать)
+span_cache_loading = False
+
+
+def span_record(key, value):
+    """=ru= Запись кэша отрезков для файла: стеки вместо номеров состояний, имена вместо форматов"""
+    text, prev_state, base, tables = key
+    if tables.key is None:
+        return None
+    state, spans, reduced = value
+    named = []
+    for start, length, fmt in spans:
+        name = tables.format_name(fmt)
+        if name is None:
+            return None
+        named.append((start, length, name))
+    # номера состояний свои в каждом процессе, а стеки контекстов - нет
+    prev = None if prev_state < 0 else lexer.decode_state(prev_state, base)
+    return (text, prev, base, tables.key), lexer.decode_state(state, base), named, reduced
+
+
+def read_span_cache():
+    """
+    =ru= Записи файла кэша отрезков (в фоновом потоке): распаковка и разбор занимают время.
+    Файл больше span_cache_disk_mb не читается (его перезапишет следующее сохранение).
+    """
+    try:
+        size = os.path.getsize(span_cache_file)
+    except OSError:
+        return [] # файла еще нет
+    if size > span_cache_disk_mb * 1048576:
+        log.debug(f"span cache file skipped: {size} bytes > span_cache_disk_mb")
+        return []
+    return read_span_file(span_cache_file, span_cache_version)
+
+
+def install_span_cache(records):
+    """=ru= Записи файла в кэш в памяти (в основном потоке: форматы по именам - это QTextCharFormat)"""
+    loaded = 0
+    for (text, prev, base, (theme_name, night)), stack, named, reduced in reversed(records):
+        if theme_name not in config["THEMES"]:
+            continue
+        tables = highlight_tables(theme_name, night)
+        spans = []
+        for start_pos, length, name in named:
+            fmt = tables.format_by_name(name)
+            if fmt is None:
+                break
+            spans.append((start_pos, length, fmt))
+        else:
+            prev_state = -1 if prev is None else lexer.encode_state(prev)
+            key = (text, prev_state, base, tables)
+            if span_cache.peek(key) is None: # уже раскрашенное в этом сеансе не трогаем
+                span_cache.put(key, text, (lexer.encode_state(stack), spans, reduced))
+                loaded += 1
+    return loaded
+
+
+def load_span_cache():
+    """
+    =ru= Один раз за сеанс: отрезки, сохраненные при прошлом закрытии окна, в кэш в памяти.
+    Файл читается в фоновом потоке, чтобы не задерживать открытие окна, а записи попадают
+    в кэш по готовности; строки, раскрашенные до этого, просто считаются заново.
+    """
+    global span_cache_loading
+    if span_cache_loaded or span_cache_loading:
+        return
+    if not span_cache.enabled or span_cache_disk_mb <= 0:
+        return
+    span_cache_loading = True
+    start = time.perf_counter()
+
+    def on_done(future):
+        global span_cache_loaded, span_cache_loading
+        span_cache_loading = False
+        span_cache_loaded = True # и при ошибке: испорченный файл перезапишется при сохранении
         try:
-            self.string_color.setForeground(QColor(colors["x_string_color"]))            
-        except Exception as e: logError(e)
+            loaded = install_span_cache(future.result())
+            log.debug(f"span cache loaded: {loaded} lines in {(time.perf_counter() - start) * 1000:.0f} ms")
+        except Exception as e:
+            logError(e)
+
+    try:
+        mw.taskman.run_in_background(read_span_cache, on_done, uses_collection=False)
+    except TypeError: # в старых версиях Anki нет uses_collection
+        mw.taskman.run_in_background(read_span_cache, on_done)
+
 
-        string_multiline_color = QTextCharFormat()
+def save_span_cache():
+    """=ru= Недавно использованные строки кэша - в файл (запись в фоновом потоке)"""
+    if not span_cache.enabled or span_cache_disk_mb <= 0 or not span_cache_loaded:
+        return
+    try:
+        records = []
+        for key, value in span_cache.recent(span_cache_disk_mb * 1048576):
+            record = span_record(key, value)
+            if record is not None:
+                records.append(record)
+    except Exception as e:
+        logError(e)
+        return
+
+    def on_done(future):
         try:
-            string_multiline_color.setForeground(QColor(colors["x_string_multiline_color"]))
-        except Exception as e: logError(e)
+            log.debug(f"span cache saved: {len(records)} lines, {future.result()} bytes")
+        except Exception as e:
+            logError(e)
 
-        self.add_highlighting_rule(R"([\^&\|~!])(?!=)", self.keyword_attention_color) 
-        self.add_highlighting_rule(R"(?:&&)|(?:\|\|)", text_color)
-        
+    mw.taskman.run_in_background(lambda: write_span_file(span_cache_file, span_cache_version, records), on_done)
 
-        # если возможные ошибки = в условиях в for и if
-        self.add_highlighting_rule(R"\b(?:(if)|(while))\b\s*\([^\)]*[^=\<\>!](=)[^=][^\)]*\)", self.keyword_attention_color)           
-        self.add_highlighting_rule(R"\bfor\b[^;\)]*;[^;\)=\<\>!]*(=)[^;\)=\<\>!]*;[^\)]*\)", self.keyword_attention_color)  
-        # внимание если пытаются присвоить числу, функции (скобкам)
-        self.add_highlighting_rule(R"(?:(\))|(\b\d+))\s*(=)(?![=\>])", self.keyword_attention_color)
-        
-        self.add_highlighting_rule(R"\b[a-zA-Z\$\-_][a-zA-Z0-9\$\-_]*\b", name_color)
 
-        self.add_highlighting_rule(R"&(?:[A-Za-z0-9]+|#[0-9]+|#x[0-9A-Fa-f]+)(?=;)", html_tag_color) # &nbsp; и подобное
-        self.add_highlighting_rule(R"<(\/?[^> ]+)(?:[^>]*)(?=>)", html_tag_color)
-        self.add_highlighting_rule(R"\b([a-zA-Z_]+[a-zA-Z0-9_:\-]*)\s*=(?=[^>]*\>)", html_tag_attr_color)         
-        
-        self.add_highlighting_rule(R"\.[a-zA-Z\$_][a-zA-Z0-9\$\-_]*\b", css_class_color) 
-        self.add_highlighting_rule(R"#\b[a-zA-Z\$_][a-zA-Z0-9\$\-_]*\b", css_id_color)      
-        # self.add_highlighting_rule(R"[^\.#:]\b([a-zA-Z\$\-_][a-zA-Z0-9\$\-_]*\b):", css_property_color)              
-        self.add_highlighting_rule(R"^\s*\b([a-zA-Z\$\-_][a-zA-Z0-9\$\-_]*\b):", css_property_color)              
-        # self.add_highlighting_rule(R"[^\.#:]\b[a-zA-Z\$\-_][a-zA-Z0-9\$\-_]*\b:\s+([^;\>]*)[;\>]", self.string_color)
-        self.add_highlighting_rule(R"^\s*\b[a-zA-Z\$\-_][a-zA-Z0-9\$\-_]*\b:\s+([^;\>]*)[;\>]", self.string_color)
-
-        self.add_highlighting_rule(R"(\b[a-zA-Z\$\-_][a-zA-Z0-9\$\-_]*\b\s*)\(", name_function_color)               
-        # self.add_highlighting_rule(R"-?\b(?:\d+(?:\.\d+)?(?:e[+-]?\d+)?|0x[0-9a-fA-F]+|0b[01]+|0o[0-7]+)\b", number_color) всё 1asdf считать надо за число а это не пойдет
-        self.add_highlighting_rule(R"(\b.?\b\d+\w*(%?|\b))", number_color)        
-        self.add_highlighting_rule(R"#[0-9A-Fa-f]{3,8}\b", number_color)       
-
-        # подсветка для скобок разных
-        self.add_highlighting_rule(R"[\{\}]", brackets_curly_color)
-        self.add_highlighting_rule(R"[\(\)]", brackets_round_color)
-        self.add_highlighting_rule(R"[\[\]]", brackets_square_color)
-
-        # подсветка для строк  (смотри в def highlightBlock(self, text): для некоторых там может быть )    
-        # self.add_highlighting_rule(r"\"[^\"\\]*(?:\\.[^\"\\]*)*\"", self.string_color)      
-        # self.add_highlighting_rule(r"'[^'\\]*(?:\\.[^'\\]*)*'", self.string_color) 
-        # self.add_highlighting_rule(r"`[^`\\]*(?:\\.[^`\\]*)*`", self.string_color) 
-        
-        #подсветка ограничивающих символов строк
-        self.add_highlighting_rule(R"[\"'`]", self.string_color)
+OCCURRENCE_MAX_CHARS = 200 # =ru= выделение длиннее не помечается автоматически (только по F4)
+OCCURRENCE_MARGIN_LINES = 50 # =ru= сколько строк выше и ниже видимых просматривать
+OCCURRENCE_MAX_MARKS = 5000 # =ru= больше пометок не создавать (минифицированный код)
+UNCLOSED_TAGS_DELAY_MS = 500 # =ru= через столько мс после правки подчеркнуть незакрытые теги
+UNCLOSED_TAGS_MAX_MARKS = 1000 # =ru= больше подчеркиваний не создавать
+EXTRA_SELECTION_LAYERS = ("tags", "occurrences", "pair") # =ru= слои ExtraSelection, следующие рисуются поверх
 
-        # строки которые важны для отображения id, class
-        self.add_highlighting_rule(R"\bid\s*=\s*[\"']([a-zA-Z\$_][a-zA-Z0-9\$\-_]*\b)[\"']", css_id_color) 
-        self.add_highlighting_rule(R"\bclass\s*=\s*[\"']([a-zA-Z\$_][a-zA-Z0-9\$\-_]*\b)[\"']", css_class_color) 
 
-        # особо для style=
-        self.add_highlighting_rule(R"\b(style)\s*=\s*", self.keyword_attention_color) 
-        
-        #self.add_highlighting_rule(R"\b(abstract|await|boolean|byte|case|char|class|const|debugger|default|delete|do|double|else|enum|export|extends|false|final|float|for|function|goto|if|implements|import|in|instanceof|int|interface|let|long|native|new|null|package|private|protected|public|short|static|super|switch|synchronized|this|transient|true|typeof|var|void|volatile|while|with|yield)(?!\s*=)\b", keyword_color)
-        self.add_highlighting_rule(R"\b(abstract|await|boolean|byte|case|char|class|const|debugger|default|delete|double|else|enum|export|extends|false|final|float|function|if|implements|import|in|instanceof|int|interface|let|long|native|new|null|package|private|protected|public|short|static|super|switch|synchronized|this|transient|true|typeof|var|void|volatile|with|yield)(?!\s*=)\b", keyword_color)
-        
-        self.add_highlighting_rule(R"\b(do|for|while|try|catch|finally)(?!\s*=)\b", keyword_block_color)
-        self.add_highlighting_rule(R"\b(return|break|continue|goto|throw|close()|exit())(?!\s*=)\b", self.keyword_attention_color)
-        self.add_highlighting_rule(R"[ ]", self.keyword_attention_color) 
-
-        # =ru= комментарии (только для строки!) обрабатывать в последнюю очередь
-        self.add_highlighting_rule(R"(?:[^:]|^)(//.*$)", self.comment_color)
-        self.add_highlighting_rule(R"(//\*.*\*//)", self.comment_color)
-        self.add_highlighting_rule(R"<!--.*-->", self.comment_color)
-        
-        self.add_highlighting_rule(R"\{\{[^{}]+\}\}", anki_field_color)
-        self.add_highlighting_rule(R"%%", anki_field_color)
+def find_all(text, sub):
+    """=ru= Позиции всех (неперекрывающихся) вхождений sub в text"""
+    result = []
+    i = text.find(sub)
+    while i != -1:
+        result.append(i)
+        i = text.find(sub, i + len(sub))
+    return result
+
+
+def set_extra_selections(edit_area, layer, selections):
+    """
+    =ru= ExtraSelection редактора по слоям (незакрытые теги, вхождения выделенного, пары):
+    setExtraSelections заменяет все сразу, поэтому каждый слой обновляет только свою часть
+    """
+    layers = getattr(edit_area, "extra_selection_layers", None)
+    if layers is None:
+        layers = edit_area.extra_selection_layers = {}
+    layers[layer] = selections
+    edit_area.setExtraSelections([selection for name in EXTRA_SELECTION_LAYERS for selection in layers.get(name, ())])
+
+
+def clear_extra_selections(edit_area):
+    edit_area.extra_selection_layers = {}
+    edit_area.setExtraSelections([])
+
+
+class HtmlSyntaxHighlighter(QSyntaxHighlighter):   
+    """=ru= Класс для подсветки синтаксиса HTML и CSS в редакторе Anki""" 
+    def __init__(self, parent=None):
+        # документ подключаем в конце, чтобы on_contents_change получал изменения раньше подсветки
+        super(HtmlSyntaxHighlighter, self).__init__(None)
 
-        # правила подсветки даже в комментариях
-        self.add_highlighting_ruleComm(R"\{\{[^{}]+\}\}", anki_field_color)
+        self.cur_edit_area = None  
+        self.edit_area_selected_text = ""       
+        self.edit_area_highlighterF4_text = "" # =ru= закрепленное по F4, помечается, пока ничего не выделено
+
+        # =ru= вхождения выделенного - слой ExtraSelection поверх подсветки: ищутся только в видимых
+        # строках (с запасом) после паузы, форматы строк и кэш отрезков не меняются
+        self.occurrence_text = None # что помечено сейчас
+        self.occurrence_range = None # (первая, последняя) строки, в которых искали
+        self.occurrence_timer = QTimer()
+        self.occurrence_timer.setInterval(max(0, occurrence_delay_ms))
+        self.occurrence_timer.setSingleShot(True)
+        self.occurrence_timer.timeout.connect(self.mark_occurrences)
+
+        self.current_line = -1  # Хранит номер текущей строки
+        self.tables = None # =ru= форматы и сканеры правил темы (общие для всех окон, см. highlight_tables)
+        self.set_tables(highlight_tables(themeName, theme_night))
+
+        self.style_button = None # =ru= кнопка вкладки стиля (для нее первая строка начинается в контексте CSS)
+        self.base = None # =ru= язык вкладки, если документ всегда одной вкладки (TemplateDocumentPool)
+        self.span_stats = SpanStats() # =ru= сколько вызовов setFormat сэкономлено
+        self.brackets = BracketIndex() # =ru= парные скобки документа (см. bracket_pair)
+        self.elements = ElementIndex() # =ru= дерево элементов (см. tag_pair, enclosing_element)
+        self.unclosed_timer = QTimer()
+        self.unclosed_timer.setInterval(UNCLOSED_TAGS_DELAY_MS)
+        self.unclosed_timer.setSingleShot(True)
+        self.unclosed_timer.timeout.connect(self.mark_unclosed_tags)
+
+        # =ru= ленивая подсветка: при большом изменении сразу раскрашиваются видимые строки
+        # (с запасом), у остальных считается только состояние, а раскраска - в простое.
+        # Лексер проходит все строки в основном потоке (Qt нужны состояния строк по порядку,
+        # ~80 мс на 1 МБ текста), в фоновую задачу уходят только правила и украшения
+        self.lazy_pass = False # текущий проход подсветки ленивый
+        self.lazy_window = None # (первая, последняя) строки, которые раскрашиваются сразу
+        self.lazy_pending = False # есть отложенные строки
+        self.lazy_unbudgeted = False # раскраска из простоя: без ограничения времени на строку
+        self.lazy_phase = None # этап дорисовки (см. lazy_highlight_step)
+        self.lazy_block = None # с какой строки продолжать дорисовку
+        self.lazy_snapshot = [] # (номер строки, текст, состояние предыдущей строки) для фоновой задачи
+        self.lazy_job = None # (revision документа, язык вкладки) текущей фоновой задачи
+        self.lazy_ready = {} # номер строки: (текст, состояние предыдущей строки, состояние, отрезки, упрощенно)
+        self.lazy_timer = QTimer()
+        self.lazy_timer.setInterval(0) # срабатывает, когда нет других событий
+        self.lazy_timer.timeout.connect(self.lazy_highlight_step)
+        self.lazy_restart_timer = QTimer()
+        self.lazy_restart_timer.setInterval(300) # после правки продолжаем дорисовку через 300ms
+        self.lazy_restart_timer.setSingleShot(True)
+        self.lazy_restart_timer.timeout.connect(self.lazy_restart)
+
+        # =ru= два уровня подсветки: при правке строки сразу раскрашивается только синтаксис,
+        # а украшения видимым строкам добавляются, когда правки на decoration_delay_ms затихнут
+        self.decorating = False # идет второй уровень (см. decorate_visible_blocks)
+        self.editing = False # подсветка после правки (ввод, удаление), а не после загрузки текста
+        self.decoration_timer = QTimer()
+        self.decoration_timer.setInterval(max(0, decoration_delay_ms))
+        self.decoration_timer.setSingleShot(True)
+        self.decoration_timer.timeout.connect(self.decorate_visible_blocks)
+
+        if parent is not None:
+            self.setParent(parent)
+            parent.contentsChange.connect(self.on_contents_change)
+            if 0 < lazy_highlighting_min_chars <= parent.characterCount():
+                self.lazy_pass = True # первая подсветка документа
+            self.setDocument(parent)
+            parent.contentsChange.connect(self.on_contents_changed)
         
      
                 
@@ -1615,447 +2047,799 @@ class HtmlSyntaxHighlighter(QSyntaxHighlighter):
         """Обрабатывает изменение выделения."""      
         cursor = edit_area.textCursor()
         self.edit_area_selected_text = cursor.selectedText()                      
+        if occurrence_delay_ms > 0:
+            self.schedule_occurrences()
         
     def rehighlight_code(self):
-        """Повторно подсвечивает весь код."""
-        if self.cur_edit_area and self.cur_edit_area.highlighter:   
-            # Устанавливаем курсор в режим "песочные часы"
-            QGuiApplication.setOverrideCursor(WaitCursor)
-            try:
-                self.edit_area_highlighterF4_text = self.edit_area_selected_text
-                # Выполняем подсветку
-                self.cur_edit_area.highlighter.rehighlight()
-            finally:
-                # Возвращаем курсор в нормальное состояние
-                QGuiApplication.restoreOverrideCursor()
+        """=ru= F4: закрепить выделенное (пометить все вхождения), F4 без выделения - снять"""
+        self.edit_area_highlighterF4_text = self.edit_area_selected_text
+        self.occurrence_text = None
+        self.mark_occurrences()
+        log.debug(f"rehighlight_code: {self.span_stats}; {swatch_cache_stats()}; {span_cache}")
+
+    def occurrence_target(self):
+        """=ru= Что помечать: выделенное (если включено автоматически) или закрепленное по F4"""
+        text = self.edit_area_selected_text if occurrence_delay_ms > 0 else ""
+        if not text or "\u2029" in text or len(text) > OCCURRENCE_MAX_CHARS or not text.strip():
+            text = self.edit_area_highlighterF4_text
+        return text
+
+    def schedule_occurrences(self):
+        """=ru= Пометить вхождения после паузы (смена выделения, прокрутка, правка)"""
+        if self.shown_edit_area() is not None and (self.occurrence_text or self.occurrence_target()):
+            self.occurrence_timer.start()
+
+    def mark_occurrences(self):
+        """=ru= Вхождения выделенного в видимых строках (с запасом) - слоем ExtraSelection"""
+        edit_area = self.shown_edit_area()
+        if edit_area is None:
+            return
+        try:
+            text = self.occurrence_target()
+            blocks = self.visible_blocks()
+            if blocks:
+                document = self.document()
+                first = document.findBlockByNumber(max(0, blocks[0].blockNumber() - OCCURRENCE_MARGIN_LINES))
+                last = blocks[-1].blockNumber() + OCCURRENCE_MARGIN_LINES
+            else:
+                first, last = None, -1
+            block_range = (first.blockNumber() if first is not None else -1, last)
+            if text == self.occurrence_text and block_range == self.occurrence_range:
+                return
+            self.occurrence_text = text
+            self.occurrence_range = block_range
+            selections = self.occurrence_selections(first, last, text) if text and first is not None else []
+            set_extra_selections(edit_area, "occurrences", selections)
+        except RuntimeError: # окно уже закрыто
+            pass
+        except Exception as e: logError(e)
+
+    def occurrence_selections(self, block, last, text):
+        """=ru= ExtraSelection для вхождений text в строках от block до строки номер last"""
+        # к одиночной скобке помечаются и парные ей (как раньше по F4)
+        pair = "}])>{[(<"["{[(<}])>".find(text)] if len(text) == 1 and text in "{[(<}])>" else None
+        selections = []
+        while block.isValid() and block.blockNumber() <= last and len(selections) < OCCURRENCE_MAX_MARKS:
+            line = block.text()
+            found = [(match, len(text), self.tables.f4_format) for match in find_all(line, text)]
+            if pair is not None:
+                found.extend((match, 1, self.tables.pair_format) for match in find_all(line, pair))
+            if found:
+                offsets = utf16_offsets(line)
+                position = block.position()
+                for start, length, fmt in found:
+                    end = start + length
+                    if offsets is not None:
+                        start, end = offsets[start], offsets[end]
+                    selection = QTextEdit.ExtraSelection()
+                    selection.format = fmt
+                    selection.cursor = QTextCursor(block)
+                    selection.cursor.setPosition(position + start)
+                    selection.cursor.setPosition(position + end, KeepAnchor)
+                    selections.append(selection)
+            block = block.next()
+        return selections
 
          
     
 
 
-    def add_highlighting_rule(self, pattern, color_format):
-        """Добавляет правило подсветки в зависимости от версии PyQt."""
-        if pyqt_version == "PyQt6":
-            regex = QRegularExpression(pattern)
-        else:  # PyQt5
-            regex = QRegExp(pattern)
-        self.highlighting_rules.append((regex, color_format))
+    def set_tables(self, tables):
+        """=ru= Подключает форматы и сканеры правил темы (HighlightTables)"""
+        self.tables = tables
+        self.current_line_format = tables.current_line_format
+        self.comment_color = tables.comment_color
+        self.string_color = tables.string_color
+        self.keyword_attention_color = tables.keyword_attention_color
+        self.keyword_attention_colorRed = tables.keyword_attention_colorRed
+        self.keyword_attention_colorBlue = tables.keyword_attention_colorBlue
+        self.painter = tables.painter
+
+    def update_theme(self):
+        """=ru= Смена темы (ночной режим): только подмена таблиц и перекраска, ничего не компилируется"""
+        tables = highlight_tables(themeName, theme_night)
+        if tables is self.tables:
+            return
+        self.set_tables(tables)
+        self.lazy_cancel() # посчитанное в фоне было с прежними форматами
+        if 0 < lazy_highlighting_min_chars <= self.document().characterCount():
+            self.lazy_pass = True
+        self.rehighlight()
+        self.lazy_finish_pass()
+
+
+    def base_context(self):
+        """=ru= Язык вкладки для первой строки: CSS для стиля, иначе HTML"""
+        if self.base is not None:
+            return self.base
+        try:
+            if self.style_button is not None and self.style_button.isChecked():
+                return lexer.CSS
+        except RuntimeError: # кнопка уже удалена вместе с окном
+            self.style_button = None
+        return lexer.HTML
+
+
+    def on_contents_change(self, position, chars_removed, chars_added):
+        """=ru= Вызывается до подсветки измененных строк"""
+        self.splice_indexes(position, chars_added)
+        self.editing = chars_added < DECORATION_EDIT_MAX_CHARS and chars_removed < DECORATION_EDIT_MAX_CHARS
+        if 0 < lazy_highlighting_min_chars <= chars_added:
+            # большое изменение (setPlainText при переключении вкладки, вставка)
+            self.lazy_cancel()
+            self.span_stats.reset()
+            self.lazy_pass = True
+        elif self.lazy_phase is not None or self.lazy_restart_timer.isActive():
+            # документ изменился - дорисовку отменяем и начинаем заново, когда правки закончатся
+            self.lazy_cancel()
+            self.lazy_restart_timer.start()
+
+    def on_contents_changed(self, position, chars_removed, chars_added):
+        """=ru= Вызывается после подсветки измененных строк"""
+        self.editing = False
+        self.lazy_finish_pass()
+        if self.occurrence_text:
+            self.occurrence_range = None # в измененных строках могли появиться или пропасть вхождения
+            self.schedule_occurrences()
+        self.schedule_unclosed_tags()
+
+    def splice_indexes(self, position, chars_added):
+        """=ru= Индексы скобок и тегов: строки изменения заменяются неразобранными, номера следующих сдвигаются"""
+        document = self.document()
+        count = document.blockCount()
+        first = document.findBlock(position).blockNumber()
+        added = document.findBlock(position + chars_added).blockNumber() - first + 1
+        for index in (self.brackets, self.elements):
+            lines = len(index.lines)
+            removed = added - (count - lines)
+            if first < 0 or removed < 1 or first + removed > lines:
+                index.reset(count)
+            else:
+                index.splice(first, removed, added)
+
+    def index_line(self, number):
+        """=ru= (текст, состояние предыдущей строки, язык вкладки) для LineIndex.refresh"""
+        block = self.document().findBlockByNumber(number)
+        previous = block.previous()
+        return block.text(), previous.userState() if previous.isValid() else -1, self.base_context()
+
+    def refresh_index(self, index, deadline=None):
+        """=ru= Разбирает строки, измененные после прошлого вопроса к индексу (до deadline, см. LineIndex.refresh)"""
+        count = self.document().blockCount()
+        if len(index.lines) != count:
+            index.reset(count)
+        index.refresh(self.index_line, deadline)
+        return index
+
+    def index_place(self, position):
+        """=ru= Позиция документа -> (строка, позиция в ней для Python) или None (середина суррогатной пары)"""
+        block = self.document().findBlock(position)
+        if not block.isValid():
+            return None
+        column = position - block.position()
+        offsets = utf16_offsets(block.text())
+        if offsets is not None: # позиции Qt в UTF-16
+            column = bisect.bisect_left(offsets, column)
+            if column >= len(offsets) or offsets[column] != position - block.position():
+                return None
+        return block.blockNumber(), column
+
+    def document_position(self, number, column):
+        """=ru= (строка, позиция в ней для Python) -> позиция документа"""
+        block = self.document().findBlockByNumber(number)
+        offsets = utf16_offsets(block.text())
+        return block.position() + (offsets[column] if offsets is not None else column)
+
+    def bracket_pair(self, position):
+        """
+        =ru= Позиция в документе скобки, парной к скобке на position, или None.
+        Разбираются только строки, измененные после прошлого вопроса, дальше - поиск в словаре.
+        """
+        place = self.index_place(position)
+        if place is None:
+            return None
+        found = self.refresh_index(self.brackets).find(*place)
+        return self.document_position(*found) if found is not None else None
 
-    def add_highlighting_ruleComm(self, pattern, color_format):
-        """Добавляет правило подсветки в зависимости от версии PyQt."""
-        if pyqt_version == "PyQt6":
-            regex = QRegularExpression(pattern)
-        else:  # PyQt5
-            regex = QRegExp(pattern)
-        self.highlighting_rulesComm.append((regex, color_format))
+    def tag_pair(self, position):
+        """
+        =ru= (начало, конец) в документе того, что подсветить парой к тегу на position (курсор
+        на < или в имени тега): < и имя парного тега, у одиночного - его >. None - пары нет.
+        """
+        place = self.index_place(position)
+        if place is None:
+            return None
+        found = self.refresh_index(self.elements).pair_tag(*place)
+        if found is None:
+            return None
+        number, column, length = found
+        return self.document_position(number, column), self.document_position(number, column + length)
+
+    def enclosing_element(self, start, end):
+        """=ru= (начало, конец) в документе ближайшего элемента, охватывающего start..end и больше него, или None"""
+        first, last = self.index_place(start), self.index_place(end)
+        if first is None or last is None:
+            return None
+        element = self.refresh_index(self.elements).enclosing(first, last)
+        if element is None:
+            return None
+        return self.document_position(*element.start), self.document_position(*element.end)
+
+    def schedule_unclosed_tags(self):
+        if mark_unclosed_tags and self.shown_edit_area() is not None:
+            self.unclosed_timer.start()
+
+    def mark_unclosed_tags(self):
+        """=ru= Незакрытые и лишние закрывающие теги (по дереву элементов) - волнистым подчеркиванием"""
+        edit_area = self.shown_edit_area()
+        if edit_area is None:
+            return
+        try:
+            document = self.document()
+            selections = []
+            for number, column, length in self.refresh_index(self.elements).unclosed()[:UNCLOSED_TAGS_MAX_MARKS]:
+                selection = QTextEdit.ExtraSelection()
+                selection.format = self.keyword_attention_colorRed
+                selection.cursor = QTextCursor(document)
+                selection.cursor.setPosition(self.document_position(number, column))
+                selection.cursor.setPosition(self.document_position(number, column + length), KeepAnchor)
+                selections.append(selection)
+            set_extra_selections(edit_area, "tags", selections)
+        except RuntimeError: # окно уже закрыто
+            pass
+        except Exception as e: logError(e)
 
+    def lazy_defer_block(self):
+        """=ru= Надо ли в ленивом проходе отложить раскраску текущей строки"""
+        block = self.currentBlock()
+        number = block.blockNumber()
+        if self.lazy_window is None:
+            first, count = self.visible_block_range()
+            self.lazy_window = (first - count, first + 2 * count) # видимые строки и по экрану выше и ниже
+        first, last = self.lazy_window
+        defer = not (first <= number <= last)
+        if defer:
+            data = self.currentBlockUserData()
+            if data is None:
+                data = HighlightBlockData()
+                self.setCurrentBlockUserData(data)
+            data.pending = True
+            self.lazy_pending = True
+        if not block.next().isValid(): # последняя строка - проход закончен
+            self.lazy_finish_pass()
+        return defer
+
+    def lazy_finish_pass(self):
+        """=ru= Конец прохода подсветки: отложенные строки дорисуются в простое"""
+        self.lazy_pass = False
+        self.lazy_window = None
+        if self.lazy_pending and not self.lazy_restart_timer.isActive():
+            self.lazy_pending = False
+            self.lazy_start("collect")
+
+    def lazy_start(self, phase):
+        """=ru= Запуск дорисовки отложенных строк с начала документа"""
+        self.lazy_cancel()
+        self.lazy_phase = phase
+        self.lazy_timer.setInterval(0)
+        self.lazy_timer.start()
+
+    def lazy_cancel(self):
+        """=ru= Остановка дорисовки, результаты фоновой задачи больше не нужны"""
+        self.lazy_timer.stop()
+        self.lazy_restart_timer.stop()
+        self.lazy_phase = None
+        self.lazy_block = None
+        self.lazy_snapshot = []
+        self.lazy_job = None
+        self.lazy_ready = {}
+
+    def lazy_restart(self):
+        """=ru= Правки закончились - дорисовка отложенных строк с начала документа"""
+        self.lazy_start("collect")
+
+    def shown_edit_area(self):
+        """=ru= edit_area, если в нем сейчас документ этого подсветчика (см. TemplateDocumentPool), иначе None"""
+        try:
+            if self.cur_edit_area is not None and self.cur_edit_area.document() is self.document():
+                return self.cur_edit_area
+        except RuntimeError: # окно уже закрыто
+            self.cur_edit_area = None
+        return None
+
+    def visible_block_range(self):
+        """=ru= Примерно (номер первой видимой строки, сколько строк видно) до раскладки текста"""
+        edit_area = self.shown_edit_area()
+        if edit_area is not None:
+            line_height = max(1, edit_area.fontMetrics().lineSpacing())
+            first = edit_area.verticalScrollBar().value() // line_height
+            count = edit_area.viewport().height() // line_height + 1
+            return first, count
+        return 0, 100
+
+    def visible_blocks(self):
+        """=ru= Строки, которые сейчас видны в редакторе"""
+        blocks = []
+        edit_area = self.shown_edit_area()
+        if edit_area is None or not edit_area.isVisible():
+            return blocks
+        block = edit_area.cursorForPosition(QPoint(0, 0)).block()
+        last = edit_area.cursorForPosition(QPoint(0, edit_area.viewport().height())).blockNumber()
+        while block.isValid() and block.blockNumber() <= last:
+            blocks.append(block)
+            block = block.next()
+        return blocks
+
+    def schedule_decorations(self):
+        """=ru= Украшения видимым строкам после паузы (прокрутка, показ документа)"""
+        if self.shown_edit_area() is not None:
+            self.decoration_timer.start()
+
+    def decorate_visible_blocks(self):
+        """=ru= Второй уровень подсветки: украшения видимым строкам, раскрашенным при правке без них"""
+        self.decorating = True
+        try:
+            for block in self.visible_blocks():
+                if block_is_undecorated(block):
+                    self.rehighlightBlock(block)
+        except RuntimeError: # окно уже закрыто
+            pass
+        finally:
+            self.decorating = False
 
-    def highlightBlockIdxComm(self, text, idx):
-        """=ru= Метод для раскрашивания даже в комментариях"""
-        if text is None or len(text) == 0:
+    def lazy_highlight_step(self):
+        """
+        =ru= Дорисовка отложенных строк небольшими порциями по таймеру простоя:
+        collect - собираем текст отложенных (и не уложившихся во время) строк, compute - отрезки
+        считает фоновая задача, apply - применяем готовые отрезки, sync - считаем сами (если
+        фоновая задача не удалась)
+        """
+        document = self.document()
+        if document is None:
+            self.lazy_cancel()
             return
-        # надо обработать все правила для self.highlighting_rulesComm - даже в комментариях
-        if pyqt_version == "PyQt6":
-            for pattern, format in self.highlighting_rulesComm:            
-                match_iterator = pattern.globalMatch(text)
-                while match_iterator.hasNext():
-                    match = match_iterator.next()
-                    lci = match.lastCapturedIndex()                    
-                    if lci == 0: # =ru= если не указаны группы ()
-                        self.setFormat(idx + match.capturedStart(), match.capturedLength(), format)
-                    else: # =ru= иначе все группы, остальные пассивные могут быть (?: )
-                        for i in range(1, lci+1):      
-                            self.setFormat(idx + match.capturedStart(i), match.capturedLength(i), format)
-        else: # if pyqt_version == "PyQt5":
-            for pattern, format in self.highlighting_rulesComm:
-                pos = 0  # Начальная позиция для поиска
-                while (pos := pattern.indexIn(text, pos)) != -1:  # Ищем совпадение начиная с позиции pos
-                    captured_texts = pattern.capturedTexts()
-                    lci = len(captured_texts) - 1  # Количество групп (capturedTexts включает группу 0)                    
-                    if lci == 0:  # =ru= если не указаны группы ()
-                        self.setFormat(idx + pos, pattern.matchedLength(), format)
-                    else:  # =ru= иначе все группы, остальные пассивные могут быть (?: )
-                        for i in range(1, lci + 1):
-                            group_start = pattern.pos(i)
-                            group_length = len(captured_texts[i])
-                            if group_start != -1:  # Проверяем, что группа найдена
-                                self.setFormat(idx + group_start, group_length, format)                    
-                    # Сдвигаем позицию для следующего поиска
-                    pos += pattern.matchedLength()      
-    
-                          
+        deadline = time.perf_counter() + LAZY_HIGHLIGHT_SLICE
+        try:
+            # сначала то, что видно на экране (туда мог перейти курсор или прокрутка)
+            for block in self.visible_blocks():
+                if block_is_pending(block):
+                    self.rehighlightBlock(block)
+
+            if self.lazy_phase == "collect":
+                block = self.lazy_block if self.lazy_block is not None else document.firstBlock()
+                while block.isValid() and time.perf_counter() < deadline:
+                    if block_is_lazy(block):
+                        self.lazy_snapshot.append((block.blockNumber(), block.text(), block.previous().userState()))
+                    block = block.next()
+                self.lazy_block = block
+                if not block.isValid():
+                    self.lazy_block = None
+                    self.lazy_start_job()
+
+            elif self.lazy_phase == "apply":
+                ready = self.lazy_ready
+                while ready and time.perf_counter() < deadline:
+                    number = next(iter(ready))
+                    block = document.findBlockByNumber(number)
+                    if block_is_lazy(block):
+                        self.rehighlightBlock(block) # отрезки из ready применит highlightBlock
+                    ready.pop(number, None)
+                if not ready:
+                    self.lazy_cancel()
+                    log.debug(f"lazy highlighting done: {self.span_stats}; {swatch_cache_stats()}; {span_cache}")
+
+            elif self.lazy_phase == "sync":
+                block = self.lazy_block if self.lazy_block is not None else document.firstBlock()
+                while block.isValid() and time.perf_counter() < deadline:
+                    if block_is_lazy(block):
+                        self.lazy_unbudgeted = True
+                        try:
+                            self.rehighlightBlock(block)
+                        finally:
+                            self.lazy_unbudgeted = False
+                    block = block.next()
+                self.lazy_block = block
+                if not block.isValid(): # дошли до конца документа
+                    self.lazy_cancel()
+        except Exception as e:
+            self.lazy_cancel()
+            logError(e)
+
+    def lazy_start_job(self):
+        """=ru= Отрезки для собранных строк считаются в фоновом потоке"""
+        snapshot = self.lazy_snapshot
+        self.lazy_snapshot = []
+        if not snapshot:
+            self.lazy_cancel()
+            return
+        # язык вкладки и сканеры - на момент запуска: смена темы во время задачи ее не касается
+        # (update_theme отменяет задачу), а форматы по именам подставит highlightBlock
+        job = (self.document().revision(), self.base_context(), self.tables.name_painter)
+        self.lazy_job = job
+        self.lazy_phase = "compute"
+        self.lazy_timer.setInterval(50) # пока ждем, только следим за видимыми строками
+        task = lambda: compute_spans(snapshot, job[1], job[2])
+        on_done = lambda future: self.on_spans_computed(job, future)
+        try:
+            mw.taskman.run_in_background(task, on_done, uses_collection=False)
+        except TypeError: # в старых версиях Anki нет uses_collection
+            mw.taskman.run_in_background(task, on_done)
+
+    def on_spans_computed(self, job, future):
+        """=ru= Результат фоновой задачи (в основном потоке)"""
+        if job is not self.lazy_job:
+            return # задачу отменили
+        document = self.document()
+        if document is None:
+            self.lazy_cancel()
+            return
+        try:
+            ready = future.result()
+        except Exception as e:
+            logError(e)
+            self.lazy_start("sync")
+            return
+        if job[0] != document.revision(): # документ уже изменился - результат устарел
+            self.lazy_start("collect")
+            return
+        self.lazy_job = None
+        self.lazy_ready = ready
+        self.lazy_phase = "apply"
+        self.lazy_timer.setInterval(0)
 
-    def isInsideQuotes(self, text, position):
+
+    def apply_spans(self, text, spans, coalesced=False):
         """
-        =ru= Проверяет, находится ли позиция внутри кавычек
-        Учитывает экранированные кавычки \", \'
+        =ru= setFormat для отрезков (позиции в Qt считаются в UTF-16).
+        Возвращает сведенные отрезки; coalesced=True - отрезки уже сведены (из кэша).
         """
-        single_quote = False
-        double_quote = False
-        backtick = False
-        escape = False
-        
-        for i in range(position):
-            char = text[i]
-            
-            if escape:
-                escape = False
-                continue
-                
-            if char == '\\':
-                escape = True
-                continue
-                
-            if char == "'":
-                single_quote = not single_quote
-            elif char == "\"":
-                double_quote = not double_quote
-            elif char == "`":
-                backtick = not backtick
-        
-        return single_quote or double_quote or backtick
-    
+        # каждый символ получает только итоговый формат - один вызов setFormat на отрезок
+        if not coalesced:
+            result = coalesce_spans(spans, len(text))
+            self.span_stats.add(len(spans), len(result))
+            spans = result
+        offsets = utf16_offsets(text)
+        if offsets is None:
+            for start, length, format in spans:
+                self.setFormat(start, length, format)
+        else:
+            for start, length, format in spans:
+                self.setFormat(offsets[start], offsets[start + length] - offsets[start], format)
+        return spans
+
+
+    def highlightBlock(self, text):
+        """=ru= Метод для раскрашивания блока (строки) текста"""
+        number = self.currentBlock().blockNumber() # строка или ее состояние изменились
+        self.brackets.invalidate(number)
+        self.elements.invalidate(number)
+        prev_state = self.previousBlockState()
+        base = self.base_context()
+        cached = None
+        cache_key = None
+        if span_cache.enabled and not profile_highlighting:
+            # =ru= все, от чего зависит раскраска строки (тема - это объект HighlightTables);
+            # при профилировании кэш не используется, иначе правила не выполнялись бы и нечего было бы мерить
+            cache_key = (text, prev_state, base, self.tables)
+
+        # =ru= отрезки, уже посчитанные в фоновом потоке, если строка с тех пор не менялась
+        ready = self.lazy_ready.get(self.currentBlock().blockNumber()) if self.lazy_ready else None
+        if ready is not None and (ready[0] != text or ready[1] != prev_state):
+            ready = None
+        if ready is None and cache_key is not None:
+            cached = span_cache.get(cache_key)
+
+        core = None
+        if self.decorating and ready is None and cached is None:
+            core = getattr(self.currentBlockUserData(), "core", None)
+            if core is not None and (core[0] != text or core[1] != prev_state):
+                core = None
+
+        undecorated = False
+        if ready is not None:
+            state, spans, reduced = ready[2], self.tables.spans_by_name(ready[3]), ready[4]
+            self.setCurrentBlockState(state)
+        elif core is not None:
+            # =ru= синтаксис уже посчитан при правке, добавляем только украшения
+            state, spans, reduced = core[2], list(core[3]), core[4]
+            self.setCurrentBlockState(state)
+            self.painter.decoration_spans(text, spans)
+        elif cached is not None:
+            # =ru= строка уже раскрашивалась с тем же состоянием - ни лексера, ни правил
+            state, spans, reduced = cached
+            self.setCurrentBlockState(state)
+            if self.lazy_pass and not self.currentBlock().next().isValid():
+                self.lazy_finish_pass()
+        else:
+            # =ru= токенизатор продолжает с контекста конца предыдущей строки (стек <style>/<script>,
+            # строки, комментарии), для первой строки previousBlockState() вернет -1
+            tokens, state = lexer.tokenize(text, prev_state, base)
+
+            # =ru= сохраняем состояние строки: если оно изменилось, то QSyntaxHighlighter сам
+            # перекрасит следующие строки, пока состояние не совпадет с прежним
+            self.setCurrentBlockState(state)
+
+            if self.lazy_pass and self.lazy_defer_block():
+                return # строка далеко от видимой области, раскрасим ее в простое
+            # при правке (не при загрузке текста) время уходит только на синтаксис
+            decorate = not self.editing or self.decorating or self.lazy_pass or decoration_delay_ms <= 0
+            spans, reduced = self.painter.block_spans(text, tokens, decorate, not self.lazy_unbudgeted)
+            undecorated = not decorate and not reduced
+
+        # =ru= упрощено из-за нехватки времени (а не из-за длины строки) - зависит от загрузки,
+        # поэтому в простое строка раскрашивается заново без ограничения (см. lazy_highlight_step)
+        retry = reduced and not 0 < long_line_min_chars <= len(text)
+        data = self.currentBlockUserData()
+        if data is None and (reduced or undecorated):
+            data = HighlightBlockData()
+            self.setCurrentBlockUserData(data)
+        if data is not None:
+            data.pending = False
+            data.reduced = reduced
+            data.retry = retry
+            data.core = (text, prev_state, state, spans, reduced) if undecorated else None
+        spans = self.apply_spans(text, spans, cached is not None)
+
+        if retry:
+            self.lazy_pending = True
+            if not self.lazy_pass and self.lazy_phase is None:
+                self.lazy_restart_timer.start()
+        if undecorated:
+            self.decoration_timer.start() # без украшений не кэшируем
+        elif cache_key is not None and cached is None:
+            span_cache_put(cache_key, text, state, spans, reduced)
+
+
+
+
+
+def compute_spans(snapshot, base, painter):
+    """
+    =ru= Выполняется в фоновом потоке: только по снимку текста, без документа и Qt.
+    painter - SpanPainter с именами форматов, отрезки получаются с именами.
+    """
+    ready = {}
+    for number, text, prev_state in snapshot:
+        tokens, state = lexer.tokenize(text, prev_state, base)
+        ready[number] = (text, prev_state, state) + painter.block_spans(text, tokens, budget=False)
+    return ready
 
-    def highlightBlockIdx(self, text, idx, findComm = True):
-        """=ru= Метод для раскрашивания блока с частичным смещением """
-        if text is None or len(text) == 0:
-            return
-        
-        # проверка на начало комментария
-        if findComm:        
-            bidx = self.mult_block_idx                  
-            if bidx > -1: # если комментарий уже начат
-                end = self.mult_block_end[bidx]
-                fendidx = text.find(end)                
-                # комментарий найден закончившимся
-                if fendidx > -1:
-                    self.mult_block_idx = -1
-                    newidx = fendidx + len(end)
-                    text1 = text[:newidx]
-                    text2 = text[newidx:] 
-                    self.setFormat(idx, len(text1)+ len(end), self.comment_color if bidx < 2 else self.string_color )                    
-                    self.highlightBlockIdxComm(text1, idx) # раскраска даже в комментариях
-                    self.highlightBlockIdx(text2, idx + newidx)                    
-                    return
-                else: # вся строка комментарий
-                    self.setFormat(idx, len(text), self.comment_color if bidx < 2 else self.string_color)
-                    self.highlightBlockIdxComm(text, idx) # раскраска даже в комментариях
-                    return
-            else: # комментарий еще не найден, надо искать
-                start_index = -1
-                # Ищем первое совпадение
-                match = self.mult_block_start_regex.search(text)
-                if match:
-                    found = match.group()
-                    match_pos = match.start()                      
-                    
-                    # ПРОВЕРКА: находится ли найденный блок внутри кавычек?
-                    if self.isInsideQuotes(text, match_pos):
-                        # Пропускаем этот match и ищем следующий
-                        remaining_text = text[match_pos + len(found):]
-                        next_match = self.mult_block_start_regex.search(remaining_text)
-                        if next_match:
-                            # Рекурсивно обрабатываем оставшийся текст
-                            text_before = text[:match_pos + len(found)]
-                            text_after = text[match_pos + len(found):]
-                            self.highlightBlockIdx(text_before, idx, False)
-                            self.highlightBlockIdx(text_after, idx + len(text_before), True)
-                        return
-                    
-                    # ПРОВЕРКА: если это // и перед ним не стоит :                    
-                    if (found == "//") and (match_pos == 0 or (match_pos > 0 and text[match_pos-1] != ":")):
-                        # Однострочный комментарий
-                        pass
-                    else:
-                        bidx = self.mult_block_start.index(found) 
-                        start_index = match.start() 
-                        # нашли, то обработка разделяется на до и после                           
-                        lenStBl = len( self.mult_block_start[bidx] )
-                        text1 = text[:start_index]
-                        text2 = text[start_index+lenStBl:] 
-
-                        self.highlightBlockIdx(text1, idx, False) # тут нет комментария, можно повторно не проверять начало
-                        # не включаем равно для поиска = `
-                        if found[0]=="=":
-                            self.setFormat(idx + start_index+1, lenStBl-1, self.comment_color if bidx < 2 else self.string_color)
-                        else:
-                            self.setFormat(idx + start_index, lenStBl, self.comment_color if bidx < 2 else self.string_color)
-                        self.mult_block_idx = bidx # показываем, что комментарий уже найден и надо искать его конец
-                        self.highlightBlockIdx(text2, idx + start_index + lenStBl)                    
-                        return
 
+class TemplateDocumentPool:
+    """
+    =ru= Свой QTextDocument (со своей подсветкой и историей отмены) для каждой стороны каждой
+    карточки и для стиля. CardLayout при переключении стороны, стиля или карточки вызывает
+    fill_fields_from_template, который делал edit_area.setPlainText: раскладка, раскраска и
+    история отмены терялись. Теперь в edit_area подставляется готовый документ, а текст в модель
+    по-прежнему записывает CardLayout.write_edits_to_template_and_redraw (по textChanged).
+    """
+    def __init__(self, card_layout, edit_area, make_highlighter):
+        self.card_layout = card_layout
+        self.edit_area = edit_area
+        self.make_highlighter = make_highlighter # функция (документ) -> HtmlSyntaxHighlighter
+        self.documents = {} # (номер карточки или None для стиля, 0/1/2): (документ, подсветчик)
+        self.adopted = False # документ, созданный QTextEdit, уже взят в пул
+        edit_area.destroyed.connect(lambda *args: self.stop_highlighters())
+
+    def key(self):
+        index = self.card_layout.current_editor_index
+        return (None if index == 2 else self.card_layout.ord, index)
+
+    def template_text(self):
+        """=ru= Текст текущей стороны или стиля из модели (как в CardLayout.fill_fields_from_template)"""
+        index = self.card_layout.current_editor_index
+        if index == 0:
+            return self.card_layout.current_template()["qfmt"]
+        if index == 1:
+            return self.card_layout.current_template()["afmt"]
+        return self.card_layout.model["css"]
+
+    def create(self, key):
+        edit_area = self.edit_area
+        current = edit_area.document()
+        if not self.adopted:
+            # первый документ - созданный QTextEdit, подсветка к нему уже подключена. Родитель -
+            # edit_area, иначе QTextEdit удалит документ при первом же setDocument
+            self.adopted = True
+            document = current
+            document.setParent(edit_area)
+            highlighter = edit_area.highlighter
+        else:
+            document = QTextDocument(edit_area)
+            document.setDefaultFont(current.defaultFont())
+            document.setDefaultTextOption(current.defaultTextOption()) # табуляция, перенос строк
+            document.setDocumentMargin(current.documentMargin())
+            highlighter = self.make_highlighter(document)
+        highlighter.base = lexer.CSS if key[1] == 2 else lexer.HTML
+        self.documents[key] = (document, highlighter)
+        return document, highlighter
+
+    def show(self, text):
+        """=ru= Подставляет в edit_area документ текущей стороны; setPlainText, только если текст в модели другой"""
+        key = self.key()
+        document, highlighter = self.documents.get(key) or self.create(key)
+        edit_area = self.edit_area
+        if edit_area.document() is not document:
+            clear_extra_selections(edit_area) # курсоры выделений из прежнего документа
+            edit_area.setDocument(document)
+            edit_area.highlighter = highlighter
+            if document.defaultFont() != edit_area.font(): # шрифт мог измениться, пока документ не был показан
+                document.setDefaultFont(edit_area.font())
+            highlighter.schedule_decorations()
+            highlighter.occurrence_text = None # пометки прежнего документа сняты
+            highlighter.schedule_occurrences()
+            highlighter.schedule_unclosed_tags()
+        if document.toPlainText() != text:
+            # шаблон изменился не через этот документ (добавление, удаление, порядок карточек)
+            document.setPlainText(text)
+        prewarm = getattr(edit_area, "prewarm", None)
+        if prewarm is not None:
+            prewarm.refresh_indexes()
+
+    def highlighters(self):
+        return [highlighter for document, highlighter in self.documents.values()]
+
+    def stop_highlighters(self):
+        """=ru= Окно закрыто: отложенная дорисовка больше не нужна"""
+        for highlighter in self.highlighters():
+            try:
+                highlighter.lazy_cancel()
+            except RuntimeError:
+                pass
+        self.documents = {}
 
-        # надо обработать все правила, так как это не комментарий
-        if pyqt_version == "PyQt6":
-            for pattern, format in self.highlighting_rules:            
-                match_iterator = pattern.globalMatch(text)
-                while match_iterator.hasNext():
-                    match = match_iterator.next()
-                    lci = match.lastCapturedIndex()                    
-                    if lci == 0: # =ru= если не указаны группы ()
-                        self.setFormat(idx + match.capturedStart(), match.capturedLength(), format)
-                    else: # =ru= иначе все группы, остальные пассивные могут быть (?: )
-                        for i in range(1, lci+1):      
-                            self.setFormat(idx + match.capturedStart(i), match.capturedLength(i), format)
-        else: # if pyqt_version == "PyQt5":
-            for pattern, format in self.highlighting_rules:
-                pos = 0  # Начальная позиция для поиска
-                while (pos := pattern.indexIn(text, pos)) != -1:  # Ищем совпадение начиная с позиции pos
-                    captured_texts = pattern.capturedTexts()
-                    lci = len(captured_texts) - 1  # Количество групп (capturedTexts включает группу 0)                    
-                    if lci == 0:  # =ru= если не указаны группы ()
-                        self.setFormat(idx + pos, pattern.matchedLength(), format)
-                    else:  # =ru= иначе все группы, остальные пассивные могут быть (?: )
-                        for i in range(1, lci + 1):
-                            group_start = pattern.pos(i)
-                            group_length = len(captured_texts[i])
-                            if group_start != -1:  # Проверяем, что группа найдена
-                                self.setFormat(idx + group_start, group_length, format)                    
-                    # Сдвигаем позицию для следующего поиска
-                    pos += pattern.matchedLength()  
-
-
-
-    def highlight_simple_strings(self, text, offset):
-        """Подсветка строковых значений без исключений."""                        
-        regex1 = QRegularExpression(r"\"[^\"\\]*(?:\\.[^\"\\]*)*\"")        
-        regex2 = QRegularExpression(r"'[^'\\]*(?:\\.[^'\\]*)*'")  
-        regex3 = QRegularExpression(r"`[^`\\]*(?:\\.[^`\\]*)*`")  
-
-        regex1.setPatternOptions(QRegularExpression.PatternOption.CaseInsensitiveOption)
-        regex2.setPatternOptions(QRegularExpression.PatternOption.CaseInsensitiveOption)
-        regex3.setPatternOptions(QRegularExpression.PatternOption.CaseInsensitiveOption)
-        iterator = regex1.globalMatch(text)
-        while iterator.hasNext():
-            match = iterator.next()
-            start = match.capturedStart()
-            length = match.capturedLength()
-            self.setFormat(offset + start, length, self.string_color)
-            self.highlightBlockIdxComm(text, offset) # раскраска даже в комментариях
-        iterator = regex2.globalMatch(text)
-        while iterator.hasNext():
-            match = iterator.next()
-            start = match.capturedStart()
-            length = match.capturedLength()
-            self.setFormat(offset + start, length, self.string_color)
-            self.highlightBlockIdxComm(text, offset) # раскраска даже в комментариях
-        iterator = regex3.globalMatch(text)
-        while iterator.hasNext():
-            match = iterator.next()
-            start = match.capturedStart()
-            length = match.capturedLength()
-            self.setFormat(offset + start, length, self.string_color)
-            self.highlightBlockIdxComm(text, offset) # раскраска даже в комментариях
-
-
-    def highlightBlock(self, text):   
-        """=ru= Метод для раскрашивания блока (строки) текста"""     
-                    
-        # если это первая строка
-        if self.currentBlock().blockNumber() == 0:
-            self.mult_block_idx = -1 # =ru= индекс блока            
 
-        self.highlightBlockIdx(text, 0)              
+COMPLETION_WORDS_CACHE_SIZE = 64 # =ru= для скольких текстов шаблонов помнить слова автодополнения
+completion_word_regex = re.compile(r'(?<!</)(?<!<)\b[a-zA-Z_-][0-9a-zA-Z_-]*\b')
 
-        
 
-        # Регулярные выражения для поиска
-        on_regex = re.compile(r"\bon[a-zA-Z]{3,16}\s*=\s*")
-        style_regex = re.compile(r"(\bstyle\s*=\s*)|(\bid\s*=\s*)|(\bclass\s*=\s*)")
-        quotes_regex1 = re.compile(r"\"[^\"\\]*(?:\\.[^\"\\]*)*\"")        
-        quotes_regex2 = re.compile(r"'[^'\\]*(?:\\.[^'\\]*)*'")  
-        quotes_regex3 = re.compile(r"`[^`\\]*(?:\\.[^`\\]*)*`")  
-        position = 0
-        lenText = len(text)
-        cntErr = 10000
-        while position < lenText:       
-            # Ищем ближайшие совпадения
-            on_match = on_regex.search(text, position)
-            style_match = style_regex.search(text, position)
-            # Определяем позиции совпадений
-            on_pos = on_match.start() if on_match else -1
-            style_pos = style_match.start() if style_match else -1     
-            # Выбираем минимальную позицию
-            next_pos = min(pos for pos in [on_pos, style_pos] if pos != -1) if on_pos != -1 or style_pos != -1 else lenText
-            # Обрабатываем текст до найденной позиции
-            sub_text = text[position:next_pos]            
-            self.highlight_simple_strings(sub_text, position)
-            position = next_pos            
-            # Пропускаем найденное слово и его значение в кавычках
-            if position < lenText:                
-                match1 = quotes_regex1.search(text, position)                
-                match2 = quotes_regex2.search(text, position)                  
-                match3 = quotes_regex3.search(text, position)  
-                posN = -1
-                pos1 = match1.start() if match1 else -1
-                if pos1 != -1:
-                    position = match1.end()                 
-                    posN = pos1 
-                pos2 = match2.start() if match2 else -1
-                if pos2 != -1 and (pos2 < posN or posN == -1):
-                    position = match2.end()
-                    posN = pos2
-                pos3 = match3.start() if match3 else -1
-                if pos3 != -1 and (pos3 < posN or posN == -1):
-                    position = match3.end()
-                    posN = pos3
-                if posN == -1:
-                    position += 1                                         
+@functools.lru_cache(maxsize=COMPLETION_WORDS_CACHE_SIZE)
+def completion_words(text):
+    """=ru= Слова текста шаблона для автодополнения (Ctrl+Space); TemplatePrewarm готовит их заранее"""
+    return tuple(completion_word_regex.findall(text))
 
-            cntErr -= 1
-            if(cntErr <= 0):
-                position = lenText
-                log.error("cntErr def highlightBlock(self, text): while position < lenText: ")  # Запись в лог
-                break 
-                
-        # Обрабатываем оставшийся текст
-        if position < lenText:
-            self.highlight_simple_strings(text[position:], position)
 
-               
+PREWARM_DELAY = 1000 # =ru= мс после открытия окна до начала подготовки
+PREWARM_RESUME = 2000 # =ru= мс без ввода, после которых подготовка продолжается
+PREWARM_SLICE = 0.008 # =ru= секунд работы за одно срабатывание таймера
 
-        # Подсветка слов с цветами #
-        color_regex = QRegularExpression( r'#[a-fA-F0-9]{3,8}\b' )
-        color_regex.setPatternOptions(QRegularExpression.PatternOption.CaseInsensitiveOption)
-        color_iter = color_regex.globalMatch(text)
-        while color_iter.hasNext():
-            match = color_iter.next()   
-            color_code = match.captured(0)
-            qcolor = QColor(color_code)
-            if not qcolor.isValid():
-                continue
-            fmt = QTextCharFormat()
-            fmt.setBackground(qcolor)
-            # Автоматически выбираем белый/чёрный текст по яркости
-            if qcolor.lightness() < 128:
-                if qcolor.alpha() < 64:
-                    fmt.setForeground(QColor("gray"))
-                else:
-                    fmt.setForeground(GC_white)
-            else:
-                if qcolor.alpha() < 64:
-                    fmt.setForeground(QColor("gray"))
-                else:
-                    fmt.setForeground(GC_black)
-
-            self.setFormat(match.capturedStart(0), match.capturedLength(0), fmt)
-
-        # Подсветка слов заданные словом цвета               
-        #color_regex = QRegularExpression( r'\b([a-zA-Z]{3,20})(?:[;"\'])' ) убрал, сделаем проще
-        color_regex = QRegularExpression( r'\b([a-zA-Z]{3,20})\b' )
-        color_regex.setPatternOptions(QRegularExpression.PatternOption.CaseInsensitiveOption)
-        color_iter = color_regex.globalMatch(text)
-        while color_iter.hasNext():
-            match = color_iter.next()   
-            color_code = match.captured(1)
-            qcolor = QColor(color_code)
-            if not qcolor.isValid():
-                continue
-            fmt = QTextCharFormat()
-            fmt.setBackground(qcolor)
-            
-            # Автоматически выбираем белый/чёрный текст по яркости
-            if qcolor.lightness() < 128:
-                if qcolor.alpha() < 64:
-                    fmt.setForeground(QColor("gray"))
-                else:
-                    fmt.setForeground(GC_white)
-            else:
-                if qcolor.alpha() < 64:
-                    fmt.setForeground(QColor("gray"))
-                else:
-                    fmt.setForeground(GC_black)    
-
-            self.setFormat(match.capturedStart(1), match.capturedLength(1), fmt)    
-
-        # Подсветка слов с rgb shl
-        color_regex = QRegularExpression( r'rgba?\([^\)]+\)|hsla?\([^\)]+\)' )
-        color_regex.setPatternOptions(QRegularExpression.PatternOption.CaseInsensitiveOption)
-        color_iter = color_regex.globalMatch(text)
-        while color_iter.hasNext():
-            match = color_iter.next()   
-            color_code = match.captured(0)
-            qcolor = QColor( convert_color_to_hex(color_code) )
-            if not qcolor.isValid():
-                continue
-            fmt = QTextCharFormat()
-            fmt.setBackground(qcolor)
-            
-            # Автоматически выбираем белый/чёрный текст по яркости
-            if qcolor.lightness() < 128:
-                if qcolor.alpha() < 64:
-                    fmt.setForeground(QColor("gray"))
-                else:
-                    fmt.setForeground(GC_white)
-            else:
-                if qcolor.alpha() < 64:
-                    fmt.setForeground(QColor("gray"))
-                else:
-                    fmt.setForeground(GC_black)                    
-            
-            #self.setFormat(match.capturedStart(0), match.capturedLength(0), fmt)
-            self.setFormat(match.capturedStart(0), 4, fmt)
 
-        
-        # Подсветка выделенного текста edit_area_highlighterF4_text
-        if self.edit_area_highlighterF4_text and len(self.edit_area_highlighterF4_text) >= 1:
-            fmt = QTextCharFormat()
-            if theme_night:
-                fmt.setBackground(QColor("#5e5e30"))
-                fmt.setForeground(QColor("yellow"))
-            else:
-                fmt.setBackground(QColor("#cfcf6d"))
-                fmt.setForeground(QColor("blue"))
-           
-
-            pattern = QRegularExpression(re.escape(self.edit_area_highlighterF4_text))    
-            match_iter = pattern.globalMatch(text)
-            while match_iter.hasNext():
-                match = match_iter.next()
-                start = match.capturedStart()
-                length = match.capturedLength()
-                self.setFormat(start, length, fmt)
-
-            # особо для парных
-            if len(self.edit_area_highlighterF4_text) == 1:
-                strp1 = "{[(<}])>"
-                strp2 = "}])>{[(<"
-                findp = strp1.find(self.edit_area_highlighterF4_text)
-                if findp >= 0:              
-                    fmt = QTextCharFormat()
-                    if theme_night:
-                        fmt.setBackground(QColor("#cfcf6d"))
-                        fmt.setForeground(QColor("#e80af7"))
-                    else:
-                        fmt.setBackground(QColor("#cfcf6d"))
-                        fmt.setForeground(QColor("#e80af7"))
+class TemplatePrewarm(QObject):
+    """
+    =ru= Подготовка в простое остальных шаблонов после открытия окна карточек: обе стороны
+    каждой карточки и стиль токенизируются и раскрашиваются построчно прямо в кэш отрезков,
+    так что первое переключение на них берет готовую раскраску; заодно собираются их слова
+    для автодополнения (completion_words). Потом - индексы скобок и тегов документов пула
+    (и снова после каждого переключения, см. refresh_indexes), чтобы первый поиск пары не
+    разбирал весь шаблон. Работает небольшими порциями по таймеру простоя и останавливается
+    при любом вводе (клавиши, мышь, колесо), а продолжает, когда ввода нет PREWARM_RESUME мс.
+    """
+    def __init__(self, card_layout, edit_area):
+        super().__init__(edit_area)
+        self.card_layout = card_layout
+        self.edit_area = edit_area
+        self.queue = [] # (текст шаблона, язык вкладки)
+        self.lines = None # строки текущего шаблона
+        self.line = 0
+        self.state = -1 # состояние конца предыдущей строки
+        self.base = lexer.HTML
+        self.prepared = 0 # сколько строк раскрашено (не было в кэше)
+        self.timer = QTimer(self)
+        self.timer.setInterval(0) # срабатывает, когда нет других событий
+        self.timer.timeout.connect(self.step)
+        self.resume_timer = QTimer(self)
+        self.resume_timer.setInterval(PREWARM_RESUME)
+        self.resume_timer.setSingleShot(True)
+        self.resume_timer.timeout.connect(self.timer.start)
+        if pyqt_version == "PyQt6":
+            self.input_events = frozenset((QEvent.Type.KeyPress, QEvent.Type.MouseButtonPress, QEvent.Type.Wheel))
+        else:
+            self.input_events = frozenset((QEvent.KeyPress, QEvent.MouseButtonPress, QEvent.Wheel))
 
-                    pattern = QRegularExpression(re.escape( strp2[findp] ))
-                    match_iter = pattern.globalMatch(text)
-                    while match_iter.hasNext():
-                        match = match_iter.next()
-                        start = match.capturedStart()
-                        length = match.capturedLength()
-                        self.setFormat(start, length, fmt)
+    def start(self):
+        """=ru= Очередь шаблонов: сначала другие стороны текущей карточки и стиль, потом остальные карточки"""
+        try:
+            card_layout = self.card_layout
+            current = (card_layout.ord, card_layout.current_editor_index)
+            queue = []
+            ords = [card_layout.ord] + [i for i in range(len(card_layout.templates)) if i != card_layout.ord]
+            for ord in ords:
+                template = card_layout.templates[ord]
+                for index, name in ((0, "qfmt"), (1, "afmt")):
+                    if (ord, index) != current:
+                        queue.append((template[name], lexer.HTML))
+                if ord == card_layout.ord and current[1] != 2:
+                    queue.append((card_layout.model["css"], lexer.CSS))
+            self.queue = queue
+            self.lines = None
+            self.prepared = 0
+            completion_words(self.edit_area.toPlainText())
+            QApplication.instance().installEventFilter(self)
+            self.timer.start()
+        except RuntimeError: # окно уже закрыто
+            pass
+        except Exception as e: # другая версия CardLayout
+            logError(e)
 
-        
-        # подсветка особых пробельных символов (не включать \u200D так как это для emoji Zero Width Joiner (ZWJ, U+200D)  )        
-        attBg_regex = QRegularExpression("[\u00A0\u2000\u2001\u2002\u2003\u2004\u2005\u2006\u2007\u2008\u2009\u200A\u200B\u200C\u200E\u200F\u202F\u205F\u3000]+")
-        attBg_regex.setPatternOptions(QRegularExpression.PatternOption.CaseInsensitiveOption)
-        attBg_iter = attBg_regex.globalMatch(text)
-        while attBg_iter.hasNext():
-            match = attBg_iter.next()
-            self.setFormat(match.capturedStart(0), match.capturedLength(0), self.keyword_attention_colorRed)
-        # табуляция допустима в некоторых тэгах, так что синим
-        attBg_regex = QRegularExpression(R"[\t]+")
-        attBg_regex.setPatternOptions(QRegularExpression.PatternOption.CaseInsensitiveOption)
-        attBg_iter = attBg_regex.globalMatch(text)
-        while attBg_iter.hasNext():
-            match = attBg_iter.next()
-            self.setFormat(match.capturedStart(0), match.capturedLength(0), self.keyword_attention_colorBlue)
-      
+    def stop(self):
+        self.timer.stop()
+        self.resume_timer.stop()
+        self.queue = []
+        self.lines = None
+        app = QApplication.instance()
+        if app is not None:
+            app.removeEventFilter(self)
+
+    def refresh_indexes(self):
+        """=ru= Документ пула показан (мог быть создан или загружен заново) - обновить индексы в простое"""
+        if not self.timer.isActive() and not self.resume_timer.isActive():
+            QApplication.instance().installEventFilter(self)
+            self.timer.start()
+
+    def stale_indexes(self):
+        """=ru= (подсветчик, индекс) документов пула, которые надо разобрать"""
+        pool = getattr(self.edit_area, "document_pool", None)
+        highlighters = pool.highlighters() if pool is not None else [getattr(self.edit_area, "highlighter", None)]
+        return [(highlighter, index) for highlighter in highlighters if highlighter is not None
+                for index in (highlighter.brackets, highlighter.elements)
+                if index.stale or len(index.lines) != highlighter.document().blockCount()]
 
+    def eventFilter(self, obj, event):
+        if event.type() in self.input_events:
+            # пользователь что-то делает - уступаем ему
+            self.timer.stop()
+            self.resume_timer.start()
+        return super().eventFilter(obj, event)
 
+    def step(self):
+        highlighter = getattr(self.edit_area, "highlighter", None)
+        if highlighter is None:
+            self.stop()
+            return
+        deadline = time.perf_counter() + PREWARM_SLICE
+        try:
+            if not span_cache.enabled:
+                self.queue = []
+            while time.perf_counter() < deadline:
+                if self.lines is None:
+                    if not self.queue:
+                        if self.prepared:
+                            log.debug(f"templates prewarmed: {self.prepared} lines; {span_cache}")
+                            self.prepared = 0
+                        stale = self.stale_indexes()
+                        if not stale:
+                            self.stop()
+                            return
+                        for owner, index in stale:
+                            owner.refresh_index(index, deadline)
+                            if time.perf_counter() >= deadline:
+                                break
+                        continue
+                    text, self.base = self.queue.pop(0)
+                    completion_words(text)
+                    self.lines = text.split("\n")
+                    self.line = 0
+                    self.state = -1
+                text = self.lines[self.line]
+                # тот же ключ, что у highlightBlock нового документа
+                key = (text, self.state, self.base, highlighter.tables)
+                cached = span_cache.peek(key)
+                if cached is not None:
+                    state = cached[0]
+                else:
+                    tokens, state = lexer.tokenize(text, self.state, self.base)
+                    spans, reduced = highlighter.painter.block_spans(text, tokens)
+                    span_cache_put(key, text, state, coalesce_spans(spans, len(text)), reduced)
+                    self.prepared += 1
+                self.state = state
+                self.line += 1
+                if self.line >= len(self.lines):
+                    self.lines = None
+        except RuntimeError: # окно уже закрыто
+            self.stop()
+        except Exception as e:
+            logError(e)
+            self.stop()
 
 
 def show_text_dialog(title: str, content: str, html: bool = False):
@@ -2652,582 +3436,87 @@ class HtmlJavaScriptHighlightingAddon:
         self.sel_par_timer.start()
 
 
-    def find_first_backslash_position(self, text, pos_in_line):
-        """
-        Ищет с конца строки первое вхождение из 2 символов "\\\\" (ближайшее к началу строки),
-        которое не является частью ":\\\\", игнорируя символы внутри 
-        строковых литералов и комментариев.
-        
-        Args:
-            text: строка для поиска
-            pos_in_line: позиция, с которой начинать поиск (обычно позиция курсора)
-        
-        Returns:
-            int: позиция найденного "\\\\" или -1 если не найдено
-        """
-        if pos_in_line <= 1:  # Нужно как минимум 2 символа для поиска
-            return -1
-        
-        i = pos_in_line - 1  # начинаем с позиции перед курсором
-        stack = []  # стек для отслеживания открытых строк/комментариев
-        found_pos = -1  # позиция найденной пары обратных слешей
-        
-        while i >= 1:  # Нужно как минимум 2 символа для проверки
-            char = text[i]
-            
-            # Проверяем, находимся ли мы внутри строки/комментария
-            if stack:
-                # Если внутри строки/комментария, проверяем закрытие
-                top = stack[-1]
-                
-                if top == '`' and char == '`':
-                    # Проверяем экранирование для ` (нет экранирования в `)
-                    stack.pop()
-                    i -= 1
-                    continue
-                    
-                elif top == '"' and char == '"':
-                    # Проверяем экранирование для "
-                    if i > 0 and text[i-1] == '\\':
-                        # Экранированная кавычка, пропускаем
-                        i -= 2
-                        continue
-                    else:
-                        stack.pop()
-                        i -= 1
-                        continue
-                        
-                elif top == "'" and char == "'":
-                    # Проверяем экранирование для '
-                    if i > 0 and text[i-1] == '\\':
-                        # Экранированная кавычка, пропускаем
-                        i -= 2
-                        continue
-                    else:
-                        stack.pop()
-                        i -= 1
-                        continue
-                        
-                elif top == '*/' and i >= 1 and text[i-1:i+1] == '/*':
-                    # Закрытие многострочного комментария
-                    stack.pop()
-                    i -= 2
-                    continue
-                    
-                elif top == '-->' and i >= 3 and text[i-3:i+1] == '<!--':
-                    # Закрытие HTML комментария
-                    stack.pop()
-                    i -= 4
-                    continue
-                    
-                # Если внутри строки/комментария, просто пропускаем символ
-                i -= 1
-                continue
-            
-            # Если не внутри строки/комментария, проверяем открытие
-            if char == '`':
-                stack.append('`')
-                i -= 1
-                continue
-                
-            elif char == '"':
-                # Проверяем экранирование
-                if i > 0 and text[i-1] == '\\':
-                    # Экранированная кавычка, не открываем строку
-                    i -= 2
-                    continue
-                else:
-                    stack.append('"')
-                    i -= 1
-                    continue
-                    
-            elif char == "'":
-                # Проверяем экранирование
-                if i > 0 and text[i-1] == '\\':
-                    # Экранированная кавычка, не открываем строку
-                    i -= 2
-                    continue
-                else:
-                    stack.append("'")
-                    i -= 1
-                    continue
-                    
-            elif i >= 1 and text[i-1:i+1] == '*/':
-                stack.append('*/')
-                i -= 2
-                continue
-                
-            elif i >= 3 and text[i-3:i+1] == '<!--':
-                stack.append('-->')
-                i -= 4
-                continue
-                
-            # Ищем два обратных слеша подряд
-            elif i >= 1 and text[i-1] == '\\' and char == '\\':
-                # Проверяем, не является ли это частью ':\\\\'
-                if i >= 2 and text[i-2] == ':':
-                    # Это ':\\\\', пропускаем
-                    i -= 3
-                    continue
-                else:
-                    # Нашли '\\\\', запоминаем позицию первого слеша
-                    found_pos = i - 1
-                    # Продолжаем искать ближе к курсору
-                    i -= 2
-                    continue
-                    
-            i -= 1
-        
-        return found_pos
-
-
-
     def highlight_pair(self, edit_area):        
         """подсветка парных скобок, тегов"""
         
         if (self is None) or (edit_area is None):
             return
-        cursor = edit_area.textCursor()
-        text = edit_area.toPlainText()
-        sel = cursor.selectedText()
-        extra_selections = []
-        
-        
-
-        # Цвет подсветки
-        fmt = QTextCharFormat()
-        if theme_night:
-            fmt.setBackground(QColor("#cfcf6d"))
-            fmt.setForeground(QColor("#e80af7"))
-        else:
-            fmt.setBackground(QColor("#cfcf6d"))
-            fmt.setForeground(QColor("#e80af7"))
+        highlighter = getattr(edit_area, "highlighter", None)
+        if highlighter is None:
+            return
+        try:
+            cursor = edit_area.textCursor()
+            sel = cursor.selectedText()
+            extra_selections = []
+            fmt = highlighter.tables.pair_format # цвет подсветки - из таблиц темы
 
+            if not sel:
+                char = cursor.document().characterAt(cursor.position()) 
+            else:
+                char = sel[0]
+
+            # === Скобки === (индекс скобок подсветчика: строки и комментарии он уже пропускает)
+            if char in BRACKET_PAIRS:
+                pair = highlighter.bracket_pair(cursor.selectionStart())
+                if pair is not None:
+                    sel1 = QTextEdit.ExtraSelection()
+                    sel1.cursor = edit_area.textCursor()
+                    sel1.cursor.setPosition(pair)
+                    sel1.cursor.setPosition(pair + 1, KeepAnchor)
+                    sel1.format = fmt
+                    extra_selections.append(sel1)
+                set_extra_selections(edit_area, "pair", extra_selections)
+                return
 
-        if not sel:
-            char = cursor.document().characterAt(cursor.position()) 
-        else:
-            char = sel[0]
-        
-        pairs = {'<': '>', '{': '}', '(': ')', '[': ']', '}': '{', ')': '(', ']': '['}
-        open_chars = '{(['
-        close_chars = '})]'
-
-        if char in open_chars:
-            direction = 1
-        elif char in close_chars:
-            direction = -1
-        else:
-            direction = 1
-        
+            # --- Теги --- (дерево элементов подсветчика: курсор на < или в имени тега)
+            pair = highlighter.tag_pair(cursor.selectionStart())
+            if pair is not None:
+                sel1 = QTextEdit.ExtraSelection()
+                sel1.cursor = edit_area.textCursor()
+                sel1.cursor.setPosition(pair[0])
+                sel1.cursor.setPosition(pair[1], KeepAnchor)
+                sel1.format = fmt
+                extra_selections.append(sel1)
+            set_extra_selections(edit_area, "pair", extra_selections)
+        except Exception as e: logError(e)
 
-        # === Скобки ===
-        if char in pairs:
-            try:
-                edit_area.setUpdatesEnabled(False)
-                match = pairs[char]
-                stack = 1                
-                cur = QTextCursor(edit_area.document())                                
-                cur.setPosition(cursor.selectionStart())
-                next_c = ""
-                prev_c = ""
-                comm = False
-                find_comm = ""                
-                len_find_comm = 0
-                findNR = False    
-                nextN = 0            
-                n = 0
-                while True:
-                    moved = cur.movePosition(NextCharacter if direction == 1 else PreviousCharacter)
-                    if not moved:
-                        break
-                    c = cur.document().characterAt(cur.position())
-                    next_c = ""
-                    if direction == -1: # если назад поиск, то заглянем на 1 далее
-                        movedN = cur.movePosition(PreviousCharacter)
-                        if movedN:
-                            next_c = cur.document().characterAt(cur.position())
-                            cur.movePosition(NextCharacter) # возрат позиции назад
-
-                    prev_c += c
-                    if c == "\u2029": # PARAGRAPH SEPARATOR.
-                        findNR = True                                            
-
-                    n += 1
-                    if n > 40:
-                        prev_c = prev_c[-5:]
-                        n = 5
-
-                    if nextN != 0: # проматываем к // если поиск с конца в начало
-                        if nextN > 0:
-                            nextN -= 1                           
-                        continue 
-
-                    if not comm:
-                        if direction == 1:
-                            if n == 1:
-                                s1 = prev_c[-1:] 
-                                if s1 == "'":
-                                    comm = True
-                                    find_comm = "'"
-                                    len_find_comm = 1
-                                    continue   
-                                if s1 == '"':
-                                    comm = True
-                                    find_comm = '"'
-                                    len_find_comm = 1
-                                    continue   
-                                if s1 == '`':
-                                    comm = True
-                                    find_comm = '`'
-                                    len_find_comm = 1
-                                    continue 
-
-                            if n == 2:   
-                                s2 = prev_c[-2:]  
-                                if s2 == "//":
-                                    comm = True
-                                    find_comm = "\u2029" # PARAGRAPH SEPARATOR.
-                                    len_find_comm = 1
-                                    continue  
-
-                            if n >= 2:
-                                s1 = prev_c[-1:]
-                                s2 = prev_c[-2:] 
-                                if s1 == "'" and s2 != "\\'":
-                                    comm = True
-                                    find_comm = "'"
-                                    len_find_comm = 1
-                                    continue   
-                                if s1 == '"' and s2 != '\\"':
-                                    comm = True
-                                    find_comm = '"'
-                                    len_find_comm = 1                                    
-                                    continue    
-                                if s1 == '`':
-                                    comm = True
-                                    find_comm = '`'
-                                    len_find_comm = 1
-                                    continue                                                             
-                                if s2 == "//" and (n ==2 or prev_c[-3:] != "://"):
-                                    comm = True
-                                    find_comm = "\u2029" # PARAGRAPH SEPARATOR.
-                                    len_find_comm = 1
-                                    continue
-                                if s2 == "/*":
-                                    comm = True
-                                    find_comm = "*/"
-                                    len_find_comm = 2
-                                    continue    
-
-                            if n >= 3:
-                                s2 = prev_c[-2:]
-                                s3 = prev_c[-3:] 
-                                if s2 == "//" and s3 != "://":
-                                    comm = True
-                                    find_comm = "\u2029" # PARAGRAPH SEPARATOR.
-                                    len_find_comm = 1
-                                    continue                                
-
-                            if n >= 4: 
-                                if prev_c[-4:] == "<!--":                            
-                                    find_comm = "-->"
-                                    len_find_comm = 3
-                                    # if char == "<":
-                                    #     stack -= 1
-                                    continue
-
-                        else: # поиск назад
-                            if n == 1 or (findNR and c != "\u2029" and c != "\u2028"):
-                                findNR = False
-                                nextN = 0
-                                cur_line = cur.block().text() # Получаем текущую строку, где находится курсор 
-                                pos_in_line = cur.position() - cur.block().position() # Позиция курсора в строке 
-                                backslash_pos = self.find_first_backslash_position(cur_line, pos_in_line)
-                                if backslash_pos != -1:
-                                    nextN = pos_in_line - backslash_pos; 
-                                    continue     
-
-                            if n >= 1:
-                                s1 = prev_c[-1:] 
-                                if s1 == "'" and next_c != "\\":
-                                    comm = True
-                                    find_comm = "'"
-                                    len_find_comm = 1
-                                    continue   
-                                if s1 == '"' and next_c != "\\":
-                                    comm = True
-                                    find_comm = '"'
-                                    len_find_comm = 1
-                                    continue
-                                if s1 == '`':
-                                    comm = True
-                                    find_comm = '`'
-                                    len_find_comm = 1
-                                    continue
-                            if n >= 2:
-                                s2 = prev_c[-2:]
-                                if s2 == "/*":
-                                    comm = True
-                                    find_comm = "*/"
-                                    len_find_comm = 2
-                                    continue
-                            if n >= 3: 
-                                if prev_c[-3:] == ">--":                            
-                                    find_comm = "--!<"
-                                    len_find_comm = 4
-                                    # if char == ">":
-                                    #     stack -= 1
-                                    continue
-
-                            # if n >= 2:                                
-                            #     # if findNR and c != "\u2029" and c != "\u2028":                                     
-                            #     #     findNR = False
-                            #     #     findSS = False                                    
-                            #     #     cur_line = cur.block().text() # Получаем текущую строку, где находится курсор                                    
-                            #     #     pos_in_line = cur.position() - cur.block().position() # Позиция курсора в строке                                    
-                            #     #     idx = cur_line.find("//") # Проверяем, есть ли // в строке до позиции курсора
-                            #     #     # если найдено будет :// то это не комментарий, а URL
-                            #     #     if (idx < 1 or cur_line[idx-1] != ":") and (idx != -1) and (idx < pos_in_line):
-                            #     #         # После // не должно быть */ и -->
-                            #     #         after = cur_line[idx+2:]
-                            #     #         if "*/" not in after and "-->" not in after:
-                            #     #             findNR = True                                            
-                            #     #             continue  
-                            #     #     if idx != -1:    
-                            #     #         findSS = True                               
-
-                            #     s2 = prev_c[-2:]
-                            #     if s2 == "//":
-                            #         comm = True
-                            #         # find_comm = "\u2029" # PARAGRAPH SEPARATOR  
-                            #         # len_find_comm = 1
-                            #         find_comm = "//"
-                            #         len_find_comm = 2
-                            #         continue
-                      
-                        
-                    else: # если идет комментарий
-                        s2 = prev_c[-len_find_comm:]                        
-                        if s2 == find_comm and (find_comm=="'" or find_comm=='"'): 
-                            if (direction == 1 and prev_c[-len_find_comm-1:] != '\\"' and prev_c[-len_find_comm-1:] != "\\'") or (direction != 1 and next_c != "\\"):                                
-                                comm = False
-                                find_comm = ""
-                                len_find_comm = 0
-                            else:
-                                continue                                    
-                        else:
-                            if s2 == find_comm:
-                                comm = False
-                                find_comm = ""
-                                len_find_comm = 0
-                            else:
-                                continue     
-
-
-                    if c == char:
-                        stack += 1
-                    elif c == match:
-                        stack -= 1
-                        if stack == 0:
-                            sel1 = QTextEdit.ExtraSelection()
-                            sel1.cursor = edit_area.textCursor()
-                            sel1.cursor.setPosition(cur.position())
-                            cur2 = QTextCursor(cur)
-                            cur2.movePosition(NextCharacter, KeepAnchor)
-                            sel1.cursor.setPosition(cur2.position(), KeepAnchor)
-                            sel1.format = fmt
-                            extra_selections.append(sel1)
-                            break
-               
-                edit_area.setExtraSelections(extra_selections)                                
-            finally:
-                edit_area.setUpdatesEnabled(True)
+    def jump_to_pair(self, edit_area):
+        """=ru= Ctrl+]: курсор к скобке, парной к скобке после курсора (или перед ним)"""
+        highlighter = getattr(edit_area, "highlighter", None)
+        if highlighter is None:
             return
-        
-        else:
-            if not sel:
-                edit_area.setExtraSelections([])                
+        try:
+            cursor = edit_area.textCursor()
+            position = cursor.position()
+            document = edit_area.document()
+            pair = None
+            if document.characterAt(position) in BRACKET_PAIRS:
+                pair = highlighter.bracket_pair(position)
+            if pair is None and position > 0 and document.characterAt(position - 1) in BRACKET_PAIRS:
+                pair = highlighter.bracket_pair(position - 1)
+            if pair is None:
                 return
-            
+            # курсор перед парной скобкой: повторное нажатие вернет обратно
+            cursor.setPosition(pair)
+            edit_area.setTextCursor(cursor)
+            edit_area.ensureCursorVisible()
+        except Exception as e: logError(e)
 
-        # --- Теги ---
-        import re
+    def select_enclosing_element(self, edit_area):
+        """=ru= Ctrl+Shift+E: выделить элемент вокруг курсора (выделения), повторно - родительский"""
+        highlighter = getattr(edit_area, "highlighter", None)
+        if highlighter is None:
+            return
         try:
-            edit_area.setUpdatesEnabled(False)
-            pos = cursor.selectionStart()
-            tag_match = re.match(r'([a-zA-Z0-9]+)', sel)
-            if tag_match:
-                tag_name = tag_match.group(1)
-                left = "" 
-                left2 = ""
-                if pos > 0:                
-                    cur = edit_area.textCursor()                
-                    cur.movePosition(PreviousCharacter) # сбросит выделение
-                    cur.movePosition(PreviousCharacter) # переместит назад                
-                    left = cur.document().characterAt(cur.position()) 
-                    if pos > 1:                 
-                        cur.movePosition(PreviousCharacter) # переместит назад                
-                        left2 = cur.document().characterAt(cur.position())                            
-                single_tags = {"area", "base", "br", "col", "embed", "hr", "img", "input", "link", "meta", "source", "track", "wbr"}
-                is_single_tag = tag_name.lower() in single_tags
-
-                if left == "<":                                    
-                    # ищем закрывающий
-                    stack = 1
-                    cur = edit_area.textCursor()   
-                    cur.movePosition(NextCharacter) # сбросит выделение и перейдет за него
-                    cur.movePosition(PreviousCharacter) # переместит назад  
-                    find_self_closing_tag = True
-                    cprev = "" # предыдущий символ
-                    prev_c = ""
-                    n = 0
-                    comm = False
-                    
-                    while cur.movePosition(NextCharacter): # перемещаемся к следующему символу
-                        c = cur.document().characterAt(cur.position())   
-                        prev_c += c
-                        n += 1
-                        if n > 40:
-                            prev_c = prev_c[-5:]
-                            n = 5
-
-
-                        if not comm:
-                            if n > 4:
-                                if prev_c[-4:] == "<!--":                                    
-                                    comm = True
-                                    cprev = c
-                                    continue                                
-                        else:
-                            if n > 3:
-                                if prev_c[-3:] == "-->":                                    
-                                    comm = False
-                                    cprev = c
-                            continue
-
-
-                        if find_self_closing_tag and c == ">":       
-                            find_self_closing_tag = False                            
-                            # Если одиночный тег (br, img и др.) — подсветить только >
-                            # Самозакрывающийся тег, подсветить только >
-                            if cprev == "/" or is_single_tag:                                      
-                                sel1 = QTextEdit.ExtraSelection()
-                                sel1.cursor = edit_area.textCursor()
-                                sel1.cursor.setPosition(cur.position())    
-                                sel1.cursor.setPosition(cur.position()+1, KeepAnchor)
-                                sel1.format = fmt
-                                extra_selections.append(sel1)
-                                edit_area.setExtraSelections(extra_selections)
-                                return         
-
-                        if c == "<": # требуется проверка на <tag_name или </tag_name 
-                            find_self_closing_tag = False 
-                            temp_cur = QTextCursor(cur) 
-                            open_tag = True                                                        
-                            find_tag_name = ""
-                            if temp_cur.movePosition(NextCharacter):
-                                tc = temp_cur.document().characterAt(temp_cur.position())  
-                                if tc == "/":
-                                     open_tag = False
-                                else:
-                                   find_tag_name += tc
-                                while temp_cur.movePosition(NextCharacter):                                    
-                                    tc = temp_cur.document().characterAt(temp_cur.position())  
-                                    if tc == ">" or tc == " ":
-                                        break
-                                    find_tag_name += tc
-                            if find_tag_name == tag_name:
-                                if open_tag:
-                                    stack += 1
-                                else:
-                                    stack -= 1
-                                if stack == 0:
-                                    sel1 = QTextEdit.ExtraSelection()
-                                    sel1.cursor = edit_area.textCursor()
-                                    sel1.cursor.setPosition(temp_cur.position()-1-len(tag_name))    
-                                    sel1.cursor.setPosition(temp_cur.position(), KeepAnchor)
-                                    sel1.format = fmt
-                                    extra_selections.append(sel1)
-                                    break
-                        cprev = c
-
-                    edit_area.setUpdatesEnabled(True)
-                    edit_area.setExtraSelections(extra_selections)
-                    return
-
-
-                elif left == "/" and left2 == "<":
-                    # Закрывающий тег: ищем назад открывающий
-                    stack = 1
-                    cur = edit_area.textCursor()   
-                    
-                    cur.movePosition(PreviousCharacter) # сбросит выделение
-                    cur.movePosition(PreviousCharacter) # переместит назад (на /)
-                    cur.movePosition(PreviousCharacter) # переместит назад (на <)
-                    prev_c = ""
-                    n = 0
-                    comm = False
-
-                    while cur.movePosition(PreviousCharacter): # перемещаемся к предыдущему символу
-                        c = cur.document().characterAt(cur.position())                           
-                        prev_c += c
-                        n += 1
-                        if n > 40:
-                            prev_c = prev_c[-5:]
-                            n = 5
-
-                        if not comm:
-                            if n > 3:
-                                if prev_c[-3:] == ">--":
-                                    comm = True
-                                    continue                                
-                        else:
-                            if n > 4:
-                                if prev_c[-4:] == "--!<":
-                                    comm = False
-                            continue
-
-                        if c == "<": # требуется проверка на <tag_name или </tag_name 
-                            temp_cur = QTextCursor(cur)                            
-                            open_tag = True                                                        
-                            find_tag_name = ""
-                            if temp_cur.movePosition(NextCharacter):
-                                tc = temp_cur.document().characterAt(temp_cur.position())  
-                                if tc == "/":
-                                     open_tag = False
-                                else:
-                                   find_tag_name += tc
-                                while temp_cur.movePosition(NextCharacter):                                    
-                                    tc = temp_cur.document().characterAt(temp_cur.position())  
-                                    if tc == ">" or tc == " ":
-                                        break
-                                    find_tag_name += tc
-                            if find_tag_name == tag_name:
-                                if open_tag:
-                                    stack -= 1
-                                else:
-                                    stack += 1
-                                if stack == 0:
-                                    sel1 = QTextEdit.ExtraSelection()
-                                    sel1.cursor = edit_area.textCursor()
-                                    sel1.cursor.setPosition(temp_cur.position()-len(tag_name))    
-                                    sel1.cursor.setPosition(temp_cur.position(), KeepAnchor)
-                                    sel1.format = fmt
-                                    extra_selections.append(sel1)
-                                    break
-                   
-
-                    edit_area.setUpdatesEnabled(True)
-                    edit_area.setExtraSelections(extra_selections)
-                    return
-
-            # Если ничего не найдено — снять подсветку
-            edit_area.setExtraSelections([])
-
-        finally:
-            edit_area.setUpdatesEnabled(True)
-
+            cursor = edit_area.textCursor()
+            found = highlighter.enclosing_element(cursor.selectionStart(), cursor.selectionEnd())
+            if found is None:
+                return
+            cursor.setPosition(found[0])
+            cursor.setPosition(found[1], KeepAnchor)
+            edit_area.setTextCursor(cursor)
+            edit_area.ensureCursorVisible()
+        except Exception as e: logError(e)
 
 
     def setup_close_event_handler(self, card_layout: QWidget):
@@ -3252,6 +3541,7 @@ class HtmlJavaScriptHighlightingAddon:
             self.update_timer.stop() 
             self.sel_par_timer.stop()                                               
             original_hide_event(event) # Вызов оригинального обработчика
+            save_span_cache() # и при закрытии, и при сохранении шаблонов окно скрывается
         card_layout.hideEvent = custom_hide_event
 
 
@@ -3921,8 +4211,20 @@ class HtmlJavaScriptHighlightingAddon:
         context_menu.addAction(replace_action)  
 
 
+        # Перейти к парной скобке
+        pair_action = QAction(localizationF("Menu_CtrlBracket", "jump to the matching bracket"), edit_area)
+        pair_action.setShortcut("Ctrl+]")
+        pair_action.triggered.connect(lambda: self.jump_to_pair(edit_area))
+        context_menu.addAction(pair_action)
+
+        # Выделить элемент вокруг курсора
+        enclosing_action = QAction(localizationF("Menu_CtrlShiftE", "select the enclosing element (again - its parent)"), edit_area)
+        enclosing_action.setShortcut("Ctrl+Shift+E")
+        enclosing_action.triggered.connect(lambda: self.select_enclosing_element(edit_area))
+        context_menu.addAction(enclosing_action)
+
         # Подсветить все как выделенное F4
-        showF4_action = QAction(localizationF("Highlight_all_selected","Highlight all as selected"), edit_area)        
+        showF4_action = QAction(localizationF("Highlight_all_selected","Highlight all as selected (again with nothing selected - clear)"), edit_area)        
         showF4_action.setShortcut("F4")
         showF4_action.triggered.connect(lambda: edit_area.highlighter.rehighlight_code())
         context_menu.addAction(showF4_action)
@@ -3984,11 +4286,48 @@ class HtmlJavaScriptHighlightingAddon:
         shortcut_CtrlO.activated.connect(lambda: self.load_file_into_editor(edit_area))  
         shortcut_CtrlG = QShortcut(QKeySequence("Ctrl+G"), edit_area)
         shortcut_CtrlG.activated.connect(lambda: gotoN(edit_area, mw.app.activeWindow()))
+        shortcut_CtrlBracket = QShortcut(QKeySequence("Ctrl+]"), edit_area)
+        shortcut_CtrlBracket.activated.connect(lambda: self.jump_to_pair(edit_area))
+        shortcut_CtrlShiftE = QShortcut(QKeySequence("Ctrl+Shift+E"), edit_area)
+        shortcut_CtrlShiftE.activated.connect(lambda: self.select_enclosing_element(edit_area))
 
         shortcut_CtrlF3 = QShortcut(QKeySequence("Ctrl+F3"), edit_area)
         shortcut_CtrlF3.activated.connect(lambda: CtrlF3())
         shortcut_CtrlF4 = QShortcut(QKeySequence("Ctrl+F4"), edit_area)
         shortcut_CtrlF4.activated.connect(lambda: CtrlF4())
+        shortcut_CtrlShiftF4 = QShortcut(QKeySequence("Ctrl+Shift+F4"), edit_area)
+        shortcut_CtrlShiftF4.activated.connect(lambda: self.show_highlight_profile(edit_area))
+
+
+    def show_highlight_profile(self, edit_area):
+        """=ru= Профиль правил подсветки: в окне и в лог дополнения (самые долгие проходы сверху)"""
+        try:
+            if not profile_highlighting:
+                # включаем и сразу перекрашиваем весь шаблон, чтобы было что показать
+                set_profile_highlighting(True)
+                rule_profile.reset()
+                highlighter = getattr(edit_area, "highlighter", None)
+                if highlighter is not None:
+                    QGuiApplication.setOverrideCursor(WaitCursor)
+                    try:
+                        highlighter.lazy_cancel()
+                        highlighter.rehighlight()
+                    finally:
+                        QGuiApplication.restoreOverrideCursor()
+            log.info(str(rule_profile))
+            rows = rule_profile.report()
+            total = sum(row["total_ms"] for row in rows)
+            content = "<h3>" + localizationF("Highlight_profile", "Highlighting rules profile") + "</h3>"
+            content += f"<p>{total:.1f} ms</p><table border='1' cellspacing='0' cellpadding='3'>"
+            content += "<tr><th>ms</th><th>worst ms</th><th>scans</th><th>matches</th><th></th><th>rule</th><th>worst line</th></tr>"
+            for row in rows:
+                content += (f"<tr><td>{row['total_ms']:.2f}</td><td>{row['worst_ms']:.3f}</td><td>{row['scans']}</td>"
+                            f"<td>{row['matches']}</td><td>{row['scanner']}</td><td>{html.escape(row['pass'])}</td>"
+                            f"<td><code>{html.escape(row['worst_line'])}</code></td></tr>")
+            content += "</table>"
+            show_text_dialog(localizationF("Highlight_profile", "Highlighting rules profile"), content, True)
+        except Exception as e:
+            logError(e)
 
 
 
@@ -4271,6 +4610,44 @@ class HtmlJavaScriptHighlightingAddon:
 
         
 
+    def create_highlighter(self, card_layout: CardLayout, edit_area: QTextEdit, document: QTextDocument):
+        """Подсветка для документа редактора шаблонов"""
+        highlighter = HtmlSyntaxHighlighter(document)
+        highlighter.setup_selection_change_handler(edit_area)
+        highlighter.cur_edit_area = edit_area
+        highlighter.style_button = card_layout.tform.style_button
+        # строки, прокрученные в видимую область, получают украшения (образцы цветов) и пометки вхождений
+        edit_area.verticalScrollBar().valueChanged.connect(lambda value: highlighter.schedule_decorations())
+        edit_area.verticalScrollBar().valueChanged.connect(lambda value: highlighter.schedule_occurrences())
+        return highlighter
+
+    def setup_document_pool(self, card_layout: CardLayout, edit_area: QTextEdit):
+        """Подменяет fill_fields_from_template: вместо setPlainText в edit_area подставляется документ из пула"""
+        if not template_documents or not hasattr(card_layout, "fill_fields_from_template"):
+            return
+        pool = TemplateDocumentPool(card_layout, edit_area,
+                                    lambda document: self.create_highlighter(card_layout, edit_area, document))
+        edit_area.document_pool = pool
+        original_fill_fields_from_template = card_layout.fill_fields_from_template
+        update_line_numbers = self.update_line_number_area_width
+
+        def custom_fill_fields_from_template(self) -> None:
+            try:
+                text = pool.template_text()
+            except Exception as e: # другая версия CardLayout
+                logError(e)
+                original_fill_fields_from_template()
+                return
+            self.ignore_change_signals = True
+            try:
+                pool.show(text)
+            finally:
+                self.ignore_change_signals = False
+            if hasattr(edit_area, "line_number_area"): # у другого документа может быть другое число строк
+                update_line_numbers(edit_area)
+
+        card_layout.fill_fields_from_template = MethodType(custom_fill_fields_from_template, card_layout)
+
     def setup_formatting_buttons(self, card_layout: CardLayout):
         edit_areas = card_layout.findChildren(QTextEdit, 'edit_area')        
         if not edit_areas:
@@ -4281,11 +4658,13 @@ class HtmlJavaScriptHighlightingAddon:
         self.enhance_text_edit(edit_area)
         self.setup_context_menu(card_layout)  # Настраиваем контекстное меню
 
-        highlighter = HtmlSyntaxHighlighter(edit_area.document())
+        highlighter = self.create_highlighter(card_layout, edit_area, edit_area.document())
         # edit_area.document().contentsChange.connect(lambda: highlighter.rehighlight())
         edit_area.highlighter = highlighter 
-        highlighter.setup_selection_change_handler(edit_area)
-        highlighter.cur_edit_area = edit_area
+        self.setup_document_pool(card_layout, edit_area)
+        if prewarm_templates:
+            edit_area.prewarm = TemplatePrewarm(card_layout, edit_area)
+            QTimer.singleShot(PREWARM_DELAY, edit_area.prewarm.start)
 
         
         original_key_press = edit_area.keyPressEvent
@@ -4564,7 +4943,10 @@ class HtmlJavaScriptHighlightingAddon:
         Menu_CtrlShiftV = localizationF("Menu_CtrlShiftV", "insert as text (without replacing tabs)") 
         Menu_CtrlShiftInsert = localizationF("Menu_CtrlShiftInsert", "insert plain HTML (b, i, u and some others)") 
         Menu_CtrlShifAltInsert = localizationF("Menu_CtrlShifAltInsert", "insert plain HTML with color preservation") 
-        Menu_F4 = localizationF("Menu_F4", "update the highlight and highlight all as selected")
+        Menu_F4 = localizationF("Menu_F4", "highlight all as selected and keep it; F4 with nothing selected clears it")
+        Menu_CtrlShiftF4 = localizationF("Menu_CtrlShiftF4", "profile of the highlighting rules (the first press turns profiling on)")
+        Menu_CtrlBracket = localizationF("Menu_CtrlBracket", "jump to the matching bracket")
+        Menu_CtrlShiftE = localizationF("Menu_CtrlShiftE", "select the enclosing element (again - its parent)")
         Menu_F5 = localizationF("Menu_F5","update from previously saved file")
         Menu_CtrlS = localizationF("Menu_CtrlS","save backup copy (and to file)") 
         Menu_CtrlO = localizationF("Menu_CtrlO","load from previously saved file") 
@@ -4614,12 +4996,15 @@ class HtmlJavaScriptHighlightingAddon:
 <br>Ctrl+Space — {Show_Code_completion}
 <br>F2 — {Menu_F2}
 <br>F4 — {Menu_F4}
+<br>Ctrl+Shift+F4 — {Menu_CtrlShiftF4}
 <br>F5 — {Menu_F5}
 <br>Ctrl+F — {Menu_CtrlF}
 <br>F3 — {Menu_F3}
 <br>Shift+F3 — {Menu_ShiftF3}
 <br>Ctrl+H — {Menu_CtrlH}
 <br>Ctrl+G — {goto}
+<br>Ctrl+] — {Menu_CtrlBracket}
+<br>Ctrl+Shift+E — {Menu_CtrlShiftE}
 <br>Ctrl+S — {Menu_CtrlS}
 <br>Ctrl+O — {Menu_CtrlO}   
 <br>Ctrl+V — {Menu_CtrlV}
@@ -5155,10 +5540,8 @@ class HtmlJavaScriptHighlightingAddon:
                 
         if Ctrl and not Shift and not Alt and key == Key_Space:
 
-            # пересчитаем список атодополнения по всем словам из текста            
-            text = edit_area.toPlainText()
-            pattern = r'(?<!</)(?<!<)\b[a-zA-Z_-][0-9a-zA-Z_-]*\b'
-            self.wordsFromEdit_Area = re.findall(pattern, text)
+            # пересчитаем список атодополнения по всем словам из текста (для неизмененных шаблонов - из кэша)
+            self.wordsFromEdit_Area = list(completion_words(edit_area.toPlainText()))
             self.update_completer_model()
 
             # Показываем окно автодополнения 
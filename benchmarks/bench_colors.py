@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+"""
+Micro-benchmarks of the color swatch helpers.
+
+    python benchmarks/bench_colors.py [--words N] [--repeat N]
+
+Named colors: "before" creates a QColor for every 3-20 letter word (needs
+PyQt6 or PyQt5), "after" looks the word up in the css_colors table and only
+then builds the color.
+Color functions: "before" is the old convert_color_to_hex that compiled four
+regexes per call, "after" is the cached css_colors.parse_color_function.
+The add-on package is not imported (it requires Anki).
+"""
+import argparse
+import importlib
+import os
+import random
+import re
+import sys
+import time
+import types
+
+ADDON_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def load_addon_module(name):
+    """=ru= Загрузка модуля дополнения без выполнения __init__.py (без Anki)"""
+    pkg_name = "_addon_bench"
+    if pkg_name not in sys.modules:
+        pkg = types.ModuleType(pkg_name)
+        pkg.__path__ = [ADDON_DIR]
+        sys.modules[pkg_name] = pkg
+    return importlib.import_module(pkg_name + "." + name)
+
+
+css_colors = load_addon_module("css_colors")
+
+COLOR_WORD = re.compile(r"\b([a-zA-Z]{3,20})\b", re.ASCII | re.IGNORECASE)
+
+PROSE = """The quick brown fox jumps over the lazy dog while the teacher explains
+the difference between mitochondria and chloroplasts. Remember the answer for the
+exam and write it down on the card, then review it again tomorrow morning. Gold
+medals, silver linings and a tomato salad are all part of the story"""
+
+
+FUNCTIONS = [
+    "rgb(255, 0, 0)", "rgba(0, 0, 0, 0.5)", "hsl(120, 50%, 50%)", "hsla(200, 100%, 40%, .8)",
+    "rgb(10 20 30 / 50%)", "hsl(120deg 50% 50%)", "hwb(90 10% 20%)",
+]
+
+
+def old_convert_color_to_hex(color):
+    """=ru= Прежняя версия из __init__.py (для сравнения): регулярные выражения компилируются при каждом вызове"""
+    rgb_regex = re.compile(r'rgb\(\s*(\d{1,3})\s*,\s*(\d{1,3})\s*,\s*(\d{1,3})\s*\)')
+    rgba_regex = re.compile(r'rgba\(\s*(\d{1,3})\s*,\s*(\d{1,3})\s*,\s*(\d{1,3})\s*,\s*(0|1|0?\.\d+)\s*\)')
+    hsl_regex = re.compile(r'hsl\(\s*(\d{1,3})\s*,\s*(\d{1,3})%\s*,\s*(\d{1,3})%\s*\)')
+    hsla_regex = re.compile(r'hsla\(\s*(\d{1,3})\s*,\s*(\d{1,3})%\s*,\s*(\d{1,3})%\s*,\s*(0|1|0?\.\d+)\s*\)')
+    match = rgb_regex.match(color)
+    if match:
+        r, g, b = map(int, match.groups())
+        return f"#{r:02X}{g:02X}{b:02X}"
+    match = rgba_regex.match(color)
+    if match:
+        r, g, b = map(int, match.groups()[:3])
+        return f"#{int(float(match.group(4)) * 255):02X}{r:02X}{g:02X}{b:02X}"
+    match = hsl_regex.match(color) or hsla_regex.match(color)
+    if match:
+        h, s, l = map(int, match.groups()[:3])
+        r, g, b = (int(round(c * 255)) for c in css_colors.hsl_to_rgb(h, s / 100, l / 100))
+        if match.re is hsla_regex:
+            return f"#{int(float(match.group(4)) * 255):02X}{r:02X}{g:02X}{b:02X}"
+        return f"#{r:02X}{g:02X}{b:02X}"
+    return color
+
+
+def make_corpus(words):
+    vocabulary = COLOR_WORD.findall(PROSE)
+    random.seed(1)
+    return [random.choice(vocabulary) for _ in range(words)]
+
+
+def load_qcolor():
+    try:
+        from PyQt6.QtGui import QColor
+        return QColor, "PyQt6"
+    except ImportError:
+        try:
+            from PyQt5.QtGui import QColor
+            return QColor, "PyQt5"
+        except ImportError:
+            return None, None
+
+
+def timed(fn, repeat):
+    best = None
+    for _ in range(repeat):
+        t = time.perf_counter()
+        fn()
+        t = time.perf_counter() - t
+        best = t if best is None else min(best, t)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--words", type=int, default=200000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    words = make_corpus(args.words)
+    n = len(words)
+    named_color = css_colors.named_color
+    print("words: %d, named colors in table: %d" % (n, len(css_colors.NAMED_COLORS)))
+
+    def table_lookup():
+        return [named_color(word) for word in words]
+
+    after = timed(table_lookup, args.repeat)
+    QColor, qt_name = load_qcolor()
+    if QColor is not None:
+        def qcolor_check():
+            return [QColor(word).isValid() for word in words]
+
+        def table_then_qcolor():
+            result = []
+            for word in words:
+                color = named_color(word)
+                result.append(color is not None and QColor(color).isValid())
+            return result
+
+        mismatch = sum(1 for a, b in zip(qcolor_check(), table_then_qcolor()) if a != b)
+        before = timed(qcolor_check, args.repeat)
+        after_qt = timed(table_then_qcolor, args.repeat)
+        print("before (%s QColor(word)):      %8.3f us/word" % (qt_name, before / n * 1e6))
+        print("after  (table, QColor for colors): %8.3f us/word" % (after_qt / n * 1e6))
+        print("words classified differently: %d" % mismatch)
+    else:
+        print("before (QColor(word)): PyQt is not available, skipped")
+    print("after  (table lookup only):        %8.3f us/word" % (after / n * 1e6))
+
+    calls = [FUNCTIONS[i % len(FUNCTIONS)] for i in range(n)]
+    parse = css_colors.parse_color_function
+    before = timed(lambda: [old_convert_color_to_hex(text) for text in calls], args.repeat)
+    after = timed(lambda: [parse(text) for text in calls], args.repeat)
+    print()
+    for text in FUNCTIONS:
+        print("  %-24s old: %-10s new: %s" % (text, old_convert_color_to_hex(text), parse(text)))
+    print("before (convert_color_to_hex, compiles per call): %8.3f us/call" % (before / n * 1e6))
+    print("after  (parse_color_function, cached):            %8.3f us/call" % (after / n * 1e6))
+    print("parse cache: %s" % (parse.cache_info(),))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,386 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark of the highlighting pipeline on a corpus of Anki templates.
+
+    python benchmarks/bench_highlighter.py [--corpus NAME ...] [--repeat N]
+        [--keystrokes N] [--rules N] [--json FILE] [--compare FILE] [--threshold 0.25]
+
+For every template of benchmarks/corpus.py it measures:
+  full       - highlighting of the whole document (rehighlight());
+  keystroke  - one typed character: the edited line and the lines after it
+               whose lexer state changed (as QSyntaxHighlighter does);
+  rules      - cost of every rule of syntax_rules.py over the code runs it is
+               applied to (the slowest --rules are printed).
+
+The add-on package is not imported (it requires Anki). The highlighter is
+the same pipeline as HtmlSyntaxHighlighter.block_spans without the color
+swatches: lexer.tokenize, the rule scanners of each region, strings and
+comments, coalesce_spans. If PyQt6/PyQt5 is available, it runs inside a real
+QSyntaxHighlighter on a QTextDocument with the "offscreen" platform, so
+setFormat and the layout of the blocks are included; otherwise only the
+Python part is timed.
+
+--json writes the results, --compare reads such a file and exits with code 1
+if any result is slower than the baseline by more than --threshold.
+"""
+import argparse
+import importlib
+import json
+import os
+import platform
+import sys
+import time
+import types
+
+ADDON_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import corpus # noqa: E402
+
+
+def load_addon_module(name):
+    """=ru= Загрузка модуля дополнения без выполнения __init__.py (без Anki)"""
+    pkg_name = "_addon_bench"
+    if pkg_name not in sys.modules:
+        pkg = types.ModuleType(pkg_name)
+        pkg.__path__ = [ADDON_DIR]
+        sys.modules[pkg_name] = pkg
+    return importlib.import_module(pkg_name + "." + name)
+
+
+lexer = load_addon_module("lexer")
+spans_module = load_addon_module("spans")
+syntax_rules = load_addon_module("syntax_rules")
+
+LONG_LINE_MIN_CHARS = 10000 # как long_line_min_chars в config.json
+
+
+class Pipeline:
+    """=ru= Раскраска строки так же, как HtmlSyntaxHighlighter (без образцов цветов)"""
+
+    def __init__(self, formats):
+        scanners, scanner_comm = syntax_rules.shared_scanners()
+        self.scanners = {lang: scanner.bind(formats) for lang, scanner in scanners.items()}
+        self.scanner_comm = scanner_comm.bind(formats)
+        self.comment = formats["x_comment_color"]
+        self.string = formats["x_string_color"]
+
+    def line_spans(self, text, tokens):
+        spans = []
+        if len(text) >= LONG_LINE_MIN_CHARS:
+            for start, end, kind, lang in tokens:
+                if kind != lexer.TOKEN_CODE:
+                    spans.append((start, end - start, self.comment if kind == lexer.TOKEN_COMMENT else self.string))
+            return spans
+        run_start = -1
+        run_lang = None
+        for start, end, kind, lang in tokens:
+            if run_start != -1 and (kind == lexer.TOKEN_COMMENT or lang != run_lang):
+                self.scan(text, run_start, start, run_lang, spans)
+                run_start = -1
+            if kind != lexer.TOKEN_COMMENT and run_start == -1:
+                run_start, run_lang = start, lang
+        if run_start != -1:
+            self.scan(text, run_start, len(text), run_lang, spans)
+        for start, end, kind, lang in tokens:
+            if kind == lexer.TOKEN_CODE:
+                continue
+            spans.append((start, end - start, self.comment if kind == lexer.TOKEN_COMMENT else self.string))
+            for s, length, fmt in self.scanner_comm.scan(text[start:end]):
+                spans.append((start + s, length, fmt))
+        return spans
+
+    def scan(self, text, start, end, lang, spans):
+        for s, length, fmt in self.scanners[lang].scan(text[start:end]):
+            spans.append((start + s, length, fmt))
+
+    def highlight(self, text, state, base):
+        """=ru= (отрезки после сведения, новое состояние)"""
+        tokens, state = lexer.tokenize(text, state, base)
+        return spans_module.coalesce_spans(self.line_spans(text, tokens), len(text)), state
+
+
+def rule_keys():
+    return {rule[1] for rule in syntax_rules.HIGHLIGHTING_RULES + syntax_rules.HIGHLIGHTING_RULES_COMM}
+
+
+def timed(fn, repeat):
+    best = None
+    for _ in range(repeat):
+        t = time.perf_counter()
+        fn()
+        t = time.perf_counter() - t
+        best = t if best is None else min(best, t)
+    return best
+
+
+def keystroke_positions(lines, count):
+    """=ru= Строки и позиции для набора: равномерно по документу, в середине строки"""
+    candidates = [i for i, line in enumerate(lines) if 0 < len(line) < LONG_LINE_MIN_CHARS]
+    if not candidates:
+        candidates = list(range(len(lines)))
+    step = max(1, len(candidates) // count)
+    return [(i, len(lines[i]) // 2) for i in candidates[::step][:count]]
+
+
+TYPED = ["a", "\"", "{", "/"]
+
+
+class PythonHighlighter:
+    """=ru= Без Qt: документ - список строк и состояний"""
+    name = "python"
+
+    def __init__(self, text, base):
+        self.pipeline = Pipeline({key: key for key in rule_keys()})
+        self.base = base
+        self.lines = text.split("\n")
+        self.states = [-1] * len(self.lines)
+
+    def rehighlight(self):
+        state = -1
+        for i, line in enumerate(self.lines):
+            _spans, state = self.pipeline.highlight(line, state, self.base)
+            self.states[i] = state
+
+    def type_char(self, number, column, char):
+        """=ru= Вставка символа и перекраска, пока состояние строки меняется. Возвращает число строк"""
+        line = self.lines[number]
+        self.lines[number] = line[:column] + char + line[column:]
+        count = 0
+        i = number
+        state = self.states[i - 1] if i > 0 else -1
+        while i < len(self.lines):
+            _spans, state = self.pipeline.highlight(self.lines[i], state, self.base)
+            count += 1
+            changed = state != self.states[i]
+            self.states[i] = state
+            if not changed and i > number:
+                break
+            i += 1
+        self.lines[number] = line
+        return count
+
+    def restore(self, number):
+        self.rehighlight_from(number)
+
+    def rehighlight_from(self, number):
+        state = self.states[number - 1] if number > 0 else -1
+        for i in range(number, len(self.lines)):
+            _spans, state = self.pipeline.highlight(self.lines[i], state, self.base)
+            if state == self.states[i] and i > number:
+                break
+            self.states[i] = state
+
+
+def load_qt():
+    """=ru= (модули Qt, имя) или None"""
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    try:
+        from PyQt6 import QtCore, QtGui, QtWidgets
+        return (QtCore, QtGui, QtWidgets), "PyQt6"
+    except ImportError:
+        try:
+            from PyQt5 import QtCore, QtGui, QtWidgets
+            return (QtCore, QtGui, QtWidgets), "PyQt5"
+        except ImportError:
+            return None
+
+
+def make_qt_highlighter(qt):
+    QtCore, QtGui, QtWidgets = qt
+    app = QtWidgets.QApplication.instance() or QtWidgets.QApplication([])
+
+    formats = {}
+    for i, key in enumerate(sorted(rule_keys())):
+        fmt = QtGui.QTextCharFormat()
+        fmt.setForeground(QtGui.QColor.fromHsv(i * 37 % 360, 200, 160))
+        formats[key] = fmt
+
+    class BenchHighlighter(QtGui.QSyntaxHighlighter):
+        def __init__(self, document, base):
+            super().__init__(document)
+            self.pipeline = Pipeline(formats)
+            self.base = base
+            self.blocks = 0
+
+        def highlightBlock(self, text):
+            spans, state = self.pipeline.highlight(text, self.previousBlockState(), self.base)
+            self.setCurrentBlockState(state)
+            self.blocks += 1
+            for start, length, fmt in spans:
+                self.setFormat(start, length, fmt)
+
+    class QtHighlighter:
+        name = "qt"
+
+        def __init__(self, text, base):
+            self.app = app
+            self.document = QtGui.QTextDocument()
+            self.document.setPlainText(text)
+            self.highlighter = BenchHighlighter(self.document, base)
+
+        def rehighlight(self):
+            self.highlighter.rehighlight()
+
+        def type_char(self, number, column, char):
+            block = self.document.findBlockByNumber(number)
+            cursor = QtGui.QTextCursor(block)
+            cursor.setPosition(block.position() + column)
+            self.highlighter.blocks = 0
+            cursor.insertText(char) # QSyntaxHighlighter перекрашивает сразу по contentsChange
+            count = self.highlighter.blocks
+            self.undo_cursor = cursor
+            return count
+
+        def restore(self, number):
+            self.undo_cursor.deletePreviousChar()
+
+    return QtHighlighter
+
+
+def bench_document(name, make, highlighter_class, args):
+    text, base = make()
+    lines = text.split("\n")
+    doc = highlighter_class(text, base)
+    results = []
+
+    full = timed(doc.rehighlight, args.repeat)
+    results.append({"corpus": name, "metric": "full", "ms": full * 1000,
+                    "lines": len(lines), "chars": len(text)})
+
+    positions = keystroke_positions(lines, args.keystrokes)
+    total = 0.0
+    worst = 0.0
+    cascaded = 0
+    count = 0
+    for number, column in positions:
+        for char in TYPED:
+            t = time.perf_counter()
+            cascaded += doc.type_char(number, column, char)
+            t = time.perf_counter() - t
+            doc.restore(number)
+            total += t
+            worst = max(worst, t)
+            count += 1
+    if count:
+        results.append({"corpus": name, "metric": "keystroke", "ms": total / count * 1000,
+                        "worst_ms": worst * 1000, "lines_per_keystroke": cascaded / count})
+    return results
+
+
+def code_runs(text, base):
+    """=ru= Куски кода (текст, язык), к которым применяются правила (как highlight_tokens)"""
+    runs = []
+    state = -1
+    for line in text.split("\n"):
+        tokens, state = lexer.tokenize(line, state, base)
+        if len(line) >= LONG_LINE_MIN_CHARS:
+            continue
+        run_start = -1
+        run_lang = None
+        for start, end, kind, lang in tokens:
+            if run_start != -1 and (kind == lexer.TOKEN_COMMENT or lang != run_lang):
+                runs.append((line[run_start:start], run_lang))
+                run_start = -1
+            if kind != lexer.TOKEN_COMMENT and run_start == -1:
+                run_start, run_lang = start, lang
+        if run_start != -1:
+            runs.append((line[run_start:], run_lang))
+    return runs
+
+
+def bench_rules(names, args):
+    """=ru= Время каждого правила отдельно (все совпадения на кусках кода его областей)"""
+    runs = []
+    for name in names:
+        runs.extend(code_runs(*corpus.CORPUS[name]()))
+    results = []
+    for index, (pattern, key, requires, layer, langs) in enumerate(syntax_rules.HIGHLIGHTING_RULES):
+        scanner = syntax_rules.RuleScanner([(pattern, key, requires, None, langs)])
+        texts = [text for text, lang in runs if lang in langs]
+        matches = sum(len(scanner.scan(text)) for text in texts)
+        seconds = timed(lambda: [scanner.scan(text) for text in texts], args.repeat)
+        results.append({"corpus": "+".join(names), "metric": "rule", "rule": index, "key": key,
+                        "pattern": pattern, "ms": seconds * 1000, "runs": len(texts), "matches": matches})
+    return results
+
+
+def result_id(result):
+    return "%s/%s%s" % (result["corpus"], result["metric"], "/%d" % result["rule"] if "rule" in result else "")
+
+
+def compare(results, baseline_file, threshold):
+    """=ru= Сравнение с прошлым запуском: список (id, было, стало) для замедлившихся результатов"""
+    with open(baseline_file, encoding="utf-8") as f:
+        baseline = {result_id(r): r for r in json.load(f)["results"]}
+    slower = []
+    for result in results:
+        old = baseline.get(result_id(result))
+        if old is None or result["metric"] == "rule":
+            continue # правила слишком быстрые, их время сильно шумит
+        if result["ms"] > old["ms"] * (1 + threshold) and result["ms"] - old["ms"] > 0.5:
+            slower.append((result_id(result), old["ms"], result["ms"]))
+    return slower
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--corpus", nargs="*", default=list(corpus.CORPUS), choices=list(corpus.CORPUS))
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--keystrokes", type=int, default=10, help="lines to type in per template")
+    parser.add_argument("--rules", type=int, default=10, help="slowest rules to print")
+    parser.add_argument("--python", action="store_true", help="do not use Qt even if it is available")
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--compare", help="results of a previous run (--json) to compare with")
+    parser.add_argument("--threshold", type=float, default=0.25, help="allowed slowdown, 0.25 = 25%%")
+    args = parser.parse_args()
+
+    qt = None if args.python else load_qt()
+    if qt is not None:
+        highlighter_class = make_qt_highlighter(qt[0])
+        backend = qt[1]
+    else:
+        highlighter_class = PythonHighlighter
+        backend = "python"
+    print("backend: %s (%s)" % (backend, "QSyntaxHighlighter, offscreen" if qt else "no Qt, Python part only"))
+
+    results = []
+    for name in args.corpus:
+        for result in bench_document(name, corpus.CORPUS[name], highlighter_class, args):
+            results.append(result)
+            if result["metric"] == "full":
+                print("%-13s full      %9.2f ms  (%d lines, %d chars)" % (name, result["ms"], result["lines"], result["chars"]))
+            else:
+                print("%-13s keystroke %9.3f ms  (worst %.3f ms, %.1f lines per keystroke)" % (
+                    name, result["ms"], result["worst_ms"], result["lines_per_keystroke"]))
+
+    rules = bench_rules(args.corpus, args)
+    results.extend(rules)
+    print("slowest rules:")
+    for result in sorted(rules, key=lambda r: -r["ms"])[:args.rules]:
+        print("  #%-3d %8.2f ms %7d matches  %-26s %s" % (
+            result["rule"], result["ms"], result["matches"], result["key"], result["pattern"][:60]))
+
+    if args.json:
+        data = {
+            "backend": backend,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "results": results,
+        }
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=1)
+        print("results written to %s" % args.json)
+
+    if args.compare:
+        slower = compare(results, args.compare, args.threshold)
+        for ident, old, new in slower:
+            print("SLOWER: %s %.2f ms -> %.2f ms" % (ident, old, new))
+        if slower:
+            sys.exit(1)
+        print("no slowdowns over %d%% compared with %s" % (args.threshold * 100, args.compare))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark of the highlighting rules: cost per line before (one pass per rule)
+and after (RuleScanner with merged layers and literal prefilters), and with
+the rule subsets per region (HTML markup, <style>, <script>) split by the lexer.
+
+    python benchmarks/bench_rules.py [--lines N] [--repeat N] [--verify] [--no-qt]
+
+The "before" numbers are measured with the real QRegularExpression/QRegExp
+loop that the highlighter used before (needs PyQt6 or PyQt5; without them the
+benchmark stops unless --no-qt is given) and with Python re (same semantics
+as the old globalMatch/indexIn loop).
+The add-on package is not imported (it requires Anki), only syntax_rules.py
+and lexer.py.
+"""
+import argparse
+import importlib
+import os
+import re
+import sys
+import time
+import types
+
+ADDON_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def load_addon_module(name):
+    """=ru= Загрузка модуля дополнения без выполнения __init__.py (без Anki)"""
+    pkg_name = "_addon_bench"
+    if pkg_name not in sys.modules:
+        pkg = types.ModuleType(pkg_name)
+        pkg.__path__ = [ADDON_DIR]
+        sys.modules[pkg_name] = pkg
+    return importlib.import_module(pkg_name + "." + name)
+
+
+syntax_rules = load_addon_module("syntax_rules")
+lexer = load_addon_module("lexer")
+
+
+TEMPLATE = r'''<!-- {{Front}} card -->
+<div class="card front" id="main" style="color: red; background: #fff;" onclick="toggle(this, 'x')">
+  {{Front}} &nbsp; {{cloze:Text}} <br/>
+  <span class='hint'>{{hint:Back}}</span> %%
+</div>
+<script>
+  // comment here: http://example.com
+  var a = 1, b = [1,2,3];
+  function toggle(el, name) {
+    if (el.x = 5) { return false; }
+    for (let i=0; i<10; ++i) { console.log(i); }
+    while (a == 2 && b || !c) { a ^= 3; break; }
+    el.style.backgroundColor = 'rgba(0, 0, 0, 0.5)';
+    document.querySelector('#main .x').classList.add("on");
+    let n = 1e5 + 0x1f - 12.5;
+  }
+</script>
+<style>
+.card { font-family: Arial; font-size: 20px; color: black; }
+  margin-top: 10px;
+#main > .x:hover { color: hsl(120, 50%, 50%); border: 1px solid #a0b0c0; }
+</style>'''
+
+
+def make_corpus(lines):
+    base = TEMPLATE.split("\n")
+    return (base * (lines // len(base) + 1))[:lines]
+
+
+def last_captured(match, ngroups):
+    for i in range(ngroups, 0, -1):
+        if match.start(i) != -1:
+            return i
+    return 0
+
+
+def sequential_spans(compiled, text):
+    """=ru= Как раньше: отдельный проход по строке для каждого правила"""
+    spans = []
+    for regex, payload in compiled:
+        for match in regex.finditer(text):
+            lci = last_captured(match, regex.groups)
+            if lci == 0:
+                if match.end() > match.start():
+                    spans.append((match.start(), match.end() - match.start(), payload))
+            else:
+                for i in range(1, lci + 1):
+                    start, end = match.span(i)
+                    if start != -1 and end > start:
+                        spans.append((start, end - start, payload))
+    return spans
+
+
+def code_runs(lines):
+    """=ru= Куски кода (текст, язык) каждой строки, как их раскрашивает highlight_tokens"""
+    runs = []
+    state = -1
+    for text in lines:
+        tokens, state = lexer.tokenize(text, state)
+        run_start = -1
+        run_lang = None
+        for start, end, kind, lang in tokens:
+            if run_start != -1 and (kind == lexer.TOKEN_COMMENT or lang != run_lang):
+                runs.append((text[run_start:start], run_lang))
+                run_start = -1
+            if kind != lexer.TOKEN_COMMENT and run_start == -1:
+                run_start, run_lang = start, lang
+        if run_start != -1:
+            runs.append((text[run_start:], run_lang))
+    return runs
+
+
+def paint(text, spans):
+    colors = [None] * len(text)
+    for start, length, payload in spans:
+        colors[start:start + length] = [payload] * length
+    return colors
+
+
+def qt_loop():
+    """=ru= (имя, функция строки) - старый цикл globalMatch/indexIn на настоящих регулярных выражениях Qt; None - нет PyQt"""
+    try:
+        from PyQt6.QtCore import QRegularExpression
+        rules = [QRegularExpression(p) for p, _k, _r, _l, _langs in syntax_rules.HIGHLIGHTING_RULES]
+
+        def run(text):
+            for pattern in rules:
+                it = pattern.globalMatch(text)
+                while it.hasNext():
+                    match = it.next()
+                    lci = match.lastCapturedIndex()
+                    if lci == 0:
+                        match.capturedStart(), match.capturedLength()
+                    else:
+                        for i in range(1, lci + 1):
+                            match.capturedStart(i), match.capturedLength(i)
+        name = "PyQt6 QRegularExpression"
+    except ImportError:
+        try:
+            from PyQt5.QtCore import QRegExp
+        except ImportError:
+            return None
+        rules = [QRegExp(p) for p, _k, _r, _l, _langs in syntax_rules.HIGHLIGHTING_RULES]
+
+        def run(text):
+            for pattern in rules:
+                pos = 0
+                while (pos := pattern.indexIn(text, pos)) != -1:
+                    captured_texts = pattern.capturedTexts()
+                    for i in range(1, len(captured_texts)):
+                        pattern.pos(i)
+                    pos += max(pattern.matchedLength(), 1)
+        name = "PyQt5 QRegExp"
+    return name, run
+
+
+def qt_sequential(lines, repeat):
+    name, run = qt_loop()
+    return name, timed(lambda: [run(text) for text in lines], repeat)
+
+
+def timed(fn, repeat=1):
+    best = None
+    for _ in range(repeat):
+        t = time.perf_counter()
+        fn()
+        t = time.perf_counter() - t
+        best = t if best is None else min(best, t)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--lines", type=int, default=5000)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--verify", action="store_true", help="compare coloring of both ways")
+    parser.add_argument("--no-qt", action="store_true", help="without PyQt: only the Python re numbers")
+    args = parser.parse_args()
+    if not args.no_qt and qt_loop() is None:
+        parser.error("PyQt6 or PyQt5 is needed to measure the old Qt regex loop (--no-qt to skip it)")
+
+    lines = make_corpus(args.lines)
+    rules = syntax_rules.HIGHLIGHTING_RULES
+    compiled = [(re.compile(p, re.ASCII), k) for p, k, _r, _l, _langs in rules]
+    scanner = syntax_rules.RuleScanner(rules)
+
+    if args.verify:
+        bad = 0
+        for text in lines:
+            if paint(text, sequential_spans(compiled, text)) != paint(text, scanner.scan(text)):
+                bad += 1
+                if bad <= 5:
+                    print("DIFF:", repr(text))
+        print("verify: %d of %d lines differ" % (bad, len(lines)))
+
+    n = len(lines)
+    print("rules: %d, passes after merging: %d, lines: %d" % (len(rules), len(scanner.passes), n))
+    before = timed(lambda: [sequential_spans(compiled, text) for text in lines], args.repeat)
+    after = timed(lambda: [scanner.scan(text) for text in lines], args.repeat)
+    print("before (re, one pass per rule): %8.1f us/line" % (before / n * 1e6))
+    if not args.no_qt:
+        name, seconds = qt_sequential(lines, args.repeat)
+        print("before (%s):%s%8.1f us/line" % (name, " " * max(1, 23 - len(name)), seconds / n * 1e6))
+    else:
+        print("before (Qt): skipped (--no-qt)")
+    print("after  (RuleScanner.scan):      %8.1f us/line" % (after / n * 1e6))
+
+    runs = code_runs(lines)
+    scanners = {lang: syntax_rules.RuleScanner(rules, lang) for lang in syntax_rules.ALL}
+    names = {lexer.LANG_HTML: "html", lexer.LANG_CSS: "css", lexer.LANG_JS: "js"}
+    print("passes per region: %s" % ", ".join(
+        "%s %d" % (names[lang], len(scanners[lang].passes)) for lang in syntax_rules.ALL))
+    all_rules = timed(lambda: [scanner.scan(text) for text, _lang in runs], args.repeat)
+    by_region = timed(lambda: [scanners[lang].scan(text) for text, lang in runs], args.repeat)
+    print("code runs from the lexer: %d" % len(runs))
+    print("all rules on every run:         %8.1f us/line" % (all_rules / n * 1e6))
+    print("region rules only:              %8.1f us/line" % (by_region / n * 1e6))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+"""
+Corpus of Anki card templates for the benchmarks.
+
+Every function returns (text, base) where base is the lexer context of the
+first line: lexer.HTML for the front/back templates, lexer.CSS for the
+Styling tab. The text is generated from fixed seeds, so the numbers of two
+runs are comparable.
+"""
+import random
+
+HTML = 1 # lexer.HTML
+CSS = 2  # lexer.CSS
+
+SMALL_CARD = '''<div class="card front" id="main">
+  <div class="question">{{Front}}</div>
+  {{#Image}}<div class="image">{{Image}}</div>{{/Image}}
+  <hr id=answer>
+  <div class="answer" style="color: #336699; font-size: 20px;">{{Back}}</div>
+  {{#Hint}}<div class="hint">{{hint:Hint}}</div>{{/Hint}}
+  <span class="tags">{{Tags}}</span> &nbsp; <br/>
+</div>
+<script>
+  // show the extra field only on desktop
+  var extra = document.getElementById("extra");
+  if (extra && window.innerWidth > 600) { extra.style.display = 'block'; }
+</script>'''
+
+SMALL_STYLE = '''.card {
+  font-family: Arial, sans-serif;
+  font-size: 20px;
+  text-align: center;
+  color: black;
+  background-color: white;
+}
+.night_mode .card { color: rgb(230, 230, 230); background-color: hsl(0, 0%, 15%); }
+#answer { border: 1px solid #a0b0c0; margin: 10px 0; }
+.hint a { color: tomato; }
+/* cloze */
+.cloze { font-weight: bold; color: blue; }'''
+
+JS_FUNCTION = '''function step{n}(el, name) {{
+  // step {n}: toggle the element and remember the state
+  var state = localStorage.getItem("step{n}") || 'off';
+  if (state == 'on' && el) {{ el.classList.add("on"); }}
+  for (let i = 0; i < {n}; ++i) {{ console.log(`step ${{i}} of {n}`, name); }}
+  while (a == 2 && b || !c) {{ a ^= 3; break; }}
+  el.style.backgroundColor = 'rgba(0, 0, 0, 0.5)';
+  document.querySelector('#main .x').setAttribute("data-n", String({n} * 1e3 + 0x1f));
+  return /^step\\d+$/.test(name) ? state : null;
+}}'''
+
+MARKUP_BLOCK = '''<div class="row r{n}" data-n="{n}" onclick="step{n}(this, 'row')">
+  <span class='label'>{{{{Field{n}}}}}</span> <b>{n}</b> &amp; <i>{{{{text:Back}}}}</i>
+  <!-- row {n} -->
+  <img src="img_{n}.png" alt="row {n}" style="width: {n}px; border: 1px solid #{color};">
+</div>'''
+
+CLOZE_LINE = ('<p>{{{{cloze:Text{n}}}}} {{{{#Extra{n}}}}}<span class="extra">{{{{Extra{n}}}}}</span>'
+              '{{{{/Extra{n}}}}} {{{{hint:Hint{n}}}}} {{{{type:cloze:Text{n}}}}} %%</p>')
+
+CSS_RULE = ('.c{n}{{color:#{color};background:rgb({r},{g},{b});margin:{n}px 0 0 {m}px;'
+            'font:{s}px/1.4 Arial,sans-serif}}.c{n}:hover>a{{color:hsl({h},50%,40%)}}')
+
+
+def small_card():
+    return SMALL_CARD, HTML
+
+
+def small_style():
+    return SMALL_STYLE, CSS
+
+
+def front_5k():
+    """=ru= Шаблон лицевой стороны ~5000 строк: разметка и большой встроенный <script>"""
+    parts = []
+    for n in range(250):
+        parts.append(MARKUP_BLOCK.format(n=n, color="%06x" % (n * 2654435761 & 0xFFFFFF)))
+    parts.append("<script>")
+    for n in range(330):
+        parts.append(JS_FUNCTION.format(n=n))
+    parts.append("</script>")
+    return "\n".join(parts), HTML
+
+
+def cloze_heavy():
+    """=ru= Много полей {{...}}, cloze и условных блоков"""
+    lines = ["<div class=\"card\">"]
+    for n in range(1500):
+        lines.append(CLOZE_LINE.format(n=n))
+    lines.append("</div>")
+    return "\n".join(lines), HTML
+
+
+def minified_css():
+    """=ru= Вкладка стиля с минифицированным CSS: несколько строк по 20-60 KB"""
+    rng = random.Random(14)
+    lines = []
+    for line in range(6):
+        rules = []
+        for n in range(rng.randint(100, 300)):
+            rules.append(CSS_RULE.format(
+                n=line * 1000 + n, color="%06x" % rng.getrandbits(24), r=rng.randint(0, 255),
+                g=rng.randint(0, 255), b=rng.randint(0, 255), m=rng.randint(0, 40),
+                s=rng.randint(10, 30), h=rng.randint(0, 359)))
+        lines.append("".join(rules))
+    return "\n".join(lines), CSS
+
+
+def minified_js():
+    """=ru= Шаблон со встроенной минифицированной библиотекой (одна строка ~100 KB)"""
+    body = "".join(
+        'var s%d=function(e,t){return e&&t?"a%d":\'b\'+e/2},q%d=[1,2,3].map(function(x){return x*%d});' % (n, n, n, n)
+        for n in range(1200))
+    return SMALL_CARD + "\n<script>" + body + "</script>\n<div>{{Back}}</div>", HTML
+
+
+CORPUS = {
+    "small_card": small_card,
+    "small_style": small_style,
+    "front_5k": front_5k,
+    "cloze_heavy": cloze_heavy,
+    "minified_css": minified_css,
+    "minified_js": minified_js,
+}
@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+# Индексы документа по строкам (парные скобки, см. также elements.py) по токенам лексера.
+# Модуль не зависит от Qt, поэтому его можно использовать и из benchmarks/.
+import functools
+import re
+import time
+
+from . import lexer
+
+
+OPEN_BRACKETS = "([{<"
+CLOSE_BRACKETS = ")]}>"
+BRACKET_PAIRS = {"(": ")", "[": "]", "{": "}", "<": ">", ")": "(", "]": "[", "}": "{", ">": "<"}
+_BRACKET = re.compile(r"[()\[\]{}<>]")
+_CODE_BRACKET = re.compile(r"[()\[\]{}]")
+
+
+LINE_TOKENS_CACHE_SIZE = 1024
+
+
+@functools.lru_cache(maxsize=LINE_TOKENS_CACHE_SIZE)
+def line_tokens(text, prev_state, base):
+    """=ru= Токены строки; кэш - чтобы индексы, обновляющие одни и те же строки, разбирали их один раз"""
+    return lexer.tokenize(text, prev_state, base)[0]
+
+
+def line_brackets(text, tokens):
+    """
+    =ru= Скобки строки вне строк и комментариев: кортеж (позиция, скобка).
+    < и > - только в разметке (теги), в CSS и JS это сравнения и селекторы.
+    """
+    found = []
+    for start, end, kind, lang in tokens:
+        if kind != lexer.TOKEN_CODE:
+            continue
+        regex = _BRACKET if lang == lexer.LANG_HTML else _CODE_BRACKET
+        for match in regex.finditer(text, start, end):
+            found.append((match.start(), match.group()))
+    return tuple(found)
+
+
+class LineIndex:
+    """
+    =ru= Записи документа по строкам, которые обновляются по частям. Правка меняет только
+    свои строки (splice - вставка и удаление строк, invalidate - строку перекрасили), а
+    заново лексером разбираются только они (refresh). После этого одним проходом по уже
+    готовым записям строится то, о чем спрашивают (build), и ответы - поиск в словаре.
+    Наследник задает parse_line(text, tokens) и build().
+    """
+
+    def __init__(self):
+        self.lines = [] # номер строки: запись строки или None - надо разобрать заново
+        self.stale = True # есть строки None или build еще не выполнен
+
+    def reset(self, count):
+        self.lines = [None] * count
+        self.stale = True
+
+    def splice(self, first, removed, added):
+        """=ru= Строки first..first+removed-1 заменены на added новых (еще не разобранных)"""
+        self.lines[first:first + removed] = [None] * added
+        self.stale = True
+
+    def invalidate(self, number):
+        if 0 <= number < len(self.lines) and self.lines[number] is not None:
+            self.lines[number] = None
+            self.stale = True
+
+    def refresh(self, line_source, deadline=None):
+        """
+        =ru= Разбирает строки, отмеченные None; line_source(номер) -> (текст, состояние
+        предыдущей строки, язык вкладки). Возвращает число разобранных строк.
+        deadline (time.perf_counter()) - разобрать, сколько успеется: если время вышло,
+        индекс остается stale, а следующий refresh продолжит с оставшихся строк.
+        """
+        if not self.stale:
+            return 0
+        count = 0
+        lines = self.lines
+        for number in [n for n, item in enumerate(lines) if item is None]:
+            if deadline is not None and count and time.perf_counter() >= deadline:
+                return count
+            text, prev_state, base = line_source(number)
+            lines[number] = self.parse_line(text, line_tokens(text, prev_state, base))
+            count += 1
+        self.build()
+        self.stale = False
+        return count
+
+    def parse_line(self, text, tokens):
+        raise NotImplementedError
+
+    def build(self):
+        raise NotImplementedError
+
+
+class BracketIndex(LineIndex):
+    """=ru= Парные скобки документа: по строкам - скобки, build - пары, find - поиск пары"""
+
+    def __init__(self):
+        super().__init__()
+        self.pairs = {} # (строка, позиция): (строка, позиция) парной скобки
+
+    def parse_line(self, text, tokens):
+        return line_brackets(text, tokens)
+
+    def build(self):
+        """=ru= Пары для всех скобок: открывающая получает ближайшую свою закрывающую"""
+        pairs = {}
+        stacks = {char: [] for char in OPEN_BRACKETS}
+        for number, brackets in enumerate(self.lines):
+            for position, char in brackets or ():
+                if char in OPEN_BRACKETS:
+                    stacks[char].append((number, position))
+                else:
+                    stack = stacks[BRACKET_PAIRS[char]]
+                    if stack:
+                        opening = stack.pop()
+                        pairs[opening] = (number, position)
+                        pairs[number, position] = opening
+        self.pairs = pairs
+
+    def find(self, number, position):
+        """=ru= (строка, позиция) скобки, парной к скобке в этом месте, или None"""
+        return self.pairs.get((number, position))
@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+# Цвета CSS: таблица именованных цветов и разбор функций rgb(), hsl(), hwb().
+# Модуль не зависит от Qt, поэтому его можно использовать и из benchmarks/.
+import functools
+import math
+import re
+from types import MappingProxyType
+
+
+# =ru= Именованные цвета CSS (CSS Color Module Level 4) в виде #rrggbb, ключи в нижнем регистре.
+# transparent - #aarrggbb (как понимает QColor), currentcolor - цвет не известен заранее (None).
+NAMED_COLORS = MappingProxyType({
+    "aliceblue": "#f0f8ff", "antiquewhite": "#faebd7", "aqua": "#00ffff", "aquamarine": "#7fffd4",
+    "azure": "#f0ffff", "beige": "#f5f5dc", "bisque": "#ffe4c4", "black": "#000000",
+    "blanchedalmond": "#ffebcd", "blue": "#0000ff", "blueviolet": "#8a2be2", "brown": "#a52a2a",
+    "burlywood": "#deb887", "cadetblue": "#5f9ea0", "chartreuse": "#7fff00", "chocolate": "#d2691e",
+    "coral": "#ff7f50", "cornflowerblue": "#6495ed", "cornsilk": "#fff8dc", "crimson": "#dc143c",
+    "cyan": "#00ffff", "darkblue": "#00008b", "darkcyan": "#008b8b", "darkgoldenrod": "#b8860b",
+    "darkgray": "#a9a9a9", "darkgreen": "#006400", "darkgrey": "#a9a9a9", "darkkhaki": "#bdb76b",
+    "darkmagenta": "#8b008b", "darkolivegreen": "#556b2f", "darkorange": "#ff8c00", "darkorchid": "#9932cc",
+    "darkred": "#8b0000", "darksalmon": "#e9967a", "darkseagreen": "#8fbc8f", "darkslateblue": "#483d8b",
+    "darkslategray": "#2f4f4f", "darkslategrey": "#2f4f4f", "darkturquoise": "#00ced1", "darkviolet": "#9400d3",
+    "deeppink": "#ff1493", "deepskyblue": "#00bfff", "dimgray": "#696969", "dimgrey": "#696969",
+    "dodgerblue": "#1e90ff", "firebrick": "#b22222", "floralwhite": "#fffaf0", "forestgreen": "#228b22",
+    "fuchsia": "#ff00ff", "gainsboro": "#dcdcdc", "ghostwhite": "#f8f8ff", "gold": "#ffd700",
+    "goldenrod": "#daa520", "gray": "#808080", "green": "#008000", "greenyellow": "#adff2f",
+    "grey": "#808080", "honeydew": "#f0fff0", "hotpink": "#ff69b4", "indianred": "#cd5c5c",
+    "indigo": "#4b0082", "ivory": "#fffff0", "khaki": "#f0e68c", "lavender": "#e6e6fa",
+    "lavenderblush": "#fff0f5", "lawngreen": "#7cfc00", "lemonchiffon": "#fffacd", "lightblue": "#add8e6",
+    "lightcoral": "#f08080", "lightcyan": "#e0ffff", "lightgoldenrodyellow": "#fafad2", "lightgray": "#d3d3d3",
+    "lightgreen": "#90ee90", "lightgrey": "#d3d3d3", "lightpink": "#ffb6c1", "lightsalmon": "#ffa07a",
+    "lightseagreen": "#20b2aa", "lightskyblue": "#87cefa", "lightslategray": "#778899", "lightslategrey": "#778899",
+    "lightsteelblue": "#b0c4de", "lightyellow": "#ffffe0", "lime": "#00ff00", "limegreen": "#32cd32",
+    "linen": "#faf0e6", "magenta": "#ff00ff", "maroon": "#800000", "mediumaquamarine": "#66cdaa",
+    "mediumblue": "#0000cd", "mediumorchid": "#ba55d3", "mediumpurple": "#9370db", "mediumseagreen": "#3cb371",
+    "mediumslateblue": "#7b68ee", "mediumspringgreen": "#00fa9a", "mediumturquoise": "#48d1cc", "mediumvioletred": "#c71585",
+    "midnightblue": "#191970", "mintcream": "#f5fffa", "mistyrose": "#ffe4e1", "moccasin": "#ffe4b5",
+    "navajowhite": "#ffdead", "navy": "#000080", "oldlace": "#fdf5e6", "olive": "#808000",
+    "olivedrab": "#6b8e23", "orange": "#ffa500", "orangered": "#ff4500", "orchid": "#da70d6",
+    "palegoldenrod": "#eee8aa", "palegreen": "#98fb98", "paleturquoise": "#afeeee", "palevioletred": "#db7093",
+    "papayawhip": "#ffefd5", "peachpuff": "#ffdab9", "peru": "#cd853f", "pink": "#ffc0cb",
+    "plum": "#dda0dd", "powderblue": "#b0e0e6", "purple": "#800080", "rebeccapurple": "#663399",
+    "red": "#ff0000", "rosybrown": "#bc8f8f", "royalblue": "#4169e1", "saddlebrown": "#8b4513",
+    "salmon": "#fa8072", "sandybrown": "#f4a460", "seagreen": "#2e8b57", "seashell": "#fff5ee",
+    "sienna": "#a0522d", "silver": "#c0c0c0", "skyblue": "#87ceeb", "slateblue": "#6a5acd",
+    "slategray": "#708090", "slategrey": "#708090", "snow": "#fffafa", "springgreen": "#00ff7f",
+    "steelblue": "#4682b4", "tan": "#d2b48c", "teal": "#008080", "thistle": "#d8bfd8",
+    "tomato": "#ff6347", "turquoise": "#40e0d0", "violet": "#ee82ee", "wheat": "#f5deb3",
+    "white": "#ffffff", "whitesmoke": "#f5f5f5", "yellow": "#ffff00", "yellowgreen": "#9acd32",
+    "transparent": "#00000000",
+    "currentcolor": None,
+})
+
+# =ru= быстрая проверка слова (в нижнем регистре) до создания QColor
+NAMED_COLOR_WORDS = frozenset(NAMED_COLORS)
+
+
+def named_color(word):
+    """=ru= #rrggbb для имени цвета CSS (без учета регистра) или None"""
+    return NAMED_COLORS.get(word.lower())
+
+
+# =ru= Разбор цветовых функций CSS. Понимает старый синтаксис через запятые
+# (rgb(0, 0, 0), rgba(0, 0, 0, .5), hsl(120, 50%, 50%)) и современный через пробелы
+# с альфой после / (rgb(0 0 0 / 50%), hsl(120deg 50% 50% / .5), hwb(120 10% 20%)).
+# Углы: число (градусы), deg, grad, rad, turn. Значения вне диапазона обрезаются, как в CSS.
+_COLOR_FUNCTION = re.compile(r"\s*(rgba?|hsla?|hwb)\s*\(\s*([^()]*?)\s*\)\s*$", re.IGNORECASE)
+_COLOR_NUMBER = re.compile(r"([+-]?(?:\d+\.?\d*|\.\d+)(?:e[+-]?\d+)?)(%|deg|grad|rad|turn)?$", re.IGNORECASE)
+_COLOR_SEPARATOR = re.compile(r"\s*,\s*|\s+")
+_HUE_UNITS = {None: 1.0, "deg": 1.0, "grad": 0.9, "rad": 180.0 / math.pi, "turn": 360.0}
+
+COLOR_FUNCTION_CACHE_SIZE = 1024
+
+
+def _number(value):
+    """=ru= (число, единица) или None; none в современном синтаксисе - это 0"""
+    if value.lower() == "none":
+        return 0.0, None
+    match = _COLOR_NUMBER.match(value)
+    if not match:
+        return None
+    unit = match.group(2)
+    return float(match.group(1)), unit.lower() if unit else None
+
+
+def _clamp(value, low=0.0, high=1.0):
+    return low if value < low else high if value > high else value
+
+
+def _alpha(value):
+    parsed = _number(value)
+    if parsed is None or parsed[1] not in (None, "%"):
+        return None
+    number, unit = parsed
+    return _clamp(number / 100.0 if unit == "%" else number)
+
+
+def _rgb_channel(value):
+    parsed = _number(value)
+    if parsed is None or parsed[1] not in (None, "%"):
+        return None
+    number, unit = parsed
+    return _clamp(number / 100.0 if unit == "%" else number / 255.0)
+
+
+def _hue(value):
+    parsed = _number(value)
+    if parsed is None or parsed[1] not in _HUE_UNITS:
+        return None
+    number, unit = parsed
+    return (number * _HUE_UNITS[unit]) % 360.0
+
+
+def _percent(value):
+    """=ru= Насыщенность, светлота, белизна, чернота: 50% или 50 (современный синтаксис)"""
+    parsed = _number(value)
+    if parsed is None or parsed[1] not in (None, "%"):
+        return None
+    return _clamp(parsed[0] / 100.0)
+
+
+def hsl_to_rgb(h, s, l):
+    """=ru= HSL (h 0-360, s и l 0-1) в RGB с компонентами 0-1"""
+    def channel(n):
+        k = (n + h / 30.0) % 12
+        a = s * min(l, 1 - l)
+        return l - a * max(-1.0, min(k - 3, 9 - k, 1.0))
+    return channel(0), channel(8), channel(4)
+
+
+def hwb_to_rgb(h, w, b):
+    """=ru= HWB (h 0-360, w и b 0-1) в RGB с компонентами 0-1"""
+    if w + b >= 1:
+        gray = w / (w + b)
+        return gray, gray, gray
+    return tuple(c * (1 - w - b) + w for c in hsl_to_rgb(h, 1.0, 0.5))
+
+
+@functools.lru_cache(maxsize=COLOR_FUNCTION_CACHE_SIZE)
+def parse_color_function(text):
+    """
+    =ru= Цвет из rgb()/rgba()/hsl()/hsla()/hwb() в виде #rrggbb (или #aarrggbb, если есть
+    прозрачность - так понимает QColor), None если разобрать не удалось.
+    """
+    match = _COLOR_FUNCTION.match(text)
+    if not match:
+        return None
+    name = match.group(1).lower()
+    body = match.group(2)
+    alpha = 1.0
+    if "/" in body: # современный синтаксис: альфа после /
+        body, alpha_text = body.split("/", 1)
+        if "," in body:
+            return None
+        alpha = _alpha(alpha_text.strip())
+        if alpha is None:
+            return None
+        parts = body.split()
+    else:
+        parts = [part for part in _COLOR_SEPARATOR.split(body) if part]
+        if "," in body:
+            if name == "hwb": # hwb() бывает только через пробелы
+                return None
+            if body.count(",") != len(parts) - 1:
+                return None
+            if len(parts) == 4:
+                alpha = _alpha(parts.pop())
+                if alpha is None:
+                    return None
+    if len(parts) != 3:
+        return None
+
+    if name.startswith("rgb"):
+        rgb = [_rgb_channel(part) for part in parts]
+    else:
+        h = _hue(parts[0])
+        x = _percent(parts[1])
+        y = _percent(parts[2])
+        if h is None or x is None or y is None:
+            return None
+        rgb = hsl_to_rgb(h, x, y) if name.startswith("hsl") else hwb_to_rgb(h, x, y)
+    if any(c is None for c in rgb):
+        return None
+
+    r, g, b = (int(round(_clamp(c) * 255)) for c in rgb)
+    if alpha >= 1.0:
+        return f"#{r:02x}{g:02x}{b:02x}"
+    return f"#{int(round(alpha * 255)):02x}{r:02x}{g:02x}{b:02x}"
+
+
+def convert_color_to_hex(color):
+    """
+    =ru= Конвертирует цвет из форматов rgb(), rgba(), hsl(), hsla(), hwb() в #RRGGBB или #AARRGGBB.
+    Если формат не распознан, возвращает исходное значение.
+    """
+    return parse_color_function(color) or color
@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+# Дерево HTML-элементов документа по токенам лексера (теги вне строк, комментариев, CSS и JS).
+# Модуль не зависит от Qt, поэтому его можно использовать и из benchmarks/.
+import bisect
+import re
+
+from . import lexer
+from .brackets import LineIndex
+
+
+# =ru= элементы без закрывающего тега
+VOID_ELEMENTS = frozenset((
+    "area", "base", "br", "col", "embed", "hr", "img", "input", "link", "meta", "source", "track", "wbr"))
+# =ru= закрывающий тег можно не писать: такие элементы не считаются незакрытыми
+OPTIONAL_CLOSE = frozenset((
+    "p", "li", "dt", "dd", "tr", "td", "th", "option", "optgroup", "thead", "tbody", "tfoot",
+    "colgroup", "rt", "rp", "html", "head", "body"))
+# =ru= открывающий тег сам закрывает открытый перед ним элемент из списка (<li>a<li>b)
+IMPLIED_END = {
+    "p": ("p",), "li": ("li",), "dt": ("dt", "dd"), "dd": ("dt", "dd"), "option": ("option",),
+    "tr": ("tr", "td", "th"), "td": ("td", "th"), "th": ("td", "th")}
+_TAG = re.compile(r"<(/?)([A-Za-z][A-Za-z0-9_:.\-]*)|/?>")
+
+
+def line_tags(text, tokens):
+    """
+    =ru= Теги строки: кортеж (позиция, вид, имя), вид "<", "</" (начало тега, имя в нижнем
+    регистре), ">" или "/>" (конец тега, имя ""). Только в разметке: < и > в строках, комментариях,
+    CSS и JS не теги. Возвращается и длина строки (конец последнего элемента документа).
+    """
+    found = []
+    for start, end, kind, lang in tokens:
+        if kind != lexer.TOKEN_CODE or lang != lexer.LANG_HTML:
+            continue
+        for match in _TAG.finditer(text, start, end):
+            name = match.group(2)
+            if name is None:
+                found.append((match.start(), match.group(), ""))
+            else:
+                found.append((match.start(), "</" if match.group(1) else "<", name.lower()))
+    return len(text), tuple(found)
+
+
+class Element:
+    """=ru= Элемент дерева; места - (строка, позиция)"""
+    __slots__ = ("name", "start", "open_end", "close", "end", "void", "parent", "children")
+
+    def __init__(self, name, start, parent):
+        self.name = name
+        self.start = start # < открывающего тега
+        self.open_end = None # > открывающего тега (None - тег не дописан)
+        self.close = None # < закрывающего тега (None - его нет)
+        self.end = None # сразу за элементом
+        self.void = False # одиночный (br, img...) или самозакрывающийся (<tag/>)
+        self.parent = parent
+        self.children = []
+
+    @property
+    def unclosed(self):
+        """=ru= Закрывающего тега нет, хотя он нужен (или открывающий не дописан до >)"""
+        if self.open_end is None:
+            return True
+        return self.close is None and not self.void and self.name not in OPTIONAL_CLOSE
+
+    def __repr__(self):
+        return "<Element %s %r-%r>" % (self.name, self.start, self.end)
+
+
+class ElementIndex(LineIndex):
+    """
+    =ru= Дерево элементов документа. Строит его одним проходом со стеком, как браузер, и
+    не ломается на ошибках: закрывающий тег снимает со стека все до своего открывающего
+    (они заканчиваются перед ним), <li> и <p> закрывают открытый перед ними такой же элемент,
+    закрывающий без открывающего остается лишним (strays), а не закрытые до конца документа
+    заканчиваются в его конце. Парный тег, охватывающий
+    элемент и незакрытые теги - поиск в словаре и двоичный поиск по готовому дереву.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.roots = [] # элементы верхнего уровня
+        self.elements = [] # все элементы по порядку открывающих тегов
+        self.starts = [] # их start (для bisect)
+        self.tags = {} # (строка, позиция <): (элемент или None - лишний закрывающий, закрывающий ли)
+        self.strays = [] # (строка, позиция, имя) закрывающих тегов без открывающего
+
+    def parse_line(self, text, tokens):
+        return line_tags(text, tokens)
+
+    def build(self):
+        roots = []
+        elements = []
+        tags = {}
+        strays = []
+        stack = []
+        pending = None # (элемент или None, закрывающий ли) - тег, который ждет свой >
+        length = 0
+        for number, record in enumerate(self.lines):
+            length, items = record or (0, ())
+            for column, kind, name in items:
+                place = (number, column)
+                if kind == "<":
+                    if stack and stack[-1].name in IMPLIED_END.get(name, ()):
+                        stack.pop().end = place
+                    parent = stack[-1] if stack else None
+                    element = Element(name, place, parent)
+                    (parent.children if parent is not None else roots).append(element)
+                    elements.append(element)
+                    tags[place] = (element, False)
+                    if name in VOID_ELEMENTS:
+                        element.void = True
+                    else:
+                        stack.append(element)
+                    pending = (element, False)
+                elif kind == "</":
+                    for i in range(len(stack) - 1, -1, -1):
+                        if stack[i].name == name:
+                            break
+                    else:
+                        i = -1
+                    if i < 0:
+                        strays.append((number, column, name))
+                        tags[place] = (None, True)
+                        pending = None
+                        continue
+                    for inner in stack[i + 1:]:
+                        inner.end = place # закончились перед чужим закрывающим тегом
+                    element = stack[i]
+                    del stack[i:]
+                    element.close = place
+                    element.end = (number, column + 2 + len(name)) # пока нет >
+                    tags[place] = (element, True)
+                    pending = (element, True)
+                elif pending is not None:
+                    element, is_close = pending
+                    pending = None
+                    after = (number, column + len(kind))
+                    if is_close:
+                        element.end = after
+                        continue
+                    element.open_end = (number, column + len(kind) - 1)
+                    if kind == "/>" and not element.void:
+                        element.void = True
+                        if stack and stack[-1] is element:
+                            stack.pop()
+                    if element.void:
+                        element.end = after
+        end = (len(self.lines) - 1, length)
+        for element in stack:
+            element.end = end
+        for element in elements:
+            if element.end is None: # одиночный тег без >
+                element.end = element.start[0], element.start[1] + 1 + len(element.name)
+        self.roots = roots
+        self.elements = elements
+        self.starts = [element.start for element in elements]
+        self.tags = tags
+        self.strays = strays
+
+    def tag_at(self, number, column):
+        """
+        =ru= Тег, в начале которого (на < или в имени, или сразу за именем) стоит column:
+        (элемент или None, закрывающий ли, позиция <, имя) или None
+        """
+        record = self.lines[number] if 0 <= number < len(self.lines) else None
+        for start, kind, name in record[1] if record else ():
+            if kind[0] == "<" and start <= column <= start + len(kind) + len(name):
+                element, is_close = self.tags.get((number, start), (None, True))
+                return element, is_close, start, name
+        return None
+
+    def pair_tag(self, number, column):
+        """
+        =ru= Что подсветить парой к тегу в этом месте: (строка, позиция, длина) - < и имя
+        парного тега, а у одиночного и самозакрывающегося - его >. None - пары нет.
+        """
+        found = self.tag_at(number, column)
+        if found is None or found[0] is None:
+            return None
+        element, is_close, start, name = found
+        if is_close:
+            line, column = element.start
+            return line, column, 1 + len(name)
+        if element.void:
+            if element.open_end is None:
+                return None
+            line, column = element.open_end
+            return line, column, 1
+        if element.close is None:
+            return None
+        line, column = element.close
+        return line, column, 2 + len(name)
+
+    def enclosing(self, start, end):
+        """
+        =ru= Ближайший элемент, который охватывает отрезок start..end и больше него
+        (повторный вопрос с его же отрезком дает родителя), или None
+        """
+        i = bisect.bisect_right(self.starts, start) - 1
+        element = self.elements[i] if i >= 0 else None
+        while element is not None:
+            if element.start <= start and end <= element.end and (element.start, element.end) != (start, end):
+                return element
+            element = element.parent
+        return None
+
+    def unclosed(self):
+        """=ru= Незакрытые элементы и лишние закрывающие теги: (строка, позиция, длина тега до конца имени)"""
+        found = [element.start + (1 + len(element.name),) for element in self.elements if element.unclosed]
+        found.extend((number, column, 2 + len(name)) for number, column, name in self.strays)
+        found.sort()
+        return found
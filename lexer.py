@@ -0,0 +1,423 @@
+# -*- coding: utf-8 -*-
+# Однопроходный токенизатор HTML/CSS/JS со стеком вложенных контекстов.
+# Модуль не зависит от Qt, поэтому его можно использовать и из benchmarks/.
+import functools
+import re
+import threading
+
+
+# =ru= Контексты (кадры стека). Нижний кадр - язык вкладки: HTML (лицо/оборот) или CSS (стиль)
+HTML = 1            # текст документа
+CSS = 2             # вкладка стиля или тело <style>
+JS = 3              # тело <script>
+HTML_COMMENT = 4    # <!-- -->
+TAG = 5             # внутри тега <div ... >
+TAG_STYLE = 6       # внутри открывающего тега <style ... >
+TAG_SCRIPT = 7      # внутри открывающего тега <script ... >
+ATTR_DQ = 8         # значение атрибута в "..."
+ATTR_SQ = 9         # значение атрибута в '...'
+ATTR_CODE_DQ = 10   # значение id=, class= в "..." (раскрашивается как код)
+ATTR_CODE_SQ = 11   # то же в '...'
+BLOCK_COMMENT = 12  # /* */ в CSS и JS
+STRING_DQ = 13      # строка "..." продолжается на следующей строке (\ в конце)
+STRING_SQ = 14      # строка '...' продолжается на следующей строке
+TEMPLATE = 15       # `шаблонная строка`
+TEMPLATE_EXPR = 16  # ${ выражение } внутри шаблонной строки
+BRACE = 17          # { } внутри ${ }, чтобы найти закрывающую } выражения
+ATTR_CSS_DQ = 18    # значение style= в "..." (код CSS)
+ATTR_CSS_SQ = 19    # то же в '...'
+ATTR_JS_DQ = 20     # значение on*= в "..." (код JavaScript)
+ATTR_JS_SQ = 21     # то же в '...'
+
+# =ru= Виды токенов
+TOKEN_CODE = 0
+TOKEN_STRING = 1
+TOKEN_COMMENT = 2
+
+# =ru= Язык кода в токене
+LANG_HTML = 0
+LANG_CSS = 1
+LANG_JS = 2
+
+
+_FRAME_LANG = {
+    HTML: LANG_HTML, HTML_COMMENT: LANG_HTML, TAG: LANG_HTML, TAG_STYLE: LANG_HTML, TAG_SCRIPT: LANG_HTML,
+    ATTR_DQ: LANG_HTML, ATTR_SQ: LANG_HTML, ATTR_CODE_DQ: LANG_HTML, ATTR_CODE_SQ: LANG_HTML,
+    ATTR_CSS_DQ: LANG_HTML, ATTR_CSS_SQ: LANG_HTML, ATTR_JS_DQ: LANG_HTML, ATTR_JS_SQ: LANG_HTML,
+    CSS: LANG_CSS,
+    JS: LANG_JS, TEMPLATE_EXPR: LANG_JS, BRACE: LANG_JS,
+}
+_ATTR_QUOTE = {ATTR_DQ: '"', ATTR_SQ: "'", ATTR_CODE_DQ: '"', ATTR_CODE_SQ: "'"}
+# =ru= значения style= и on*= разбираются лексером своего языка: кадр стека и язык вкладки для него
+_NESTED_QUOTE = {ATTR_CSS_DQ: ('"', CSS), ATTR_CSS_SQ: ("'", CSS), ATTR_JS_DQ: ('"', JS), ATTR_JS_SQ: ("'", JS)}
+_NESTED_FRAME = {(CSS, '"'): ATTR_CSS_DQ, (CSS, "'"): ATTR_CSS_SQ, (JS, '"'): ATTR_JS_DQ, (JS, "'"): ATTR_JS_SQ}
+_STRING_FRAME = {'"': STRING_DQ, "'": STRING_SQ}
+_STRING_QUOTE = {STRING_DQ: '"', STRING_SQ: "'"}
+
+_TAG_OPEN = re.compile(r"<(/?)([A-Za-z][A-Za-z0-9_:\-]*)|<[!?](?=[A-Za-z])")
+_TAG_SPECIAL = re.compile(r"[\"'>]")
+_ATTR_NAME = re.compile(r"([A-Za-z_:@][A-Za-z0-9_:.\-]*)\s*=\s*$")
+_CODE_ATTR = re.compile(r"(?:(style)|id|class|(on[a-zA-Z]{3,16}))$", re.IGNORECASE)
+_CSS_SPECIAL = re.compile(r"/\*|[\"']")
+_JS_SPECIAL = re.compile(r"/[/*]?|[\"'`]")
+_JS_EXPR_SPECIAL = re.compile(r"/[/*]?|[\"'`{}]")
+_TEMPLATE_SPECIAL = re.compile(r"\\.?|`|\$\{")
+_STRING_BODY = {
+    '"': re.compile(r"[^\"\\]*(?:\\.[^\"\\]*)*"),
+    "'": re.compile(r"[^'\\]*(?:\\.[^'\\]*)*"),
+}
+_REGEX_BODY = re.compile(r"(?:[^/\\\[]|\\.|\[(?:[^\]\\]|\\.)*\])+/[A-Za-z]*")
+_PREV_WORD = re.compile(r"([A-Za-z_$][A-Za-z0-9_$]*)\s*$")
+_RAW_END = {
+    CSS: re.compile(r"</style", re.IGNORECASE),
+    JS: re.compile(r"</script", re.IGNORECASE),
+}
+# после этих слов / начинает регулярное выражение, а не деление
+_REGEX_KEYWORDS = frozenset(("return", "typeof", "instanceof", "in", "of", "new", "delete",
+                             "void", "throw", "case", "do", "else", "yield", "await"))
+_REGEX_PREV_CHARS = frozenset("(,=:[!&|?{};+-*%<>~^")
+
+
+# =ru= Состояние блока (int для QSyntaxHighlighter) - номер стека в общей таблице стеков.
+# Одинаковые стеки получают одинаковые номера, поэтому QSyntaxHighlighter может сравнивать
+# состояния строк. Старшие биты оставлены под флаги.
+STATE_MASK = 0xFFFFFF
+_state_lock = threading.Lock()
+_state_by_stack = {}
+_stack_by_state = []
+
+
+def encode_state(stack):
+    """=ru= Номер состояния для стека контекстов (кортеж)"""
+    state = _state_by_stack.get(stack)
+    if state is None:
+        with _state_lock:
+            state = _state_by_stack.get(stack)
+            if state is None:
+                state = len(_stack_by_state)
+                _stack_by_state.append(stack)
+                _state_by_stack[stack] = state
+    return state
+
+
+def decode_state(state, base=HTML):
+    """=ru= Стек контекстов по номеру состояния, -1 (первая строка) - только язык вкладки"""
+    if state is None or state < 0:
+        return (base,)
+    state &= STATE_MASK
+    if state >= len(_stack_by_state):
+        return (base,)
+    return _stack_by_state[state]
+
+
+def tokenize(text, state=-1, base=HTML):
+    """
+    =ru= Разбивает строку на токены за один проход.
+    state - состояние предыдущей строки (previousBlockState()), base - язык вкладки (HTML или CSS).
+    Возвращает ([(начало, конец, вид токена, язык)], состояние для следующей строки).
+    Соседние токены одного вида и языка сливаются.
+    """
+    stack = list(decode_state(state, base))
+    tokens = []
+    n = len(text)
+    pos = 0
+
+    def emit(start, end, kind, lang):
+        if end <= start:
+            return
+        if tokens:
+            last = tokens[-1]
+            if last[1] == start and last[2] == kind and last[3] == lang:
+                tokens[-1] = (last[0], end, kind, lang)
+                return
+        tokens.append((start, end, kind, lang))
+
+    # =ru= </style или </script закрывает тело даже внутри строки или комментария
+    raw_end = n
+    raw_frame = None
+
+    def find_raw_end():
+        for i in range(len(stack) - 1, 0, -1):
+            frame = stack[i]
+            if frame == CSS or frame == JS:
+                match = _RAW_END[frame].search(text, pos)
+                return (match.start() if match else n), i
+        return n, None
+
+    raw_end, raw_frame = find_raw_end()
+
+    while pos < n:
+        top = stack[-1]
+
+        if raw_frame is not None and pos >= raw_end:
+            # =ru= вышли из <style>/<script>: дальше разбирает HTML, начиная с </...
+            del stack[raw_frame:]
+            raw_end, raw_frame = n, None
+            continue
+        limit = raw_end if raw_frame is not None else n
+
+        if top == HTML:
+            i = text.find("<", pos)
+            if i == -1:
+                emit(pos, n, TOKEN_CODE, LANG_HTML)
+                break
+            emit(pos, i, TOKEN_CODE, LANG_HTML)
+            if text.startswith("<!--", i):
+                stack.append(HTML_COMMENT)
+                emit(i, i + 4, TOKEN_COMMENT, LANG_HTML)
+                pos = i + 4
+                continue
+            match = _TAG_OPEN.match(text, i)
+            if match:
+                name = (match.group(2) or "").lower()
+                if match.group(1):
+                    stack.append(TAG)
+                elif name == "style":
+                    stack.append(TAG_STYLE)
+                elif name == "script":
+                    stack.append(TAG_SCRIPT)
+                else:
+                    stack.append(TAG)
+                emit(i, match.end(), TOKEN_CODE, LANG_HTML)
+                pos = match.end()
+            else:
+                emit(i, i + 1, TOKEN_CODE, LANG_HTML)
+                pos = i + 1
+
+        elif top == HTML_COMMENT:
+            i = text.find("-->", pos)
+            if i == -1:
+                emit(pos, n, TOKEN_COMMENT, LANG_HTML)
+                break
+            emit(pos, i + 3, TOKEN_COMMENT, LANG_HTML)
+            stack.pop()
+            pos = i + 3
+
+        elif top == TAG or top == TAG_STYLE or top == TAG_SCRIPT:
+            match = _TAG_SPECIAL.search(text, pos)
+            if not match:
+                emit(pos, n, TOKEN_CODE, LANG_HTML)
+                break
+            i = match.start()
+            char = text[i]
+            if char == ">":
+                emit(pos, i + 1, TOKEN_CODE, LANG_HTML)
+                stack.pop()
+                pos = i + 1
+                if top != TAG and text[i - 1:i] != "/":
+                    stack.append(CSS if top == TAG_STYLE else JS)
+                    raw_end, raw_frame = find_raw_end()
+                continue
+            emit(pos, i, TOKEN_CODE, LANG_HTML)
+            name = _ATTR_NAME.search(text, max(0, i - 64), i)
+            code = name and _CODE_ATTR.match(name.group(1))
+            kind = TOKEN_CODE if code else TOKEN_STRING
+            j = text.find(char, i + 1)
+            if code and (code.group(1) or code.group(2)):
+                # style= и on*=: кавычки - разметка, значение - код CSS или JavaScript
+                nested = CSS if code.group(1) else JS
+                emit(i, i + 1, TOKEN_CODE, LANG_HTML)
+                _nested(text, i + 1, n if j == -1 else j, nested, emit)
+                if j == -1:
+                    stack.append(_NESTED_FRAME[nested, char])
+                    break
+                emit(j, j + 1, TOKEN_CODE, LANG_HTML)
+                pos = j + 1
+                continue
+            if j == -1:
+                emit(i, n, kind, LANG_HTML)
+                if code:
+                    stack.append(ATTR_CODE_DQ if char == '"' else ATTR_CODE_SQ)
+                else:
+                    stack.append(ATTR_DQ if char == '"' else ATTR_SQ)
+                break
+            emit(i, j + 1, kind, LANG_HTML)
+            pos = j + 1
+
+        elif top in _NESTED_QUOTE:
+            quote, nested = _NESTED_QUOTE[top]
+            j = text.find(quote, pos)
+            _nested(text, pos, n if j == -1 else j, nested, emit)
+            if j == -1:
+                break
+            emit(j, j + 1, TOKEN_CODE, LANG_HTML)
+            stack.pop()
+            pos = j + 1
+
+        elif top in _ATTR_QUOTE:
+            kind = TOKEN_CODE if top == ATTR_CODE_DQ or top == ATTR_CODE_SQ else TOKEN_STRING
+            j = text.find(_ATTR_QUOTE[top], pos)
+            if j == -1:
+                emit(pos, n, kind, LANG_HTML)
+                break
+            emit(pos, j + 1, kind, LANG_HTML)
+            stack.pop()
+            pos = j + 1
+
+        elif top == CSS:
+            match = _CSS_SPECIAL.search(text, pos, limit)
+            if not match:
+                emit(pos, limit, TOKEN_CODE, LANG_CSS)
+                pos = limit
+                continue
+            i = match.start()
+            emit(pos, i, TOKEN_CODE, LANG_CSS)
+            if text[i] == "/":
+                stack.append(BLOCK_COMMENT)
+                emit(i, i + 2, TOKEN_COMMENT, LANG_CSS)
+                pos = i + 2
+            else:
+                pos = _string(text, i, limit, stack, emit, LANG_CSS)
+
+        elif top == JS or top == TEMPLATE_EXPR or top == BRACE:
+            special = _JS_SPECIAL if top == JS else _JS_EXPR_SPECIAL
+            match = special.search(text, pos, limit)
+            if not match:
+                emit(pos, limit, TOKEN_CODE, LANG_JS)
+                pos = limit
+                continue
+            i = match.start()
+            found = match.group()
+            emit(pos, i, TOKEN_CODE, LANG_JS)
+            if found == "//":
+                emit(i, limit, TOKEN_COMMENT, LANG_JS)
+                pos = limit
+            elif found == "/*":
+                stack.append(BLOCK_COMMENT)
+                emit(i, i + 2, TOKEN_COMMENT, LANG_JS)
+                pos = i + 2
+            elif found == "/":
+                end = -1
+                if _regex_allowed(text, i):
+                    regex = _REGEX_BODY.match(text, i + 1, limit)
+                    if regex:
+                        end = regex.end()
+                if end == -1:
+                    emit(i, i + 1, TOKEN_CODE, LANG_JS)
+                    pos = i + 1
+                else:
+                    emit(i, end, TOKEN_STRING, LANG_JS)
+                    pos = end
+            elif found == "`":
+                stack.append(TEMPLATE)
+                emit(i, i + 1, TOKEN_STRING, LANG_JS)
+                pos = i + 1
+            elif found == "{":
+                stack.append(BRACE)
+                emit(i, i + 1, TOKEN_CODE, LANG_JS)
+                pos = i + 1
+            elif found == "}":
+                stack.pop() # закрыли { или ${
+                emit(i, i + 1, TOKEN_CODE, LANG_JS)
+                pos = i + 1
+            else:
+                pos = _string(text, i, limit, stack, emit, LANG_JS)
+
+        elif top == BLOCK_COMMENT:
+            lang = _FRAME_LANG[stack[-2]] if len(stack) > 1 else LANG_CSS
+            i = text.find("*/", pos, limit)
+            if i == -1:
+                emit(pos, limit, TOKEN_COMMENT, lang)
+                pos = limit
+                continue
+            emit(pos, i + 2, TOKEN_COMMENT, lang)
+            stack.pop()
+            pos = i + 2
+
+        elif top == TEMPLATE:
+            while True:
+                match = _TEMPLATE_SPECIAL.search(text, pos, limit)
+                if not match or match.group()[0] != "\\":
+                    break
+                emit(pos, match.end(), TOKEN_STRING, LANG_JS)
+                pos = match.end()
+            if not match:
+                emit(pos, limit, TOKEN_STRING, LANG_JS)
+                pos = limit
+                continue
+            i = match.start()
+            if match.group() == "`":
+                emit(pos, i + 1, TOKEN_STRING, LANG_JS)
+                stack.pop()
+                pos = i + 1
+            else: # ${
+                emit(pos, i, TOKEN_STRING, LANG_JS)
+                emit(i, i + 2, TOKEN_CODE, LANG_JS)
+                stack.append(TEMPLATE_EXPR)
+                pos = i + 2
+
+        elif top == STRING_DQ or top == STRING_SQ:
+            lang = _FRAME_LANG[stack[-2]] if len(stack) > 1 else LANG_CSS
+            stack.pop()
+            pos = _string_body(text, pos, pos, _STRING_QUOTE[top], limit, stack, emit, lang)
+
+        else: # неизвестный кадр - начинаем заново с языка вкладки
+            stack = [base]
+
+    return tokens, encode_state(tuple(stack))
+
+
+def token_kinds(tokens, length):
+    """
+    =ru= Вид токена (TOKEN_CODE, TOKEN_STRING, TOKEN_COMMENT) для каждого символа строки.
+    Строится один раз за проход по токенам, после этого вопрос "внутри строки или
+    комментария?" для любой позиции - это одно обращение по индексу.
+    """
+    kinds = bytearray(length) # TOKEN_CODE == 0
+    for start, end, kind, lang in tokens:
+        if kind != TOKEN_CODE:
+            kinds[start:end] = bytes((kind,)) * (end - start)
+    return bytes(kinds)
+
+
+ATTRIBUTE_CACHE_SIZE = 4096
+
+
+@functools.lru_cache(maxsize=ATTRIBUTE_CACHE_SIZE)
+def attribute_tokens(value, base):
+    """
+    =ru= Токены значения атрибута style= (base=CSS) или on*= (base=JS) от начала значения.
+    Кэшируется по тексту значения: одинаковые style="..." в шаблоне и повторные раскраски
+    строки не разбираются заново. Каждая строка значения разбирается отдельно: строка или
+    комментарий внутри атрибута на следующую строку не переносятся.
+    """
+    tokens, _state = tokenize(value, -1, base)
+    return tuple(tokens)
+
+
+def _nested(text, start, end, base, emit):
+    """=ru= Токены вложенного языка для text[start:end] (значение атрибута)"""
+    if end <= start:
+        return
+    for s, e, kind, lang in attribute_tokens(text[start:end], base):
+        emit(start + s, start + e, kind, lang)
+
+
+def _string(text, start, limit, stack, emit, lang):
+    """=ru= Строка '...' или "..." с позиции кавычки, возвращает позицию после строки"""
+    return _string_body(text, start, start + 1, text[start], limit, stack, emit, lang)
+
+
+def _string_body(text, start, body, quote, limit, stack, emit, lang):
+    end = _STRING_BODY[quote].match(text, body, limit).end()
+    if end < limit and text[end] == quote:
+        emit(start, end + 1, TOKEN_STRING, lang)
+        return end + 1
+    emit(start, limit, TOKEN_STRING, lang)
+    if end == limit - 1 and limit == len(text) and text[end] == "\\":
+        stack.append(_STRING_FRAME[quote]) # \ в конце строки - строка продолжается
+    return limit
+
+
+def _regex_allowed(text, i):
+    """=ru= Может ли / на позиции i начинать регулярное выражение (а не деление)"""
+    k = i - 1
+    while k >= 0 and text[k] in " \t":
+        k -= 1
+    if k < 0:
+        return True
+    char = text[k]
+    if char in _REGEX_PREV_CHARS:
+        return True
+    word = _PREV_WORD.search(text, max(0, k - 16), k + 1)
+    return bool(word and word.group(1) in _REGEX_KEYWORDS)
@@ -0,0 +1,254 @@
+# -*- coding: utf-8 -*-
+# Работа с отрезками подсветки (начало, длина, формат).
+# Модуль не зависит от Qt, поэтому его можно использовать и из benchmarks/.
+import heapq
+import marshal
+import os
+import sys
+import tempfile
+import zlib
+from array import array
+from collections import OrderedDict
+
+
+# =ru= строка не длиннее стольких символов на отрезок сводится по символам (заполнение срезами
+# быстрее прохода по границам на Python), длиннее - по границам отрезков
+COALESCE_CHARS_PER_SPAN = 16
+
+
+def coalesce_spans(spans, length):
+    """
+    =ru= Сводит отрезки в порядке применения (каждый следующий перекрывает предыдущие)
+    к непересекающимся отрезкам с итоговым форматом каждого символа.
+    Соседние символы с одним и тем же форматом (тот же объект) объединяются в один отрезок.
+    Символы без формата не попадают в результат, как и без вызова setFormat.
+    Время зависит от числа отрезков (O(n log n)), а не от длины строки: длинная строка
+    сводится проходом по границам, где формат - у последнего примененного из открытых отрезков.
+    """
+    if len(spans) <= 1:
+        return spans
+    if length <= COALESCE_CHARS_PER_SPAN * len(spans):
+        return coalesce_spans_by_chars(spans, length)
+    events = [] # (позиция, 0 - конец / 1 - начало, номер отрезка)
+    for order, (start, count, format) in enumerate(spans):
+        end = start + count
+        if end > length:
+            end = length
+        if end > start:
+            events.append((start, 1, order))
+            events.append((end, 0, order))
+    events.sort()
+
+    result = []
+    active = [] # куча -номер открытых отрезков: сверху последний примененный
+    closed = set() # закрытые, но еще не снятые с кучи
+    run_start = 0
+    current = None
+    i = 0
+    count = len(events)
+    while i < count:
+        position = events[i][0]
+        while i < count and events[i][0] == position:
+            _position, opening, order = events[i]
+            if opening:
+                heapq.heappush(active, -order)
+            else:
+                closed.add(order)
+            i += 1
+        while active and -active[0] in closed:
+            closed.discard(-heapq.heappop(active))
+        format = spans[-active[0]][2] if active else None
+        if format is not current:
+            if current is not None:
+                result.append((run_start, position - run_start, current))
+            run_start = position
+            current = format
+    return result
+
+
+def coalesce_spans_by_chars(spans, length):
+    """=ru= То же, что coalesce_spans, через формат каждого символа (для коротких строк)"""
+    owner = [None] * length
+    for start, count, format in spans:
+        end = start + count
+        if end > length:
+            end = length
+        if end > start:
+            owner[start:end] = [format] * (end - start)
+
+    result = []
+    run_start = 0
+    current = owner[0] if length else None
+    for i in range(1, length):
+        format = owner[i]
+        if format is not current:
+            if current is not None:
+                result.append((run_start, i - run_start, current))
+            run_start = i
+            current = format
+    if current is not None:
+        result.append((run_start, length - run_start, current))
+    return result
+
+
+class SpanStats:
+    """=ru= Сколько вызовов setFormat сэкономило сведение отрезков"""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.blocks = 0
+        self.spans = 0 # отрезков до сведения (столько было бы вызовов setFormat)
+        self.calls = 0 # вызовов setFormat после сведения
+
+    def add(self, spans, calls):
+        self.blocks += 1
+        self.spans += spans
+        self.calls += calls
+
+    def saved_per_block(self):
+        return (self.spans - self.calls) / self.blocks if self.blocks else 0.0
+
+    def __str__(self):
+        return "setFormat: %d spans -> %d calls in %d blocks (saved %.1f per block)" % (
+            self.spans, self.calls, self.blocks, self.saved_per_block())
+
+
+class SpanCache:
+    """
+    =ru= LRU-кэш готовых отрезков строки. Ключ - содержимое строки и все, от чего зависит ее
+    раскраска (состояние предыдущей строки, язык вкладки, тема), значение -
+    (состояние строки, отрезки после сведения, упрощенно). При переключении лицевой/оборотной
+    стороны, стиля или карточки строки, которые уже раскрашивались, берутся из кэша без лексера
+    и правил. Размер ограничен числом строк и примерной занимаемой памятью.
+    """
+
+    ENTRY_OVERHEAD = 200 # байт на запись: ключ, кортеж значения, узел словаря
+    SPAN_SIZE = 72 # байт на отрезок (кортеж из трех элементов)
+
+    def __init__(self, max_entries, max_bytes):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict() # ключ: (значение, размер)
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def enabled(self):
+        return self.max_entries > 0 and self.max_bytes > 0
+
+    def get(self, key):
+        item = self.entries.get(key)
+        if item is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return item[0]
+
+    def peek(self, key):
+        """=ru= Значение без учета в статистике и порядке LRU (для фоновой подготовки)"""
+        item = self.entries.get(key)
+        return None if item is None else item[0]
+
+    def put(self, key, text, value):
+        """=ru= value = (состояние, отрезки, упрощенно); text - строка из ключа (для оценки размера)"""
+        if not self.enabled:
+            return
+        size = self.ENTRY_OVERHEAD + sys.getsizeof(text) + self.SPAN_SIZE * len(value[1])
+        old = self.entries.pop(key, None)
+        if old is not None:
+            self.size -= old[1]
+        self.entries[key] = (value, size)
+        self.size += size
+        while self.entries and (len(self.entries) > self.max_entries or self.size > self.max_bytes):
+            _key, (_value, evicted) = self.entries.popitem(last=False)
+            self.size -= evicted
+            self.evictions += 1
+
+    def recent(self, max_bytes):
+        """=ru= (ключ, значение) от недавно использованных к давним, пока их размер не больше max_bytes"""
+        total = 0
+        for key, (value, size) in reversed(self.entries.items()):
+            total += size
+            if total > max_bytes:
+                break
+            yield key, value
+
+    def clear(self):
+        self.entries.clear()
+        self.size = 0
+
+    def __str__(self):
+        lookups = self.hits + self.misses
+        return "span cache: %d hits, %d misses (%.0f%%), %d lines, %.1f MB, %d evicted" % (
+            self.hits, self.misses, 100.0 * self.hits / lookups if lookups else 0.0,
+            len(self.entries), self.size / 1048576, self.evictions)
+
+
+# =ru= Файл кэша отрезков: заголовок (метка, формат, версия) и записи в marshal + zlib.
+# Версия включает версию дополнения и Python: при обновлении файл просто не читается.
+SPAN_FILE_MAGIC = b"HJCSPANS"
+SPAN_FILE_FORMAT = 1
+
+
+def span_file_header(version):
+    stamp = "%s|py%d.%d|%s" % (version, sys.version_info[0], sys.version_info[1], sys.byteorder)
+    return SPAN_FILE_MAGIC + bytes((SPAN_FILE_FORMAT,)) + stamp.encode("utf-8") + b"\n"
+
+
+def write_span_file(path, version, records):
+    """
+    =ru= Сохраняет записи кэша отрезков: [(ключ, состояние, отрезки, упрощенно)], где ключ и
+    состояние - числа, строки и кортежи, а формат отрезка - его имя. Имена собираются в таблицу,
+    отрезки хранятся массивом чисел. Пишется в свой временный файл в той же папке, затем он
+    заменяет прежний: две записи одновременно не портят друг другу файл. Возвращает размер файла.
+    """
+    names = {}
+    packed = []
+    for key, state, spans, reduced in records:
+        flat = array("I")
+        for start, length, name in spans:
+            index = names.get(name)
+            if index is None:
+                index = names[name] = len(names)
+            flat.extend((start, length, index))
+        packed.append((key, state, flat.tobytes(), reduced))
+    data = span_file_header(version) + zlib.compress(marshal.dumps((tuple(names), packed)), 6)
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    handle, temp = tempfile.mkstemp(prefix=os.path.basename(path) + ".", suffix=".tmp", dir=directory)
+    try:
+        with os.fdopen(handle, "wb") as file:
+            file.write(data)
+        os.replace(temp, path)
+    except BaseException:
+        try:
+            os.remove(temp)
+        except OSError:
+            pass
+        raise
+    return len(data)
+
+
+def read_span_file(path, version):
+    """=ru= Записи из write_span_file; [] если файла нет или он от другой версии"""
+    try:
+        with open(path, "rb") as file:
+            data = file.read()
+    except FileNotFoundError:
+        return []
+    header = span_file_header(version)
+    if not data.startswith(header):
+        return []
+    names, packed = marshal.loads(zlib.decompress(data[len(header):]))
+    records = []
+    for key, state, flat, reduced in packed:
+        numbers = array("I")
+        numbers.frombytes(flat)
+        spans = [(numbers[i], numbers[i + 1], names[numbers[i + 2]]) for i in range(0, len(numbers), 3)]
+        records.append((key, state, spans, reduced))
+    return records
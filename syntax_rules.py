@@ -0,0 +1,573 @@
+# -*- coding: utf-8 -*-
+# Таблица правил подсветки и компилятор правил.
+# Модуль не зависит от Qt, поэтому его можно использовать и из benchmarks/.
+import functools
+import re
+import threading
+import time
+
+try: # Python 3.11+
+    from re import _parser as sre_parse, _constants as sre_constants
+except ImportError:
+    import sre_parse, sre_constants
+
+from .lexer import LANG_HTML, LANG_CSS, LANG_JS
+
+
+# =ru= в каких областях работает правило (язык токена лексера: разметка, CSS, JavaScript)
+ALL = (LANG_HTML, LANG_CSS, LANG_JS)
+HTML = (LANG_HTML,)
+CSS = (LANG_CSS,)
+JS = (LANG_JS,)
+CSS_JS = (LANG_CSS, LANG_JS)
+
+# =ru= Правила в порядке приоритета: каждое следующее правило перекрашивает предыдущие.
+# (шаблон, ключ цвета из THEMES, обязательные подстроки, слой, языки)
+# - обязательные подстроки: если хотя бы одной нет в строке, то правило не может совпасть
+#   и проход по нему не выполняется;
+# - слой: правила одного слоя объединяются в одно регулярное выражение (альтернативу) и
+#   строка сканируется один раз. В слой можно добавлять только правила, совпадения которых
+#   не пересекаются с чужими (одиночные символы из разных классов, целые слова из разных
+#   списков) или поглощают совпадения менее приоритетных правил слоя (&& поглощает &);
+# - языки: правило применяется только к коду этих областей (вкладка стиля и <style> - CSS,
+#   <script> - JavaScript, остальное - разметка HTML), так ключевые слова JS не раскрашиваются
+#   в CSS и тексте, а теги HTML - в сравнениях a < b в скриптах.
+HIGHLIGHTING_RULES = [
+    (R"([\^&\|~!])(?!=)", "x_keyword_attention_color", (), "punct", CSS_JS),
+    (R"(?:&&)|(?:\|\|)", "text_color", (), "punct", JS),
+
+    # если возможные ошибки = в условиях в for и if
+    (R"\b(?:(if)|(while))\b\s*\([^\)]*[^=\<\>!](=)[^=][^\)]*\)", "x_keyword_attention_color", ("=", "("), None, JS),
+    (R"\bfor\b[^;\)]*;[^;\)=\<\>!]*(=)[^;\)=\<\>!]*;[^\)]*\)", "x_keyword_attention_color", ("for", "=", ";"), None, JS),
+    # внимание если пытаются присвоить числу, функции (скобкам)
+    (R"(?:(\))|(\b\d+))\s*(=)(?![=\>])", "x_keyword_attention_color", ("=",), None, JS),
+
+    (R"\b[a-zA-Z\$\-_][a-zA-Z0-9\$\-_]*\b", "x_name_color", (), None, ALL),
+
+    (R"&(?:[A-Za-z0-9]+|#[0-9]+|#x[0-9A-Fa-f]+)(?=;)", "x_html_tag_color", ("&", ";"), None, HTML), # &nbsp; и подобное
+    # (?=[ >]) после имени тега: без нее при отсутствии > имя и [^>]* делят строку перебором (O(n^2) на каждое <)
+    (R"<(\/?[^> ]+)(?=[ >])[^>]*(?=>)", "x_html_tag_color", ("<", ">"), None, HTML),
+    # [a-zA-Z_] один раз: [a-zA-Z_]+[a-zA-Z0-9_:\-]* - то же самое, но с квадратичным перебором
+    (R"\b([a-zA-Z_][a-zA-Z0-9_:\-]*)\s*=(?=[^>]*\>)", "x_html_tag_attr_color", ("=", ">"), None, HTML),
+
+    (R"\.[a-zA-Z\$_][a-zA-Z0-9\$\-_]*\b", "x_css_class_color", (".",), None, CSS_JS),
+    (R"#\b[a-zA-Z\$_][a-zA-Z0-9\$\-_]*\b", "x_css_id_color", ("#",), None, CSS),
+    # (R"[^\.#:]\b([a-zA-Z\$\-_][a-zA-Z0-9\$\-_]*\b):", "x_css_property_color"),
+    (R"^\s*\b([a-zA-Z\$\-_][a-zA-Z0-9\$\-_]*\b):", "x_css_property_color", (":",), None, CSS),
+    # (R"[^\.#:]\b[a-zA-Z\$\-_][a-zA-Z0-9\$\-_]*\b:\s+([^;\>]*)[;\>]", "x_string_color"),
+    # значение начинается не с пробела: иначе \s+ и [^;\>]* делят пробелы между собой перебором
+    (R"^\s*\b[a-zA-Z\$\-_][a-zA-Z0-9\$\-_]*\b:\s+([^\s;\>][^;\>]*)[;\>]", "x_string_color", (":",), None, CSS),
+
+    (R"(\b[a-zA-Z\$\-_][a-zA-Z0-9\$\-_]*\b\s*)\(", "x_name_function_color", ("(",), None, CSS_JS),
+    # (R"-?\b(?:\d+(?:\.\d+)?(?:e[+-]?\d+)?|0x[0-9a-fA-F]+|0b[01]+|0o[0-7]+)\b", "x_number_color") всё 1asdf считать надо за число а это не пойдет
+    (R"(\b.?\b\d+\w*(%?|\b))", "x_number_color", (), None, ALL),
+    (R"#[0-9A-Fa-f]{3,8}\b", "x_number_color", ("#",), None, CSS_JS),
+
+    # подсветка для скобок разных
+    (R"[\{\}]", "x_brackets_curly_color", (), "punct", ALL),
+    (R"[\(\)]", "x_brackets_round_color", (), "punct", ALL),
+    (R"[\[\]]", "x_brackets_square_color", (), "punct", ALL),
+
+    # подсветка для строк (смотри в def highlightBlock(self, text): для некоторых там может быть )
+    # (r"\"[^\"\\]*(?:\\.[^\"\\]*)*\"", "x_string_color"),
+    # (r"'[^'\\]*(?:\\.[^'\\]*)*'", "x_string_color"),
+    # (r"`[^`\\]*(?:\\.[^`\\]*)*`", "x_string_color"),
+
+    # подсветка ограничивающих символов строк
+    (R"[\"'`]", "x_string_color", (), "punct", ALL),
+
+    # строки которые важны для отображения id, class
+    (R"\bid\s*=\s*[\"']([a-zA-Z\$_][a-zA-Z0-9\$\-_]*\b)[\"']", "x_css_id_color", ("id",), None, HTML),
+    (R"\bclass\s*=\s*[\"']([a-zA-Z\$_][a-zA-Z0-9\$\-_]*\b)[\"']", "x_css_class_color", ("class",), None, HTML),
+
+    # особо для style=
+    (R"\b(style)\s*=\s*", "x_keyword_attention_color", ("style",), None, HTML),
+
+    # (R"\b(abstract|await|boolean|byte|case|char|class|const|debugger|default|delete|do|double|else|enum|export|extends|false|final|float|for|function|goto|if|implements|import|in|instanceof|int|interface|let|long|native|new|null|package|private|protected|public|short|static|super|switch|synchronized|this|transient|true|typeof|var|void|volatile|while|with|yield)(?!\s*=)\b", "x_keyword_color"),
+    (R"\b(abstract|await|boolean|byte|case|char|class|const|debugger|default|delete|double|else|enum|export|extends|false|final|float|function|if|implements|import|in|instanceof|int|interface|let|long|native|new|null|package|private|protected|public|short|static|super|switch|synchronized|this|transient|true|typeof|var|void|volatile|with|yield)(?!\s*=)\b", "x_keyword_color", (), "keywords", JS),
+    (R"\b(do|for|while|try|catch|finally)(?!\s*=)\b", "x_keyword_block_color", (), "keywords", JS),
+    (R"\b(return|break|continue|goto|throw|close()|exit())(?!\s*=)\b", "x_keyword_attention_color", (), "keywords", JS),
+    (R"[ ]+", "x_keyword_attention_color", (), "punct", ALL), # серия пробелов одним отрезком, цвет тот же что и у [ ]
+
+    # =ru= комментарии (только для строки!) обрабатывать в последнюю очередь
+    (R"(?:[^:]|^)(//.*$)", "x_comment_color", ("//",), None, JS),
+    (R"(//\*.*\*//)", "x_comment_color", ("//*", "*//"), None, ALL),
+    (R"<!--.*-->", "x_comment_color", ("<!--", "-->"), None, HTML),
+
+    (R"\{\{[^{}]+\}\}", "x_anki_field_color", ("{{", "}}"), None, ALL),
+    (R"%%", "x_anki_field_color", (), "punct", ALL),
+]
+
+# =ru= правила подсветки даже в комментариях
+HIGHLIGHTING_RULES_COMM = [
+    (R"\{\{[^{}]+\}\}", "x_anki_field_color", ("{{", "}}"), None, ALL),
+]
+
+# =ru= Дешевые замены для правил, которые audit_pattern считает опасными (перебор с возвратами).
+# Используются вместо правила на строках длиннее предела RuleGuard. Раскрашивают почти то же:
+# if/while - первое подозрительное = в условии, закрывающая ) не обязательна.
+FALLBACK_RULES = {
+    R"\b(?:(if)|(while))\b\s*\([^\)]*[^=\<\>!](=)[^=][^\)]*\)": R"\b(?:(if)|(while))\b\s*\([^\)=]*[^=\<\>!\)](=)[^=]",
+}
+
+
+# =ru= Проверка шаблонов на катастрофический перебор с возвратами (ReDoS). Эвристика по дереву
+# разбора sre_parse: (1) вложенные неограниченные повторы, например (a+)+ - экспоненциальный
+# перебор; (2) два и больше неограниченных повтора подряд с пересекающимися наборами символов,
+# между которыми нет обязательного символа, который первый повтор не может поглотить, а после
+# них есть что-то, что может не совпасть, - полиномиальный перебор: для строки длиной n
+# O(n^k) на каждую позицию начала. Наборы символов считаются по ASCII (правила с re.ASCII).
+_UNIVERSE = frozenset(range(129)) # 128 - любой не-ASCII символ
+_CATEGORIES = {
+    sre_constants.CATEGORY_DIGIT: frozenset(ord(c) for c in "0123456789"),
+    sre_constants.CATEGORY_SPACE: frozenset(ord(c) for c in " \t\n\r\f\v"),
+    sre_constants.CATEGORY_WORD: frozenset(c for c in range(128) if chr(c).isalnum() or c == ord("_")),
+}
+_NOT_CATEGORIES = {
+    sre_constants.CATEGORY_NOT_DIGIT: sre_constants.CATEGORY_DIGIT,
+    sre_constants.CATEGORY_NOT_SPACE: sre_constants.CATEGORY_SPACE,
+    sre_constants.CATEGORY_NOT_WORD: sre_constants.CATEGORY_WORD,
+}
+_REPEATS = tuple(getattr(sre_constants, name) for name in ("MAX_REPEAT", "MIN_REPEAT") if hasattr(sre_constants, name))
+
+
+def _category(category):
+    if category in _CATEGORIES:
+        return _CATEGORIES[category]
+    if category in _NOT_CATEGORIES:
+        return _UNIVERSE - _CATEGORIES[_NOT_CATEGORIES[category]]
+    return _UNIVERSE
+
+
+def _charset(op, av):
+    """=ru= Символы, с которых может совпасть элемент (None - элемент не одиночный символ)"""
+    if op == sre_constants.LITERAL:
+        return frozenset((min(av, 128),))
+    if op == sre_constants.NOT_LITERAL:
+        return _UNIVERSE - {av}
+    if op == sre_constants.ANY:
+        return _UNIVERSE
+    if op == sre_constants.CATEGORY:
+        return _category(av)
+    if op == sre_constants.IN:
+        chars = set()
+        negate = False
+        for item_op, item_av in av:
+            if item_op == sre_constants.NEGATE:
+                negate = True
+            elif item_op == sre_constants.LITERAL:
+                chars.add(min(item_av, 128))
+            elif item_op == sre_constants.RANGE:
+                low, high = item_av
+                chars.update(range(min(low, 128), min(high, 128) + 1))
+            elif item_op == sre_constants.CATEGORY:
+                chars.update(_category(item_av))
+            else:
+                return _UNIVERSE
+        return _UNIVERSE - chars if negate else frozenset(chars)
+    return None
+
+
+class _Atom:
+    """
+    =ru= Элемент последовательности: набор символов, может ли быть пустым, неограниченный ли повтор,
+    может ли не совпасть; ahead - с каких символов обязано продолжаться совпадение (проверка (?=...))
+    """
+    __slots__ = ("chars", "nullable", "unbounded", "can_fail", "ahead")
+
+    def __init__(self, chars, nullable, unbounded, can_fail, ahead=None):
+        self.chars = chars
+        self.nullable = nullable
+        self.unbounded = unbounded
+        self.can_fail = can_fail
+        self.ahead = ahead
+
+
+def _atoms(subpattern, issues, in_repeat):
+    """=ru= Последовательность элементов (группы раскрываются), вложенные повторы сразу в issues"""
+    atoms = []
+    for op, av in subpattern:
+        chars = _charset(op, av)
+        if chars is not None:
+            atoms.append(_Atom(chars, False, False, True))
+        elif op in _REPEATS:
+            low, high, item = av
+            unbounded = high == sre_constants.MAXREPEAT
+            inner = _sequence(item, issues, in_repeat or unbounded)
+            if unbounded and _ambiguous_body(inner):
+                issues.append("nested unbounded quantifiers: exponential backtracking")
+            chars = frozenset().union(*(atom.chars for atom in inner)) if inner else frozenset()
+            nullable = low == 0 or all(atom.nullable for atom in inner)
+            atoms.append(_Atom(chars, nullable, unbounded or any(atom.unbounded for atom in inner), not nullable))
+        elif op == sre_constants.SUBPATTERN:
+            atoms.extend(_atoms(av[-1], issues, in_repeat))
+        elif op == sre_constants.BRANCH:
+            branches = [_sequence(branch, issues, in_repeat) for branch in av[1]]
+            chars = frozenset().union(*(atom.chars for branch in branches for atom in branch))
+            nullable = any(all(atom.nullable for atom in branch) for branch in branches)
+            unbounded = any(atom.unbounded for branch in branches for atom in branch)
+            if in_repeat and _overlapping_branches(branches):
+                issues.append("overlapping alternatives inside a repeat: exponential backtracking")
+            atoms.append(_Atom(chars, nullable, unbounded, not nullable))
+        elif op in (sre_constants.ASSERT, sre_constants.ASSERT_NOT):
+            inner = _sequence(av[1], issues, in_repeat)
+            ahead = None
+            if op == sre_constants.ASSERT and av[0] == 1: # (?=...)
+                ahead = _first_chars(inner)
+            atoms.append(_Atom(frozenset(), True, False, True, ahead)) # проверка без символов, но может не совпасть
+        elif op == sre_constants.AT:
+            atoms.append(_Atom(frozenset(), True, False, True))
+        else: # ссылки на группы и прочее - считаем, что может быть что угодно
+            atoms.append(_Atom(_UNIVERSE, True, True, True))
+    return atoms
+
+
+def _ambiguous_body(inner):
+    """=ru= Тело повтора - неограниченный повтор и то, что он сам может поглотить, как в (a+)+"""
+    repeats = [atom for atom in inner if atom.unbounded]
+    if not repeats:
+        return False
+    chars = frozenset().union(*(atom.chars for atom in repeats))
+    return all(atom.nullable or atom.unbounded or atom.chars <= chars for atom in inner)
+
+
+def _first_chars(atoms):
+    """=ru= Символы, с которых начинается непустое совпадение последовательности (None - может быть пустым)"""
+    first = set()
+    for atom in atoms:
+        first |= atom.chars
+        if not atom.nullable:
+            return frozenset(first)
+    return None
+
+
+def _overlapping_branches(branches):
+    """=ru= Две альтернативы могут начаться с одного символа, как в (a|ab)*"""
+    seen = set()
+    for branch in branches:
+        first = set()
+        for atom in branch:
+            first |= atom.chars
+            if not atom.nullable:
+                break
+        if seen & first:
+            return True
+        seen |= first
+    return False
+
+
+def _sequence(subpattern, issues, in_repeat):
+    atoms = _atoms(subpattern, issues, in_repeat)
+    _check_overlaps(atoms, issues)
+    return atoms
+
+
+def _check_overlaps(atoms, issues):
+    for i, first in enumerate(atoms):
+        if not first.unbounded or not first.chars:
+            continue
+        degree = 1
+        last = i
+        for j in range(i + 1, len(atoms)):
+            atom = atoms[j]
+            if atom.unbounded and atom.chars & first.chars:
+                degree += 1
+                last = j
+            elif not atom.nullable and not atom.chars & first.chars:
+                break # обязательный символ, которого нет в первом повторе, - граница без перебора
+            elif atom.ahead is not None and not atom.ahead & first.chars:
+                break # (?=...) требует символ, которого нет в первом повторе, - тоже граница
+        if degree >= 2 and any(atom.can_fail for atom in atoms[last + 1:]):
+            issues.append("%d overlapping unbounded quantifiers: polynomial backtracking O(n^%d) per start" % (degree, degree))
+            return
+
+
+@functools.lru_cache(maxsize=None)
+def audit_pattern(pattern):
+    """=ru= Кортеж описаний опасных мест шаблона (пустой - шаблон безопасен)"""
+    issues = []
+    try:
+        _sequence(sre_parse.parse(pattern, re.ASCII), issues, False)
+    except Exception as e:
+        issues.append("not checked: %s" % e)
+    return tuple(dict.fromkeys(issues))
+
+
+def audit_rules(rules):
+    """=ru= [(номер правила, шаблон, описание)] для опасных правил таблицы"""
+    return [(number, rule[0], issue) for number, rule in enumerate(rules) for issue in audit_pattern(rule[0])]
+
+
+# =ru= Предел взят по худшему случаю правила if/while (время растет примерно как куб длины):
+# =ru= "if(x=" подряд - 0.4 мс на 300 символов, 1.4 мс на 500 и 9 мс на 1000 при budget 5 мс
+RISKY_RULE_MAX_CHARS = 300 # =ru= длиннее - вместо опасного правила его замена из FALLBACK_RULES
+RISKY_RULE_MIN_CHARS = 100 # =ru= ниже этого предел не опускается
+
+
+class RuleGuard:
+    """
+    =ru= Ограничение работы опасных правил (см. audit_pattern). Прервать re посреди поиска нельзя,
+    поэтому ограничивается длина строки, а не время: на строке длиннее предела правило заменяется
+    дешевым из FALLBACK_RULES (или пропускается, если замены нет). Медленный проход не прерывается,
+    он только замеряется задним числом: если он дольше budget секунд, то предел для этого правила
+    опускается до половины длины строки, а report(сообщение) сообщает, какое правило сработало на
+    какой строке.
+    """
+
+    def __init__(self, budget, report=None, max_chars=RISKY_RULE_MAX_CHARS):
+        self.lock = threading.Lock()
+        self.budget = budget
+        self.report = report
+        self.max_chars = max_chars
+        self.limits = {} # (сканер, номер прохода): предел длины строки
+
+    def limit(self, scanner, index):
+        return self.limits.get((scanner.name, index), self.max_chars)
+
+    def check(self, scanner, index, text, seconds):
+        if seconds <= self.budget:
+            return
+        key = (scanner.name, index)
+        with self.lock:
+            limit = max(RISKY_RULE_MIN_CHARS, min(self.limits.get(key, self.max_chars), len(text) // 2))
+            self.limits[key] = limit
+        if self.report is not None:
+            self.report("rule guard: %s %s took %.1f ms on a line of %d chars, fallback from %d chars: %r" % (
+                scanner.name, scanner.pass_names[index], seconds * 1000, len(text), limit, text[:80]))
+
+
+class RuleScanner:
+    """
+    =ru= Компилятор таблицы правил.
+    Правила одного слоя сливаются в одну альтернативу (более приоритетные идут первыми),
+    остальные правила остаются отдельными проходами, но пропускаются, если в строке нет
+    их обязательных подстрок. Результат scan() совпадает с последовательным применением
+    правил: каждое правило ищется так же, как globalMatch, а отрезки возвращаются в порядке
+    приоритета правил, так что более поздний setFormat перекрывает более ранний.
+    Шаблоны компилируются с re.ASCII, чтобы \\b, \\w, \\d работали как в QRegularExpression.
+    """
+
+    def __init__(self, rules, lang=None, name=""):
+        # rules - список (шаблон, формат, обязательные подстроки, слой, языки),
+        # lang - если задан, берутся только правила этого языка (lexer.LANG_*)
+        selected = [(number, rule) for number, rule in enumerate(rules) if lang is None or lang in rule[4]]
+        self.rules = [rule[:4] for number, rule in selected]
+        self.name = name # для профиля (RuleProfile)
+        self.profile = None # RuleProfile, если включено профилирование
+        self.guard = None # RuleGuard, если работа опасных правил ограничена
+        self.passes = [] # (regex, обязательные подстроки, {номер группы-обертки: (приоритет, формат, групп в правиле)})
+        self.pass_names = [] # описание прохода для профиля: номера правил в таблице и шаблоны
+        self.fallbacks = {} # номер опасного прохода (audit_pattern): дешевая замена (проход) или None
+
+        layers = {}
+        for priority, (pattern, payload, requires, layer) in enumerate(self.rules):
+            number = selected[priority][0]
+            if layer is None:
+                if audit_pattern(pattern):
+                    fallback = FALLBACK_RULES.get(pattern)
+                    self.fallbacks[len(self.passes)] = (
+                        None if fallback is None else self._compile_pass([(priority, fallback, payload)], tuple(requires)))
+                self.passes.append(self._compile_pass([(priority, pattern, payload)], tuple(requires)))
+                self.pass_names.append("#%d %s" % (number, pattern))
+            else:
+                if layer not in layers:
+                    layers[layer] = []
+                    self.passes.append(layer) # место прохода слоя - по первому правилу слоя
+                    self.pass_names.append(layer)
+                layers[layer].append((priority, pattern, payload))
+
+        for i, item in enumerate(self.passes):
+            if isinstance(item, str):
+                # в альтернативе первыми должны идти более приоритетные (более поздние) правила
+                self.passes[i] = self._compile_pass(list(reversed(layers[item])), ())
+                numbers = ", ".join("#%d" % selected[priority][0] for priority, _pattern, _payload in layers[item])
+                self.pass_names[i] = "layer %s: %s" % (item, numbers)
+                if any(audit_pattern(pattern) for _priority, pattern, _payload in layers[item]):
+                    self.fallbacks[i] = None
+
+    def bind(self, payloads):
+        """
+        =ru= Копия сканера с теми же скомпилированными проходами, в которой ключи цвета
+        заменены на payloads[ключ] (например, QTextCharFormat темы). Регулярные выражения
+        не компилируются заново, так что смена темы стоит только пересборки словарей.
+        """
+        bound = RuleScanner.__new__(RuleScanner)
+        bound.name = self.name
+        bound.profile = self.profile
+        bound.guard = self.guard
+        bound.pass_names = self.pass_names
+        bound.rules = [(pattern, payloads[key], requires, layer) for pattern, key, requires, layer in self.rules]
+        bound.passes = [self._bind_pass(item, payloads) for item in self.passes]
+        bound.fallbacks = {index: None if item is None else self._bind_pass(item, payloads)
+                           for index, item in self.fallbacks.items()}
+        return bound
+
+    @staticmethod
+    def _bind_pass(item, payloads):
+        regex, requires, wrappers = item
+        return (regex, requires, {group: (priority, payloads[key], ngroups) for group, (priority, key, ngroups) in wrappers.items()})
+
+    @staticmethod
+    def _compile_pass(members, requires):
+        """=ru= Собирает одно регулярное выражение для прохода"""
+        if len(members) == 1:
+            priority, pattern, payload = members[0]
+            regex = re.compile(pattern, re.ASCII)
+            return (regex, requires, {0: (priority, payload, regex.groups)})
+        parts = []
+        wrappers = {}
+        group = 0
+        for priority, pattern, payload in members:
+            ngroups = re.compile(pattern, re.ASCII).groups
+            group += 1
+            wrappers[group] = (priority, payload, ngroups)
+            parts.append("(" + pattern + ")")
+            group += ngroups
+        return (re.compile("|".join(parts), re.ASCII), requires, wrappers)
+
+    def scan(self, text):
+        """=ru= Возвращает список (начало, длина, формат) в порядке применения setFormat"""
+        return self.scan_until(text, None)[0]
+
+    def scan_until(self, text, deadline):
+        """
+        =ru= Как scan, но между проходами проверяет время: если time.perf_counter() дошло до
+        deadline, остальные проходы не выполняются. Возвращает (отрезки, все ли проходы выполнены).
+        """
+        spans = []
+        if not text:
+            return spans, True
+        append = spans.append
+        profile = self.profile
+        guard = self.guard
+        for index, (regex, requires, wrappers) in enumerate(self.passes):
+            if deadline is not None and time.perf_counter() >= deadline:
+                spans.sort(key=_span_priority)
+                return [(start, length, payload) for _priority, start, length, payload in spans], False
+            skip = False
+            for literal in requires:
+                if literal not in text:
+                    skip = True
+                    break
+            if skip:
+                continue
+            guarded = False
+            if guard is not None and index in self.fallbacks:
+                # опасное правило: на длинной строке - его дешевая замена, на остальных - замер времени
+                if len(text) > guard.limit(self, index):
+                    fallback = self.fallbacks[index]
+                    if fallback is None:
+                        continue
+                    regex, requires, wrappers = fallback
+                else:
+                    guarded = True
+                    guard_start = time.perf_counter()
+            if profile is not None:
+                pass_start = time.perf_counter()
+                count_before = len(spans)
+            single = wrappers.get(0)
+            for match in regex.finditer(text):
+                if single:
+                    base = 0
+                    priority, payload, ngroups = single
+                else:
+                    # lastindex - это группа-обертка сработавшей альтернативы (она закрывается последней)
+                    base = match.lastindex
+                    priority, payload, ngroups = wrappers[base]
+                if ngroups == 0: # =ru= если не указаны группы ()
+                    start, end = match.span(base)
+                    if end > start:
+                        append((priority, start, end - start, payload))
+                    continue
+                regs = match.regs
+                # как lastCapturedIndex(): номер последней сработавшей группы правила
+                lci = 0
+                for i in range(ngroups, 0, -1):
+                    if regs[base + i][0] != -1:
+                        lci = i
+                        break
+                if lci == 0:
+                    start, end = regs[base]
+                    if end > start:
+                        append((priority, start, end - start, payload))
+                else: # =ru= иначе все группы, остальные пассивные могут быть (?: )
+                    for i in range(1, lci + 1):
+                        start, end = regs[base + i]
+                        if start != -1 and end > start:
+                            append((priority, start, end - start, payload))
+            if guarded:
+                guard.check(self, index, text, time.perf_counter() - guard_start)
+            if profile is not None:
+                profile.add(self, index, len(spans) - count_before, time.perf_counter() - pass_start, text)
+        # сортировка устойчивая: внутри одного правила порядок совпадений сохраняется
+        spans.sort(key=_span_priority)
+        return [(start, length, payload) for _priority, start, length, payload in spans], True
+
+
+def _span_priority(span):
+    return span[0]
+
+
+class RuleProfile:
+    """
+    =ru= Профиль правил подсветки: для каждого прохода RuleScanner - сколько раз выполнялся,
+    сколько нашел совпадений, общее время и самая долгая строка. Правила одного слоя
+    сливаются в один проход, поэтому время слоя делится между ними только вместе.
+    Записывать могут основной и фоновый поток (дорисовка в простое), поэтому с блокировкой.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.entries = {} # (сканер, номер прохода): [описание, проходов, совпадений, время, худшее время, худшая строка]
+            self.started = time.perf_counter()
+
+    def add(self, scanner, index, matches, seconds, text):
+        key = (scanner.name, index)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                entry = self.entries[key] = [scanner.pass_names[index], 0, 0, 0.0, 0.0, ""]
+            entry[1] += 1
+            entry[2] += matches
+            entry[3] += seconds
+            if seconds > entry[4]:
+                entry[4] = seconds
+                entry[5] = text[:80]
+
+    def report(self):
+        """=ru= Список словарей по убыванию общего времени"""
+        with self.lock:
+            items = [(key, list(entry)) for key, entry in self.entries.items()]
+        rows = []
+        for (scanner_name, index), (name, scans, matches, seconds, worst, worst_text) in items:
+            rows.append({
+                "scanner": scanner_name, "pass": name, "scans": scans, "matches": matches,
+                "total_ms": seconds * 1000, "worst_ms": worst * 1000, "worst_line": worst_text,
+            })
+        rows.sort(key=lambda row: -row["total_ms"])
+        return rows
+
+    def __str__(self):
+        rows = self.report()
+        total = sum(row["total_ms"] for row in rows)
+        lines = ["rule profile: %.1f ms in rules over %.1f s" % (total, time.perf_counter() - self.started)]
+        for row in rows:
+            lines.append("%9.2f ms %7d scans %8d matches  worst %7.3f ms  %-5s %s | %r" % (
+                row["total_ms"], row["scans"], row["matches"], row["worst_ms"],
+                row["scanner"], row["pass"][:70], row["worst_line"]))
+        return "\n".join(lines)
+
+
+@functools.lru_cache(maxsize=None)
+def shared_scanners():
+    """
+    =ru= Сканеры таблиц правил, компилируются один раз на процесс: ({язык: сканер HIGHLIGHTING_RULES},
+    сканер HIGHLIGHTING_RULES_COMM). Вместо форматов в них ключи цвета - см. RuleScanner.bind.
+    """
+    names = {LANG_HTML: "html", LANG_CSS: "css", LANG_JS: "js"}
+    return ({lang: RuleScanner(HIGHLIGHTING_RULES, lang, names[lang]) for lang in ALL},
+            RuleScanner(HIGHLIGHTING_RULES_COMM, name="comm"))
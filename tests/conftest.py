@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+# Тесты модулей дополнения, которые не зависят от Qt и Anki. __init__.py дополнения
+# не выполняется: модули грузятся из пакета-заглушки _addon_test, как в benchmarks/.
+# Запуск: python -m pytest tests (tests/pytest.ini делает tests корнем, иначе pytest сам
+# импортирует __init__.py дополнения как пакет, а без Anki он не загрузится).
+import os
+import sys
+import types
+
+import pytest
+
+ADDON_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+if "_addon_test" not in sys.modules:
+    _pkg = types.ModuleType("_addon_test")
+    _pkg.__path__ = [ADDON_DIR]
+    sys.modules["_addon_test"] = _pkg
+
+from _addon_test import lexer
+
+
+def line_source(lines, base=lexer.HTML):
+    """=ru= line_source для LineIndex.refresh: состояния строк считаются лексером, как в редакторе"""
+    states = []
+    state = -1
+    for text in lines:
+        states.append(state)
+        state = lexer.tokenize(text, state, base)[1]
+    return lambda number: (lines[number], states[number], base)
+
+
+def build_index(index, text, base=lexer.HTML):
+    """=ru= Индекс по тексту целиком; возвращает его и список строк (для правок в тестах)"""
+    lines = text.split("\n")
+    index.reset(len(lines))
+    index.refresh(line_source(lines, base))
+    return index, lines
+
+
+@pytest.fixture
+def build():
+    return build_index
+
+
+@pytest.fixture
+def source():
+    return line_source
@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+# Парные скобки (brackets.BracketIndex) и правки строк индекса.
+from _addon_test.brackets import BracketIndex
+
+
+def test_brackets_pairs(build):
+    index, _lines = build(BracketIndex(), "<script>\nf(a[1], {b: 2});\n</script>")
+    assert index.find(1, 1) == (1, 14)
+    assert index.find(1, 14) == (1, 1)
+    assert index.find(1, 3) == (1, 5)
+    assert index.find(1, 8) == (1, 13)
+    assert index.find(0, 0) == (0, 7) # < и > тега
+    assert index.find(1, 0) is None
+
+
+def test_brackets_skip_strings_comments_and_comparisons(build):
+    text = '<script>\nif (a < b) { s = "(" } // )\n</script>'
+    index, _lines = build(BracketIndex(), text)
+    assert index.find(1, 3) == (1, 9)
+    assert index.find(1, 11) == (1, 21)
+    assert (1, 5) not in index.pairs # < в JS - сравнение
+    assert (1, 18) not in index.pairs
+
+
+def test_brackets_splice(build, source):
+    index, lines = build(BracketIndex(), "<style>\na {\n}\n</style>")
+    assert index.find(1, 2) == (2, 0)
+    lines[2:2] = ["  color: red;", "  b: c;"]
+    index.splice(2, 0, 2)
+    index.refresh(source(lines))
+    assert index.find(1, 2) == (4, 0)
+
+
+def test_brackets_invalidate(build, source):
+    index, lines = build(BracketIndex(), "<script>\nf(a,\n  b);\n</script>")
+    assert index.find(1, 1) == (2, 3)
+    lines[2] = "  b];"
+    index.invalidate(2)
+    assert index.stale
+    assert index.refresh(source(lines)) == 1 # заново разбирается только измененная строка
+    assert index.find(1, 1) is None
+    assert index.refresh(source(lines)) == 0 # не stale - ничего не делает
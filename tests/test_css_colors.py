@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+# Цветовые функции CSS (css_colors.parse_color_function).
+import pytest
+
+from _addon_test.css_colors import parse_color_function
+
+
+@pytest.mark.parametrize("text, color", [
+    ("rgb(255, 0, 0)", "#ff0000"),
+    ("RGB(100%,0%,0%)", "#ff0000"),
+    ("rgb(10%, 20, 30)", "#1a141e"),
+    ("rgb(300,0,0)", "#ff0000"), # каналы обрезаются до 0..255
+    ("rgba(255,0,0,0.5)", "#80ff0000"),
+    ("rgba(0,0,0,2)", "#000000"), # непрозрачный - без альфы
+    ("rgb(255 0 0 / 50%)", "#80ff0000"),
+    ("rgb(0 0 0 / 0)", "#00000000"),
+    ("hsl(120, 100%, 50%)", "#00ff00"),
+    ("hsl(180deg 100% 50%)", "#00ffff"),
+    ("hsl(0.5turn, 100%, 50%)", "#00ffff"),
+    ("hsl(-120, 100%, 50%)", "#0000ff"),
+    ("hsla(120, 100%, 50%, 50%)", "#8000ff00"),
+    ("hsl(120 100% 50% / .25)", "#4000ff00"),
+    ("hwb(0 0% 0%)", "#ff0000"),
+    ("hwb(0 60% 60%)", "#808080"), # белизна и чернота больше 100% - серый
+])
+def test_parse(text, color):
+    assert parse_color_function(text) == color
+
+
+@pytest.mark.parametrize("text", [
+    "rgb()",
+    "rgb(1,2)",
+    "rgb(1,2,3,)",
+    "rgb(1, 2 3)",
+    "rgb(1 2 3",
+    "rgb(a,b,c)",
+    "rgb(0, 0, 0) tail",
+    "rgb(0 0 0 / 50% / 1)",
+    "rgb(1, 2, 3 / 1)",
+    "hwb(120 0% 0% 1)",
+    "hwb(0, 0%, 0%)", # hwb() бывает только через пробелы
+    "hwb(0, 0%, 0%, 0.5)",
+    "red",
+])
+def test_invalid(text):
+    assert parse_color_function(text) is None
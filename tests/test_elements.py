@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+# Дерево элементов (elements.py) и правки строк индекса (brackets.LineIndex).
+import time
+
+from _addon_test.brackets import LineIndex
+from _addon_test.elements import ElementIndex
+
+
+def elements(index):
+    return [(element.name, element.start, element.end) for element in index.elements]
+
+
+def test_implied_end_of_list_items(build):
+    index, _lines = build(ElementIndex(), "<ul><li>a<li>b</ul>")
+    assert elements(index) == [("ul", (0, 0), (0, 19)), ("li", (0, 4), (0, 9)), ("li", (0, 9), (0, 14))]
+    ul = index.elements[0]
+    assert [child.name for child in ul.children] == ["li", "li"]
+    assert index.unclosed() == []
+    assert index.pair_tag(0, 0) == (0, 14, 4)
+    assert index.pair_tag(0, 4) is None # у <li> нет закрывающего, но он и не нужен
+
+
+def test_implied_end_of_paragraphs(build):
+    index, _lines = build(ElementIndex(), "<div><p>one<p>two</div>")
+    div = index.elements[0]
+    assert [child.name for child in div.children] == ["p", "p"]
+    assert index.unclosed() == []
+
+
+def test_stray_closing_tag(build):
+    index, _lines = build(ElementIndex(), "<p>x</em></p>")
+    assert index.strays == [(0, 4, "em")]
+    assert index.unclosed() == [(0, 4, 4)]
+    assert index.pair_tag(0, 4) is None
+    assert index.pair_tag(0, 0) == (0, 9, 3)
+
+
+def test_misnested_tags(build):
+    index, _lines = build(ElementIndex(), "<b><i>bold</b></i>")
+    b, i = index.elements
+    assert i.parent is b
+    assert i.end == (0, 10) # закончился перед </b>
+    assert index.unclosed() == [(0, 3, 2), (0, 14, 3)]
+
+
+def test_void_and_self_closing(build):
+    index, _lines = build(ElementIndex(), '<img src="a>b"/><br><div/><b>x</b>')
+    img, br, div, b = index.elements
+    assert img.void and img.open_end == (0, 15) and img.end == (0, 16)
+    assert br.void and br.end == (0, 20)
+    assert div.void and div.parent is None
+    assert b.parent is None and b.close == (0, 30)
+    assert index.pair_tag(0, 0) == (0, 15, 1)
+    assert index.unclosed() == []
+
+
+def test_tags_in_comments_and_strings(build):
+    text = '<!-- <b> --><i title="<u>" onclick="f(\'</i>\')">x</i><script>var s = "<em>"; if (a<b) {}</script>'
+    index, _lines = build(ElementIndex(), text)
+    assert [element.name for element in index.elements] == ["i", "script"]
+    assert index.strays == []
+    assert index.unclosed() == []
+
+
+def test_tags_in_style_attribute_and_style_body(build):
+    index, _lines = build(ElementIndex(), '<p style="content: \'<b>\'">x</p><style>a > b { }</style>')
+    assert [element.name for element in index.elements] == ["p", "style"]
+    assert index.unclosed() == []
+
+
+def test_unclosed_and_unfinished_tags(build):
+    index, _lines = build(ElementIndex(), "<div><span>x\n<section")
+    assert [element.name for element in index.elements] == ["div", "span", "section"]
+    assert index.unclosed() == [(0, 0, 4), (0, 5, 5), (1, 0, 8)]
+    assert index.elements[0].end == (1, 8) # незакрытые заканчиваются в конце документа
+
+
+def test_multiline_open_tag(build):
+    index, _lines = build(ElementIndex(), '<div\n  class="a">\n<span>x</span>\n</div>')
+    div, span = index.elements
+    assert div.open_end == (1, 11)
+    assert div.close == (3, 0)
+    assert span.parent is div
+    assert index.pair_tag(3, 0) == (0, 0, 4)
+    assert index.pair_tag(3, 3) == (0, 0, 4) # курсор в имени закрывающего тега
+
+
+def test_enclosing_walks_up(build):
+    index, _lines = build(ElementIndex(), "<div><p>a<b>c</b></p></div>")
+    div, p, b = index.elements
+    assert index.enclosing((0, 12), (0, 13)) is b
+    assert index.enclosing(b.start, b.end) is p
+    assert index.enclosing(p.start, p.end) is div
+    assert index.enclosing(div.start, div.end) is None
+    assert index.enclosing((0, 8), (0, 9)) is p
+
+
+def test_splice_then_query(build, source):
+    index, lines = build(ElementIndex(), "<div>\n<p>a</p>\n</div>")
+    assert index.pair_tag(0, 0) == (2, 0, 5)
+
+    lines[1:1] = ["<ul>", "<li>x</li>", "</ul>"]
+    index.splice(1, 0, 3)
+    assert index.stale
+    index.refresh(source(lines))
+    assert not index.stale
+    assert index.pair_tag(0, 0) == (5, 0, 5)
+    assert index.pair_tag(1, 0) == (3, 0, 4)
+    ul = index.enclosing((2, 4), (2, 5)).parent
+    assert ul.name == "ul" and ul.parent.name == "div"
+
+    del lines[1:4]
+    index.splice(1, 3, 0)
+    index.refresh(source(lines))
+    assert index.pair_tag(2, 0) == (0, 0, 4)
+    assert index.enclosing((1, 3), (1, 4)).name == "p"
+
+
+def test_invalidate_then_query(build, source):
+    index, lines = build(ElementIndex(), "<div>\n<p>a</p>\n</div>")
+    lines[2] = "</section>"
+    index.invalidate(2)
+    assert index.stale
+    assert index.refresh(source(lines)) == 1 # заново разбирается только измененная строка
+    assert index.pair_tag(0, 0) is None
+    assert index.strays == [(2, 0, "section")]
+    assert index.unclosed() == [(0, 0, 4), (2, 0, 9)]
+
+
+def test_multiline_state_after_splice(build, source):
+    index, lines = build(ElementIndex(), "<b>x</b>\n<i>y</i>")
+    lines.insert(0, "<!--")
+    index.splice(0, 0, 1)
+    # состояние первой строки изменилось, редактор перекрашивает и следующие
+    lines.insert(3, "-->")
+    index.splice(3, 0, 1)
+    for number in (1, 2):
+        index.invalidate(number)
+    index.refresh(source(lines))
+    assert index.elements == []
+
+
+def test_refresh_with_deadline_continues(build, source):
+    text = "\n".join("<div><p>%d</p>" % n for n in range(50)) + "\n" + "</div>" * 50
+    full, lines = build(ElementIndex(), text)
+
+    sliced = ElementIndex()
+    sliced.reset(len(lines))
+    calls = 0
+    while sliced.stale:
+        assert sliced.refresh(source(lines), deadline=time.perf_counter()) >= 1
+        calls += 1
+    assert calls == len(lines)
+    assert elements(sliced) == elements(full)
+    assert sliced.unclosed() == full.unclosed()
+
+
+def test_line_index_refresh_only_none_lines(source):
+    class Counting(LineIndex):
+        def __init__(self):
+            super().__init__()
+            self.parsed = []
+            self.builds = 0
+
+        def parse_line(self, text, tokens):
+            self.parsed.append(text)
+            return text
+
+        def build(self):
+            self.builds += 1
+
+    lines = ["a", "b", "c"]
+    index = Counting()
+    index.reset(3)
+    assert index.refresh(source(lines)) == 3
+    assert index.refresh(source(lines)) == 0 # не stale - ничего не делает
+    lines[1] = "B"
+    index.invalidate(1)
+    index.invalidate(7) # вне документа - игнорируется
+    assert index.refresh(source(lines)) == 1
+    assert index.parsed == ["a", "b", "c", "B"]
+    assert index.lines == ["a", "B", "c"]
+    assert index.builds == 2
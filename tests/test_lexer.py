@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+# Лексер (lexer.py): токены строки и состояние между строками.
+from _addon_test import lexer
+from _addon_test.lexer import LANG_CSS, LANG_HTML, LANG_JS, TOKEN_CODE, TOKEN_COMMENT, TOKEN_STRING
+
+
+def pieces(text, state=-1, base=lexer.HTML):
+    """=ru= (текст токена, вид, язык) и стек контекстов следующей строки"""
+    tokens, state = lexer.tokenize(text, state, base)
+    return [(text[start:end], kind, lang) for start, end, kind, lang in tokens], lexer.decode_state(state)
+
+
+def tokenize_lines(lines, base=lexer.HTML):
+    state = -1
+    result = []
+    for text in lines:
+        tokens, state = lexer.tokenize(text, state, base)
+        result.append(tokens)
+    return result, state
+
+
+def test_tag_attribute_and_comment():
+    assert pieces('<a href="x">t</a> <!-- c -->') == ([
+        ('<a href=', TOKEN_CODE, LANG_HTML),
+        ('"x"', TOKEN_STRING, LANG_HTML),
+        ('>t</a> ', TOKEN_CODE, LANG_HTML),
+        ('<!-- c -->', TOKEN_COMMENT, LANG_HTML),
+    ], (lexer.HTML,))
+
+
+def test_comment_continues_on_next_line():
+    first, stack = pieces("<!-- a")
+    assert first == [("<!-- a", TOKEN_COMMENT, LANG_HTML)]
+    assert stack == (lexer.HTML, lexer.HTML_COMMENT)
+    tokens, state = lexer.tokenize("<!-- a")
+    assert pieces("b --> <b>", state) == ([
+        ("b -->", TOKEN_COMMENT, LANG_HTML),
+        (" <b>", TOKEN_CODE, LANG_HTML),
+    ], (lexer.HTML,))
+
+
+def test_style_body_is_css():
+    (_style, a, b, end), state = tokenize_lines(["<style>", "a { color: red; } /* c", "d */ b { }", "</style><p>"])
+    assert lexer.decode_state(state) == (lexer.HTML,)
+    assert [(kind, lang) for _start, _end, kind, lang in a] == [(TOKEN_CODE, LANG_CSS), (TOKEN_COMMENT, LANG_CSS)]
+    assert [(kind, lang) for _start, _end, kind, lang in b] == [(TOKEN_COMMENT, LANG_CSS), (TOKEN_CODE, LANG_CSS)]
+    assert end == [(0, 11, TOKEN_CODE, LANG_HTML)]
+
+
+def test_script_strings_comments_regex_and_templates():
+    tokens, stack = pieces('<script>var s = "a<b", t = \'q\'; // x')
+    assert tokens == [
+        ("<script>", TOKEN_CODE, LANG_HTML),
+        ("var s = ", TOKEN_CODE, LANG_JS),
+        ('"a<b"', TOKEN_STRING, LANG_JS),
+        (", t = ", TOKEN_CODE, LANG_JS),
+        ("'q'", TOKEN_STRING, LANG_JS),
+        ("; ", TOKEN_CODE, LANG_JS),
+        ("// x", TOKEN_COMMENT, LANG_JS),
+    ]
+    assert stack == (lexer.HTML, lexer.JS)
+
+    state = lexer.tokenize("<script>")[1]
+    tokens, _stack = pieces('r = /a\\/b/g; `t ${x + "y"} z`;', state)
+    assert tokens == [
+        ("r = ", TOKEN_CODE, LANG_JS),
+        ("/a\\/b/g", TOKEN_STRING, LANG_JS),
+        ("; ", TOKEN_CODE, LANG_JS),
+        ("`t ", TOKEN_STRING, LANG_JS),
+        ("${x + ", TOKEN_CODE, LANG_JS),
+        ('"y"', TOKEN_STRING, LANG_JS),
+        ("}", TOKEN_CODE, LANG_JS),
+        (" z`", TOKEN_STRING, LANG_JS),
+        (";", TOKEN_CODE, LANG_JS),
+    ]
+
+
+def test_template_expression_across_lines():
+    (_script, first, second), state = tokenize_lines(["<script>", "var t = `a ${b", "} c`;"])
+    assert first[-1][2] == TOKEN_CODE # ${b - код внутри шаблонной строки
+    assert [kind for _start, _end, kind, _lang in second] == [TOKEN_CODE, TOKEN_STRING, TOKEN_CODE]
+    assert lexer.decode_state(state) == (lexer.HTML, lexer.JS)
+
+
+def test_closing_script_tag_inside_string():
+    tokens, stack = pieces('<script>a = "</script>" + 1')
+    assert tokens[-1] == ('</script>" + 1', TOKEN_CODE, LANG_HTML)
+    assert stack == (lexer.HTML,)
+
+
+def test_style_and_event_attributes():
+    tokens, _stack = pieces('<p style="color: red; content: \'x\'" onclick="f(\'a\')" class="c">')
+    assert tokens == [
+        ('<p style="', TOKEN_CODE, LANG_HTML),
+        ("color: red; content: ", TOKEN_CODE, LANG_CSS),
+        ("'x'", TOKEN_STRING, LANG_CSS),
+        ('" onclick="', TOKEN_CODE, LANG_HTML),
+        ("f(", TOKEN_CODE, LANG_JS),
+        ("'a'", TOKEN_STRING, LANG_JS),
+        (")", TOKEN_CODE, LANG_JS),
+        ('" class="c">', TOKEN_CODE, LANG_HTML),
+    ]
+
+
+def test_css_base():
+    tokens, stack = pieces('a { color: "x" }', base=lexer.CSS)
+    assert tokens == [("a { color: ", TOKEN_CODE, LANG_CSS), ('"x"', TOKEN_STRING, LANG_CSS), (" }", TOKEN_CODE, LANG_CSS)]
+    assert stack == (lexer.CSS,)
+
+
+def test_tokens_cover_line():
+    lines = [
+        '<div class="card" style="color: red" onclick="go(\'x\')">{{Front}}<!-- a',
+        'b --><script>if (a < b) { s = `x ${y}`; } /* c',
+        'd */</script><style>a > b { content: "}" }</style>',
+        "",
+    ]
+    all_tokens, _state = tokenize_lines(lines)
+    for text, tokens in zip(lines, all_tokens):
+        position = 0
+        for start, end, kind, lang in tokens:
+            assert start == position and end > start
+            position = end
+        assert position == len(text)
+        for left, right in zip(tokens, tokens[1:]): # соседние одного вида и языка слиты
+            assert left[2:] != right[2:]
+
+
+def test_token_kinds():
+    text = '<a b="c"> "d" <!-- e -->'
+    tokens, _state = lexer.tokenize(text)
+    assert lexer.token_kinds(tokens, len(text)) == bytes((0,) * 5 + (1,) * 3 + (0,) * 6 + (2,) * 10)
+
+
+def test_decode_state():
+    assert lexer.decode_state(-1) == (lexer.HTML,)
+    assert lexer.decode_state(-1, lexer.CSS) == (lexer.CSS,)
+    stack = (lexer.HTML, lexer.JS, lexer.BLOCK_COMMENT)
+    assert lexer.decode_state(lexer.encode_state(stack)) == stack
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+# Сведение отрезков подсветки (spans.coalesce_spans) и файл кэша отрезков.
+import os
+import random
+import threading
+
+import pytest
+
+from _addon_test import spans
+from _addon_test.spans import coalesce_spans, coalesce_spans_by_chars, read_span_file, write_span_file
+
+RED = object()
+BLUE = object()
+GREEN = object()
+
+
+@pytest.fixture(params=["chars", "sweep"])
+def branch(request, monkeypatch):
+    """=ru= Оба способа сведения: по символам и проходом по границам"""
+    monkeypatch.setattr(spans, "COALESCE_CHARS_PER_SPAN", 10 ** 9 if request.param == "chars" else 0)
+    return request.param
+
+
+def test_later_span_wins(branch):
+    assert coalesce_spans([(0, 10, RED), (3, 4, BLUE)], 10) == [(0, 3, RED), (3, 4, BLUE), (7, 3, RED)]
+    assert coalesce_spans([(3, 4, BLUE), (0, 10, RED)], 10) == [(0, 10, RED)]
+
+
+def test_same_format_merges(branch):
+    assert coalesce_spans([(0, 3, RED), (3, 3, RED), (8, 2, RED)], 12) == [(0, 6, RED), (8, 2, RED)]
+    assert coalesce_spans([(0, 5, RED), (2, 2, RED), (5, 2, BLUE)], 7) == [(0, 5, RED), (5, 2, BLUE)]
+
+
+def test_gaps_and_clipping(branch):
+    assert coalesce_spans([(2, 2, RED), (6, 10, BLUE), (20, 3, GREEN), (5, 0, GREEN)], 10) == [
+        (2, 2, RED), (6, 4, BLUE)]
+
+
+def test_nested_spans_restore_outer(branch):
+    result = coalesce_spans([(0, 20, RED), (2, 16, BLUE), (4, 2, GREEN), (10, 2, RED)], 20)
+    assert result == [(0, 2, RED), (2, 2, BLUE), (4, 2, GREEN), (6, 4, BLUE), (10, 2, RED),
+                      (12, 6, BLUE), (18, 2, RED)]
+
+
+def test_single_span_unchanged():
+    single = [(0, 50, RED)]
+    assert coalesce_spans(single, 10) is single
+    assert coalesce_spans([], 10) == []
+
+
+def test_sweep_matches_chars(monkeypatch):
+    monkeypatch.setattr(spans, "COALESCE_CHARS_PER_SPAN", 0)
+    formats = [object() for _ in range(5)]
+    generator = random.Random(7)
+    for _ in range(300):
+        length = generator.randint(1, 400)
+        items = [(generator.randint(0, length), generator.randint(0, 60), generator.choice(formats))
+                 for _ in range(generator.randint(2, 30))]
+        assert coalesce_spans(items, length) == coalesce_spans_by_chars(items, length)
+
+
+def test_long_line_uses_sweep(monkeypatch):
+    def fail(*args):
+        raise AssertionError("coalesce_spans_by_chars on a long line")
+
+    monkeypatch.setattr(spans, "coalesce_spans_by_chars", fail)
+    assert coalesce_spans([(0, 5, RED), (10 ** 6, 5, BLUE)], 10 ** 6 + 5) == [(0, 5, RED), (10 ** 6, 5, BLUE)]
+
+
+RECORDS = [
+    (("<div>", -1, 1, "dark"), 0, [(0, 5, "tag"), (1, 3, "name")], False),
+    (('a = "x";', 4, 1, "dark"), 4, [(4, 3, "string")], True),
+    (("", 0, 2, "light"), 7, [], False),
+    (("цвет: red", 2, 2, "light"), 2, [(0, 4, "name"), (6, 3, "#ff0000")], False),
+]
+
+
+def test_span_file_round_trip(tmp_path):
+    path = str(tmp_path / "cache" / "spans.bin")
+    size = write_span_file(path, "1.2", RECORDS)
+    assert size == (tmp_path / "cache" / "spans.bin").stat().st_size
+    assert sorted(os.listdir(str(tmp_path / "cache"))) == ["spans.bin"] # временный файл не остается
+    assert read_span_file(path, "1.2") == RECORDS
+
+
+def test_span_file_other_version(tmp_path):
+    path = str(tmp_path / "spans.bin")
+    write_span_file(path, "1.2", RECORDS)
+    assert read_span_file(path, "1.3") == []
+    assert read_span_file(str(tmp_path / "missing.bin"), "1.2") == []
+
+
+def test_span_file_replaced(tmp_path):
+    path = str(tmp_path / "spans.bin")
+    write_span_file(path, "1.2", RECORDS)
+    write_span_file(path, "1.2", RECORDS[:1])
+    assert read_span_file(path, "1.2") == RECORDS[:1]
+
+
+def test_span_file_parallel_saves(tmp_path):
+    path = str(tmp_path / "spans.bin")
+    versions = [RECORDS[:n] for n in range(1, len(RECORDS) + 1)] * 5
+    threads = [threading.Thread(target=write_span_file, args=(path, "1.2", records)) for records in versions]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert read_span_file(path, "1.2") in versions # файл целиком от одной из записей
+    assert os.listdir(str(tmp_path)) == ["spans.bin"]
+
+
+def test_span_file_failed_write(tmp_path, monkeypatch):
+    path = str(tmp_path / "spans.bin")
+    write_span_file(path, "1.2", RECORDS)
+
+    def fail(source, target):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(os, "replace", fail)
+    with pytest.raises(OSError):
+        write_span_file(path, "1.2", RECORDS[:1])
+    monkeypatch.undo()
+    assert os.listdir(str(tmp_path)) == ["spans.bin"]
+    assert read_span_file(path, "1.2") == RECORDS